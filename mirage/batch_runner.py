@@ -0,0 +1,529 @@
+#! /usr/bin/env python
+
+"""Run the simulations described by a collection of yaml files, such as
+those produced by ``yaml_generator.SimInput``, across a pool of local
+processes.
+
+Each yaml file is one job. Imaging (and moving target) yaml files are
+run with ``ImgSim`` and WFSS yaml files with ``WFSSSim``. Jobs are
+started only while their estimated memory use fits within the memory
+limit, failed jobs are retried, and every finished job is appended to a
+journal file. Re-running with the same journal skips the jobs that have
+already completed, so an interrupted batch can be resumed.
+
+Authors
+-------
+    - Bryan Hilbert
+
+Use
+---
+    ::
+
+        from mirage.batch_runner import BatchRunner
+        runner = BatchRunner('yaml_files/', processes=4, retries=1)
+        runner.run()
+        print(runner.summary)
+
+    or from the command line:
+
+    ::
+
+        python batch_runner.py yaml_files/ --processes 4
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import glob
+import json
+import os
+import time
+import traceback
+from types import SimpleNamespace
+
+from astropy.io import ascii
+from astropy.table import Table
+import numpy as np
+import yaml
+
+from .utils import siaf_interface
+from .utils.constants import grism_factor
+
+# Memory used by a job in addition to its arrays: the interpreter,
+# imported packages, PSF libraries and reference file headers
+BASE_JOB_MEMORY = 1.e9
+
+# Number of full-resolution copies of a single integration (dark ramp,
+# linearized dark and simulated ramp) held at once by the dark prep and
+# observation generator steps, and the number of seed image sized arrays
+# (seed image, segmentation map, dispersed seed)
+RAMP_COPIES = 3
+SEED_COPIES = 3
+
+# Default name of the journal file placed in the yaml directory
+JOURNAL_FILENAME = 'mirage_batch_journal.jsonl'
+
+READPATT_DEFINITION_FILES = {'nircam': 'nircam_read_pattern_definitions.list',
+                             'niriss': 'niriss_readout_pattern.txt',
+                             'fgs': 'guider_readout_pattern.txt'}
+
+
+class BatchRunner():
+    def __init__(self, yaml_files, processes=None, max_memory=None, retries=1, journal_file=None,
+                 summary_file=None, offline=False):
+        """Run the simulations described by yaml files in parallel
+
+        Parameters
+        ----------
+        yaml_files : str or list
+            Directory containing the yaml files, a single yaml file, or a
+            list of yaml files
+
+        processes : int
+            Maximum number of simulations to run at once. If None, the
+            number of CPUs is used.
+
+        max_memory : float
+            Total memory, in bytes, that the running jobs may use. Jobs are
+            started only while the sum of their estimated memory fits within
+            this limit, although at least one job always runs. If None, the
+            physical memory of the machine is used.
+
+        retries : int
+            Number of times a failed job is run again before it is recorded
+            as failed. If a worker process dies (e.g. it is killed for using
+            too much memory), every job running in the pool at that time is
+            counted as failed, and uses up one of its retries, including
+            jobs that did not cause the failure.
+
+        journal_file : str
+            JSON lines file recording each finished job. Jobs recorded as
+            complete whose outputs still exist are skipped. If None, the
+            journal is placed in the directory of the first yaml file.
+
+        summary_file : str
+            If given, the per-job timing summary is saved to this ascii file
+
+        offline : bool
+            If True, the check for the existence of the MIRAGE_DATA
+            directory is skipped
+        """
+        self.yaml_files = find_yaml_files(yaml_files)
+        if len(self.yaml_files) == 0:
+            raise ValueError('No yaml files found in {}'.format(yaml_files))
+
+        self.processes = processes
+        if self.processes is None:
+            self.processes = os.cpu_count() or 1
+        self.max_memory = max_memory
+        if self.max_memory is None:
+            self.max_memory = physical_memory()
+        self.retries = retries
+        self.journal_file = journal_file
+        if self.journal_file is None:
+            self.journal_file = os.path.join(os.path.dirname(self.yaml_files[0]), JOURNAL_FILENAME)
+        self.summary_file = summary_file
+        self.offline = offline
+        self.summary = None
+
+    def run(self):
+        """MAIN FUNCTION"""
+        completed = completed_jobs(self.journal_file)
+        jobs = []
+        skipped = []
+        for yaml_file in self.yaml_files:
+            if yaml_file in completed:
+                skipped.append(completed[yaml_file])
+                continue
+            params = read_yaml(yaml_file)
+            jobs.append(SimpleNamespace(yaml_file=yaml_file, mode=params['Inst']['mode'].lower(),
+                                        memory=estimate_memory(params), outputs=expected_outputs(params),
+                                        attempts=0, elapsed=0., error=None))
+        print('{} of {} yaml files already complete according to {}'.format(len(skipped), len(self.yaml_files),
+                                                                            self.journal_file))
+
+        # Start the largest jobs first so that the smaller ones can fill the
+        # remaining memory while they run
+        jobs.sort(key=lambda job: job.memory, reverse=True)
+        finished = self.schedule(jobs)
+
+        rows = [(entry['yaml_file'], entry['mode'], 'skipped', entry['attempts'], entry['memory'] / 1.e9,
+                 entry['elapsed']) for entry in skipped]
+        rows += [(job.yaml_file, job.mode, job.status, job.attempts, job.memory / 1.e9, job.elapsed)
+                 for job in finished]
+        self.summary = Table(rows=rows, names=('yaml_file', 'mode', 'status', 'attempts', 'memory_GB', 'elapsed_sec'),
+                             dtype=(str, str, str, int, float, float))
+        self.summary['memory_GB'].format = '.2f'
+        self.summary['elapsed_sec'].format = '.1f'
+        if self.summary_file is not None:
+            ascii.write(self.summary, self.summary_file, overwrite=True)
+            print('Timing summary saved to {}'.format(self.summary_file))
+
+        failed = [job.yaml_file for job in finished if job.status == 'failed']
+        if len(failed) > 0:
+            print('{} jobs failed. See {} for the errors.'.format(len(failed), self.journal_file))
+        return self.summary
+
+    def schedule(self, jobs):
+        """Run the jobs in a process pool, keeping the estimated memory use
+        of the running jobs within ``max_memory``
+
+        Parameters
+        ----------
+        jobs : list
+            SimpleNamespace objects describing each job
+
+        Returns
+        -------
+        finished : list
+            The input jobs, with ``status``, ``attempts`` and ``elapsed``
+            set, in the order in which they finished
+        """
+        pending = deque(jobs)
+        running = {}
+        finished = []
+        executor = ProcessPoolExecutor(max_workers=self.processes)
+        try:
+            while pending or running:
+                while pending and len(running) < self.processes:
+                    job = next_job(pending, sum(job.memory for job in running.values()), self.max_memory,
+                                   len(running) == 0)
+                    if job is None:
+                        break
+                    job.attempts += 1
+                    running[executor.submit(_run_simulation, (job.yaml_file, job.mode, self.offline))] = job
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        # A worker was killed, e.g. by the out-of-memory
+                        # killer. Every job in the pool is lost.
+                        broken = True
+                        result = SimpleNamespace(success=False, elapsed=0.,
+                                                 error='Worker process terminated abruptly')
+                    job.elapsed += result.elapsed
+                    job.error = result.error
+
+                    if result.success:
+                        job.status = 'complete'
+                    elif job.attempts <= self.retries:
+                        print('{} failed on attempt {}. Retrying.'.format(job.yaml_file, job.attempts))
+                        pending.append(job)
+                        continue
+                    else:
+                        job.status = 'failed'
+                        print('{} failed after {} attempts:\n{}'.format(job.yaml_file, job.attempts, job.error))
+                    self.write_journal(job)
+                    finished.append(job)
+
+                if broken:
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=self.processes)
+        finally:
+            executor.shutdown(wait=True)
+        return finished
+
+    def write_journal(self, job):
+        """Append a finished job to the journal file. Each entry is written
+        and flushed to disk separately so that the journal remains readable
+        if the batch is interrupted.
+
+        Parameters
+        ----------
+        job : types.SimpleNamespace
+            Finished job
+        """
+        entry = {'yaml_file': job.yaml_file, 'mode': job.mode, 'status': job.status, 'attempts': job.attempts,
+                 'memory': job.memory, 'elapsed': job.elapsed,
+                 'outputs': [filename for filename in job.outputs if os.path.isfile(filename)],
+                 'finished': datetime.now().isoformat(), 'error': job.error}
+        with open(self.journal_file, 'a') as journal:
+            journal.write(json.dumps(entry) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+
+def _run_simulation(task):
+    """Run the simulation for a single yaml file. This is the function
+    executed by the worker processes. The simulator modules are imported
+    here so that imaging-only batches do not require the WFSS dependencies.
+
+    Parameters
+    ----------
+    task : tuple
+        Name of the yaml file, observing mode, and offline flag
+
+    Returns
+    -------
+    result : types.SimpleNamespace
+        Whether the simulation succeeded, the run time in seconds, and the
+        traceback of the error if it failed
+    """
+    yaml_file, mode, offline = task
+    start = time.time()
+    try:
+        if mode == 'wfss':
+            from .wfss_simulator import WFSSSim
+            sim = WFSSSim(yaml_file, offline=offline, processes=1)
+        else:
+            from .imaging_simulator import ImgSim
+            sim = ImgSim(paramfile=yaml_file, offline=offline)
+        sim.create()
+    except Exception:
+        return SimpleNamespace(success=False, elapsed=time.time() - start, error=traceback.format_exc())
+    return SimpleNamespace(success=True, elapsed=time.time() - start, error=None)
+
+
+def add_options(parser=None, usage=None):
+    """Add the command line arguments of the batch runner to a parser"""
+    if parser is None:
+        parser = argparse.ArgumentParser(usage=usage, description="Run Mirage simulations for a set of yaml files.")
+    parser.add_argument("yaml_files", nargs='+', help='Directory of yaml files, or list of yaml files')
+    parser.add_argument("--processes", type=int, help="Number of simulations to run at once", default=None)
+    parser.add_argument("--max_memory", type=float, help="Memory limit in bytes for all running jobs", default=None)
+    parser.add_argument("--retries", type=int, help="Number of times to retry failed jobs", default=1)
+    parser.add_argument("--journal_file", help="Journal of finished jobs, used to resume the batch", default=None)
+    parser.add_argument("--summary_file", help="Output file for the per-job timing summary", default=None)
+    return parser
+
+
+def completed_jobs(journal_file):
+    """Read the journal of a previous batch and return the jobs that
+    completed and whose outputs still exist
+
+    Parameters
+    ----------
+    journal_file : str
+        JSON lines journal written by ``BatchRunner``
+
+    Returns
+    -------
+    completed : dict
+        Journal entries of the completed jobs, keyed by yaml filename
+    """
+    completed = {}
+    if not os.path.isfile(journal_file):
+        return completed
+    with open(journal_file) as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Partially written final line of an interrupted batch
+                continue
+            if entry['status'] == 'complete' and all(os.path.isfile(filename) for filename in entry['outputs']):
+                completed[entry['yaml_file']] = entry
+            else:
+                completed.pop(entry['yaml_file'], None)
+    return completed
+
+
+def estimate_memory(params):
+    """Estimate the peak memory used when simulating a yaml file, based on
+    the array size and the number of frames in each integration
+
+    Parameters
+    ----------
+    params : dict
+        Contents of the yaml file
+
+    Returns
+    -------
+    memory : float
+        Estimated memory in bytes
+    """
+    instrument = params['Inst']['instrument'].lower()
+    xdim, ydim = array_size(instrument, params['Readout']['array_name'])
+    nframe, nskip = frames_per_group(params)
+    frames = params['Readout']['ngroup'] * (nframe + nskip)
+
+    seed_pixels = xdim * ydim
+    if params['Inst']['mode'].lower() == 'wfss':
+        # Seed images for WFSS are full frame, expanded to include
+        # sources that disperse onto the detector
+        seed_pixels = (2048 * grism_factor(instrument))**2
+
+    value_bytes = np.dtype(np.float64).itemsize
+    return BASE_JOB_MEMORY + value_bytes * (RAMP_COPIES * frames * xdim * ydim + SEED_COPIES * seed_pixels)
+
+
+def array_size(instrument, array_name):
+    """Return the dimensions of an aperture, or full frame if the aperture
+    or SIAF cannot be found
+
+    Parameters
+    ----------
+    instrument : str
+        Instrument name
+
+    array_name : str
+        Aperture name, e.g. 'NRCB5_SUB160'
+
+    Returns
+    -------
+    xdim, ydim : tuple
+        Dimensions of the aperture in pixels
+    """
+    try:
+        aperture = siaf_interface.get_instance(instrument)[array_name]
+        return aperture.XSciSize, aperture.YSciSize
+    except (KeyError, ValueError, OSError):
+        return 2048, 2048
+
+
+def frames_per_group(params):
+    """Return the number of frames averaged and skipped in each group for
+    the readout pattern in a yaml file
+
+    Parameters
+    ----------
+    params : dict
+        Contents of the yaml file
+
+    Returns
+    -------
+    nframe, nskip : tuple
+        Number of averaged and skipped frames per group. (1, 0) if the
+        readout pattern is not found.
+    """
+    instrument = params['Inst']['instrument'].lower()
+    readpatt_file = params['Reffiles'].get('readpattdefs', 'config')
+    if readpatt_file.lower() == 'config':
+        readpatt_file = os.path.join(os.path.dirname(__file__), 'config', READPATT_DEFINITION_FILES[instrument])
+    readpatt_file = os.path.expandvars(readpatt_file)
+    if os.path.isfile(readpatt_file):
+        definitions = ascii.read(readpatt_file)
+        match = np.where(definitions['name'] == params['Readout']['readpatt'].upper())[0]
+        if len(match) > 0:
+            return int(definitions['nframe'][match[0]]), int(definitions['nskip'][match[0]])
+    return 1, 0
+
+
+def expected_outputs(params):
+    """List the files the simulation of a yaml file will save, following
+    the naming used by ``obs_generator``
+
+    Parameters
+    ----------
+    params : dict
+        Contents of the yaml file
+
+    Returns
+    -------
+    outputs : list
+        Full paths of the raw and/or linear ramp files
+    """
+    base_name = params['Output']['file'].split('/')[-1]
+    if base_name[-5:].lower() != '.fits':
+        base_name += '.fits'
+    directory = os.path.expandvars(params['Output']['directory'])
+
+    outputs = []
+    datatype = params['Output']['datatype'].lower()
+    if 'linear' in datatype:
+        if 'uncal' in base_name:
+            outputs.append(os.path.join(directory, base_name.replace('uncal', 'linear')))
+        else:
+            outputs.append(os.path.join(directory, base_name.replace('.fits', '_linear.fits')))
+    if 'raw' in datatype:
+        outputs.append(os.path.join(directory, base_name))
+    return [os.path.abspath(filename) for filename in outputs]
+
+
+def find_yaml_files(yaml_files):
+    """Expand the input to a sorted list of yaml files
+
+    Parameters
+    ----------
+    yaml_files : str or list
+        Directory containing yaml files, a yaml file, or a list of either
+
+    Returns
+    -------
+    found : list
+        Absolute paths of the yaml files
+    """
+    if isinstance(yaml_files, str):
+        yaml_files = [yaml_files]
+    found = []
+    for entry in yaml_files:
+        if os.path.isdir(entry):
+            found.extend(glob.glob(os.path.join(entry, '*.yaml')) + glob.glob(os.path.join(entry, '*.yml')))
+        else:
+            found.append(entry)
+    return sorted(set(os.path.abspath(filename) for filename in found))
+
+
+def next_job(pending, memory_in_use, max_memory, idle):
+    """Remove and return the first pending job that fits within the
+    remaining memory
+
+    Parameters
+    ----------
+    pending : collections.deque
+        Jobs waiting to run
+
+    memory_in_use : float
+        Estimated memory of the running jobs in bytes
+
+    max_memory : float
+        Memory limit in bytes. None for no limit.
+
+    idle : bool
+        If True, no jobs are running and the first pending job is returned
+        even if it exceeds the limit
+
+    Returns
+    -------
+    job : types.SimpleNamespace
+        Job to start, or None if no job fits
+    """
+    for job in pending:
+        if idle or max_memory is None or memory_in_use + job.memory <= max_memory:
+            pending.remove(job)
+            return job
+    return None
+
+
+def physical_memory():
+    """Return the physical memory of the machine in bytes, or None if it
+    cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def read_yaml(yaml_file):
+    """Read a simulator yaml file
+
+    Parameters
+    ----------
+    yaml_file : str
+        Name of the yaml file
+
+    Returns
+    -------
+    params : dict
+        Contents of the yaml file
+    """
+    with open(yaml_file, 'r') as infile:
+        return yaml.safe_load(infile)
+
+
+if __name__ == '__main__':
+
+    usagestring = 'USAGE: batch_runner.py yaml_directory --processes 4'
+
+    parser = add_options(usage=usagestring)
+    args = parser.parse_args()
+    runner = BatchRunner(args.yaml_files, processes=args.processes, max_memory=args.max_memory,
+                         retries=args.retries, journal_file=args.journal_file, summary_file=args.summary_file)
+    runner.run()
+    print(runner.summary)
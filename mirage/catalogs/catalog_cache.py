@@ -0,0 +1,448 @@
+#! /usr/bin/env python
+
+"""This module contains a persistent, tile-based local cache for queries of
+external source catalogs (2MASS, WISE, GAIA). The sky is divided into
+fixed RA/Dec tiles. When a region is requested, tiles already on disk are
+read back, only the missing tiles are queried from the catalog service,
+and the combined result is trimmed to the requested region. Overlapping
+pointings, and repeated runs on the same field, therefore query each part
+of the sky only once, and can be run offline once the tiles are stored.
+
+Catalog services are accessed through a ``CatalogBackend``. The default
+``RemoteCatalogBackend`` queries IRSA, the GAIA archive and VizieR using
+astroquery. Other backends (e.g. a local stand-in catalog server for
+testing) can be supplied by subclassing ``CatalogBackend``.
+
+Authors
+-------
+
+    - Bryan Hilbert
+
+Use
+---
+
+    The cache is used by the query functions in ``create_catalog`` and
+    ``get_catalog`` when it is enabled, either by setting the
+    MIRAGE_CATALOG_CACHE environment variable to a directory, or as such:
+
+    ::
+
+        from mirage.catalogs import catalog_cache
+        catalog_cache.set_catalog_cache(catalog_cache.TiledCatalogCache('/my/cache/dir'))
+
+        table = catalog_cache.get_catalog_cache().query_box('2MASS', 80.4, -69.8, 120.)
+"""
+
+import os
+
+from astropy.coordinates import SkyCoord
+from astropy.table import Table, vstack
+import astropy.units as u
+import numpy as np
+
+CATALOG_CACHE_ENV_VAR = 'MIRAGE_CATALOG_CACHE'
+
+# Default tile size, in degrees of RA and Dec
+TILE_SIZE = 0.5
+
+# IRSA catalog names
+IRSA_CATALOGS = {'2MASS': 'fp_psc', 'WISE': 'allsky_4band_p3as_psd'}
+
+# ADQL queries of the GAIA archive. Each is formatted with the RA and Dec
+# limits of the tile: ra_min, ra_max, dec_min, dec_max
+GAIA_FIELD = """(SELECT gaia.*
+            FROM gaiadr2.gaia_source AS gaia
+            WHERE gaia.ra >= {0} AND gaia.ra < {1} AND gaia.dec >= {2} AND gaia.dec < {3})
+            AS field"""
+GAIA_QUERIES = {'gaia': """SELECT * FROM gaiadr2.gaia_source AS gaia
+                        WHERE gaia.ra >= {0} AND gaia.ra < {1} AND gaia.dec >= {2} AND gaia.dec < {3}
+                        """,
+                'tmass': """SELECT ra,dec,ph_qual,j_m,h_m,ks_m,designation FROM gaiadr1.tmass_original_valid AS tmass
+                        WHERE tmass.ra >= {0} AND tmass.ra < {1} AND tmass.dec >= {2} AND tmass.dec < {3}
+                        """,
+                'tmass_crossmatch': """SELECT field.ra,field.dec,field.designation,tmass.designation from
+            """ + GAIA_FIELD + """
+            INNER JOIN gaiadr2.tmass_best_neighbour AS xmatch
+                ON field.source_id = xmatch.source_id
+            INNER JOIN gaiadr1.tmass_original_valid AS tmass
+                ON tmass.tmass_oid = xmatch.tmass_oid
+        """,
+                'wise': """SELECT ra,dec,ph_qual,w1mpro,w2mpro,w3mpro,w4mpro,designation FROM gaiadr1.allwise_original_valid AS wise
+                        WHERE wise.ra >= {0} AND wise.ra < {1} AND wise.dec >= {2} AND wise.dec < {3}
+                        """,
+                'wise_crossmatch': """SELECT field.ra,field.dec,field.designation,allwise.designation from
+            """ + GAIA_FIELD + """
+            INNER JOIN gaiadr2.allwise_best_neighbour AS xmatch
+                ON field.source_id = xmatch.source_id
+            INNER JOIN gaiadr1.allwise_original_valid AS allwise
+                ON allwise.designation = xmatch.original_ext_source_id
+        """}
+
+# VizieR catalogs, along with the columns retrieved, and the names of
+# the RA and Dec columns
+VIZIER_CATALOGS = {'II/246/out': (['_RAJ2000', '_DEJ2000', 'Kmag'], '_RAJ2000', '_DEJ2000'),
+                   'II/328/allwise': (['RAJ2000', 'DEJ2000', 'W2mag'], 'RAJ2000', 'DEJ2000')}
+
+_CATALOG_CACHE = None
+
+
+class CatalogBackend():
+    """Interface to a service returning the sources of a catalog within
+    an RA/Dec box. Subclasses must implement ``query_box``, and may
+    override ``coordinate_columns`` if the RA and Dec columns of a
+    catalog are not named 'ra' and 'dec'.
+    """
+    def coordinate_columns(self, catalog):
+        """Return the names of the RA and Dec columns of a catalog
+
+        Parameters
+        ----------
+        catalog : str
+            Catalog name
+
+        Returns
+        -------
+        columns : tuple
+            (RA column name, Dec column name)
+        """
+        return 'ra', 'dec'
+
+    def query_box(self, catalog, ra_min, ra_max, dec_min, dec_max):
+        """Return all sources in a catalog with ra_min <= RA < ra_max and
+        dec_min <= Dec < dec_max, where 0 <= ra_min < ra_max <= 360.
+
+        Parameters
+        ----------
+        catalog : str
+            Catalog name
+
+        ra_min : float
+            Minimum RA, in degrees
+
+        ra_max : float
+            Maximum RA, in degrees
+
+        dec_min : float
+            Minimum Dec, in degrees
+
+        dec_max : float
+            Maximum Dec, in degrees
+
+        Returns
+        -------
+        table : astropy.table.Table
+            Sources in the box
+        """
+        raise NotImplementedError
+
+
+class RemoteCatalogBackend(CatalogBackend):
+    """Query 2MASS and WISE from IRSA ('2MASS', 'WISE'), tables from the
+    GAIA archive ('gaia', 'tmass', 'tmass_crossmatch', 'wise',
+    'wise_crossmatch'), and VizieR catalogs ('II/246/out', 'II/328/allwise')
+    """
+    def coordinate_columns(self, catalog):
+        if catalog in VIZIER_CATALOGS:
+            return VIZIER_CATALOGS[catalog][1:]
+        return 'ra', 'dec'
+
+    def query_box(self, catalog, ra_min, ra_max, dec_min, dec_max):
+        if catalog in IRSA_CATALOGS:
+            from astroquery.irsa import Irsa
+            Irsa.ROW_LIMIT = -1
+            center = SkyCoord((ra_min + ra_max) / 2., (dec_min + dec_max) / 2., unit=u.deg)
+            polygon = [SkyCoord(ra, dec, unit=u.deg) for ra, dec in
+                       [(ra_min, dec_min), (ra_max, dec_min), (ra_max, dec_max), (ra_min, dec_max)]]
+            table = Irsa.query_region(center, catalog=IRSA_CATALOGS[catalog], spatial='Polygon',
+                                      polygon=polygon)
+        elif catalog in GAIA_QUERIES:
+            from astroquery.gaia import Gaia
+            job = Gaia.launch_job_async(GAIA_QUERIES[catalog].format(ra_min, ra_max, dec_min, dec_max),
+                                        dump_to_file=False)
+            table = job.get_results()
+        elif catalog in VIZIER_CATALOGS:
+            from astroquery.vizier import Vizier
+            columns, ra_col, dec_col = VIZIER_CATALOGS[catalog]
+            v = Vizier(catalog=catalog, columns=columns)
+            v.ROW_LIMIT = -1
+            center = SkyCoord((ra_min + ra_max) / 2., (dec_min + dec_max) / 2., unit=u.deg)
+            # Width on the sky at the Dec closest to the equator, so that the
+            # box covers the whole tile
+            if dec_min <= 0. <= dec_max:
+                cos_dec = 1.
+            else:
+                cos_dec = np.cos(np.radians(min(abs(dec_min), abs(dec_max))))
+            width = min((ra_max - ra_min) * cos_dec, 180.)
+            result = v.query_region(center, width=width * u.deg, height=(dec_max - dec_min) * u.deg)
+            if len(result) == 0:
+                return Table(names=columns)
+            table = result[catalog]
+        else:
+            raise ValueError('Unknown catalog: {}'.format(catalog))
+        return table
+
+
+class TiledCatalogCache():
+    """Persistent cache of catalog query results, stored on disk as fixed
+    RA/Dec tiles
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory in which tiles are stored. Tiles for each catalog are
+        stored in a separate subdirectory.
+
+    backend : CatalogBackend
+        Backend used to query missing tiles. Defaults to
+        ``RemoteCatalogBackend``.
+
+    tile_size : float
+        Size of the tiles in degrees of RA and Dec. 360 and 180 must both
+        be integer multiples of this value.
+    """
+    def __init__(self, cache_dir, backend=None, tile_size=TILE_SIZE):
+        if backend is None:
+            backend = RemoteCatalogBackend()
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.tile_size = tile_size
+        self.n_ra_tiles = int(round(360. / tile_size))
+        self.n_dec_tiles = int(round(180. / tile_size))
+
+    def get_tile(self, catalog, ra_index, dec_index):
+        """Return the sources in a single tile, querying the backend and
+        storing the result if the tile is not yet in the cache
+
+        Parameters
+        ----------
+        catalog : str
+            Catalog name
+
+        ra_index : int
+            Index of the tile in RA
+
+        dec_index : int
+            Index of the tile in Dec
+
+        Returns
+        -------
+        table : astropy.table.Table
+            Sources in the tile, in a table of MaskedColumns
+        """
+        filename = self.tile_filename(catalog, ra_index, dec_index)
+        if os.path.isfile(filename):
+            # ECSV files keep the mask only for columns with masked values,
+            # so make all columns masked again, as returned by the services
+            return Table(Table.read(filename, format='ascii.ecsv'), masked=True)
+
+        ra_min = ra_index * self.tile_size
+        dec_min = dec_index * self.tile_size - 90.
+        ra_max = min(ra_min + self.tile_size, 360.)
+        dec_max = min(dec_min + self.tile_size, 90.)
+        table = self.backend.query_box(catalog, ra_min, ra_max, dec_min, dec_max)
+
+        # Keep only the sources inside the tile, so that neighbouring tiles
+        # never contain the same source
+        ra_col, dec_col = self.backend.coordinate_columns(catalog)
+        if len(table) > 0:
+            ra = np.mod(np.asarray(table[ra_col], dtype=float), 360.)
+            dec = np.asarray(table[dec_col], dtype=float)
+            in_tile = (ra >= ra_min) & (ra < ra_max) & (dec >= dec_min) & (dec < dec_max)
+            if dec_max == 90.:
+                in_tile |= (ra >= ra_min) & (ra < ra_max) & (dec == 90.)
+            table = table[in_tile]
+
+        table.meta = {}
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temp_file = '{}.{}.tmp'.format(filename, os.getpid())
+        table.write(temp_file, format='ascii.ecsv', overwrite=True)
+        os.replace(temp_file, filename)
+        return Table(table, masked=True)
+
+    def query_box(self, catalog, ra, dec, box_width):
+        """Return the sources in a square box centered on the given
+        position
+
+        Parameters
+        ----------
+        catalog : str
+            Catalog name
+
+        ra : float or str
+            RA of the center of the box. Can be decimal degrees or HMS string
+
+        dec : float or str
+            Dec of the center of the box. Can be decimal degrees or DMS string
+
+        box_width : float
+            Width of the box in arcseconds
+
+        Returns
+        -------
+        table : astropy.table.Table
+            Sources in the box, in a table of MaskedColumns
+        """
+        ra, dec = _to_degrees(ra, dec)
+        half_width = box_width / 3600. / 2.
+        dec_min = max(dec - half_width, -90.)
+        dec_max = min(dec + half_width, 90.)
+        table = self._query_region(catalog, ra, dec_min, dec_max, half_width)
+        if len(table) == 0:
+            return table
+
+        ra_col, dec_col = self.backend.coordinate_columns(catalog)
+        cat_ra = np.asarray(table[ra_col], dtype=float)
+        cat_dec = np.asarray(table[dec_col], dtype=float)
+        delta_ra = (cat_ra - ra + 180.) % 360. - 180.
+        in_box = ((np.abs(delta_ra * np.cos(np.radians(dec))) <= half_width)
+                  & (cat_dec >= dec_min) & (cat_dec <= dec_max))
+        return table[in_box]
+
+    def query_cone(self, catalog, ra, dec, radius):
+        """Return the sources within a given radius of a position
+
+        Parameters
+        ----------
+        catalog : str
+            Catalog name
+
+        ra : float or str
+            RA of the center of the cone. Can be decimal degrees or HMS string
+
+        dec : float or str
+            Dec of the center of the cone. Can be decimal degrees or DMS string
+
+        radius : float
+            Radius of the cone in arcseconds
+
+        Returns
+        -------
+        table : astropy.table.Table
+            Sources in the cone, in a table of MaskedColumns
+        """
+        ra, dec = _to_degrees(ra, dec)
+        radius_deg = radius / 3600.
+        dec_min = max(dec - radius_deg, -90.)
+        dec_max = min(dec + radius_deg, 90.)
+        table = self._query_region(catalog, ra, dec_min, dec_max, radius_deg)
+        if len(table) == 0:
+            return table
+
+        ra_col, dec_col = self.backend.coordinate_columns(catalog)
+        center = SkyCoord(ra, dec, unit=u.deg)
+        coords = SkyCoord(np.asarray(table[ra_col], dtype=float), np.asarray(table[dec_col], dtype=float),
+                          unit=u.deg)
+        return table[center.separation(coords).deg <= radius_deg]
+
+    def tile_filename(self, catalog, ra_index, dec_index):
+        """Return the name of the file in which a tile is stored
+
+        Parameters
+        ----------
+        catalog : str
+            Catalog name
+
+        ra_index : int
+            Index of the tile in RA
+
+        dec_index : int
+            Index of the tile in Dec
+
+        Returns
+        -------
+        filename : str
+            Name of the tile file
+        """
+        catalog_dir = '{}_{}deg'.format(catalog.replace('/', '_'), self.tile_size)
+        return os.path.join(self.cache_dir, catalog_dir, 'tile_{}_{}.ecsv'.format(ra_index, dec_index))
+
+    def tiles_for_region(self, ra, dec_min, dec_max, half_width):
+        """Return the indexes of the tiles covering a region extending from
+        dec_min to dec_max, and by half_width degrees (on the sky) on
+        either side of ra
+
+        Parameters
+        ----------
+        ra : float
+            RA of the center of the region, in degrees
+
+        dec_min : float
+            Minimum Dec of the region, in degrees
+
+        dec_max : float
+            Maximum Dec of the region, in degrees
+
+        half_width : float
+            Half of the width of the region in RA, in degrees on the sky
+
+        Returns
+        -------
+        tiles : list
+            (ra_index, dec_index) tuples
+        """
+        dec_indexes = range(int(np.floor((dec_min + 90.) / self.tile_size)),
+                            min(int(np.floor((dec_max + 90.) / self.tile_size)), self.n_dec_tiles - 1) + 1)
+
+        # Widen the RA range by the cosine of the Dec closest to the pole
+        cos_dec = np.cos(np.radians(max(abs(dec_min), abs(dec_max))))
+        if cos_dec <= 0 or half_width / cos_dec >= 180.:
+            ra_indexes = range(self.n_ra_tiles)
+        else:
+            ra_half_width = half_width / cos_dec
+            first = int(np.floor((ra - ra_half_width) / self.tile_size))
+            last = int(np.floor((ra + ra_half_width) / self.tile_size))
+            ra_indexes = sorted(set([index % self.n_ra_tiles for index in range(first, last + 1)]))
+        return [(ra_index, dec_index) for dec_index in dec_indexes for ra_index in ra_indexes]
+
+    def _query_region(self, catalog, ra, dec_min, dec_max, half_width):
+        """Combine the tiles covering a region into a single table"""
+        tables = [self.get_tile(catalog, ra_index, dec_index) for ra_index, dec_index in
+                  self.tiles_for_region(ra, dec_min, dec_max, half_width)]
+        populated = [table for table in tables if len(table) > 0]
+        if len(populated) == 0:
+            return tables[0]
+        if len(populated) == 1:
+            return populated[0]
+        return vstack(populated, join_type='exact')
+
+
+def get_catalog_cache():
+    """Return the catalog cache in use, if any. If no cache has been set
+    with ``set_catalog_cache`` and the MIRAGE_CATALOG_CACHE environment
+    variable is set, a cache in that directory using the remote backend
+    is created.
+
+    Returns
+    -------
+    cache : TiledCatalogCache
+        Catalog cache, or None if caching is not enabled
+    """
+    global _CATALOG_CACHE
+    if _CATALOG_CACHE is None:
+        cache_dir = os.environ.get(CATALOG_CACHE_ENV_VAR)
+        if cache_dir:
+            _CATALOG_CACHE = TiledCatalogCache(cache_dir)
+    return _CATALOG_CACHE
+
+
+def set_catalog_cache(cache):
+    """Set the catalog cache used by the catalog query functions
+
+    Parameters
+    ----------
+    cache : TiledCatalogCache
+        Catalog cache to use. If None, queries go directly to the catalog
+        services (unless the MIRAGE_CATALOG_CACHE environment variable is
+        set).
+    """
+    global _CATALOG_CACHE
+    _CATALOG_CACHE = cache
+
+
+def _to_degrees(ra, dec):
+    """Convert RA and Dec, which may be sexagesimal strings, to degrees"""
+    try:
+        return float(ra) % 360., float(dec)
+    except ValueError:
+        pos = SkyCoord(ra, dec, frame='icrs')
+        return pos.ra.deg, pos.dec.deg
@@ -29,6 +29,55 @@ from astropy.table import Table, Column
 import numpy as np
 
 
+# File name extensions of catalogs saved as binary (FITS) tables. Catalogs
+# with any other extension are saved and read as ascii.
+BINARY_CATALOG_EXTENSIONS = ('.fits', '.fits.gz')
+
+# Names of the valid filters for each instrument, read by filter_check
+_FILTER_NAMES = {}
+
+
+class GrowableColumn():
+    def __init__(self, values=[]):
+        """Column of per-source values. Values are stored as a list of
+        chunks, which are only concatenated when the full column is
+        requested, so appending does not copy the existing values.
+
+        Parameters
+        ----------
+        values : list or numpy.ndarray
+            Initial values of the column
+        """
+        self._chunks = []
+        self._length = 0
+        self.append(values)
+
+    def __len__(self):
+        return self._length
+
+    def append(self, values):
+        """Add values to the end of the column
+
+        Parameters
+        ----------
+        values : list or numpy.ndarray
+            Values to add
+        """
+        values = np.asarray(values)
+        if len(values) > 0:
+            self._chunks.append(values)
+            self._length += len(values)
+
+    @property
+    def values(self):
+        """Return all values in the column as a single numpy array"""
+        if len(self._chunks) == 0:
+            return np.array([])
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0]
+
+
 class PointSourceCatalog():
     def __init__(self, ra=[], dec=[], x=[], y=[]):
         """Initialize the point source catalog. Users can enter lists of RA and Dec values
@@ -51,13 +100,23 @@ class PointSourceCatalog():
         if len(ra) > 0 and len(x) > 0:
             raise ValueError(("WARNING: Provide either RA and Dec values, or x and y values."))
 
+        # Per-source columns, other than magnitudes. Catalogs that inherit
+        # from two catalog classes initialize the positions twice, so keep
+        # any columns added by the first initialization.
+        if not hasattr(self, '_columns'):
+            self._columns = {}
         if len(ra) > 0:
-            self._ra = ra
-            self._dec = dec
+            self._columns['x_or_RA'] = GrowableColumn(ra)
+            self._columns['y_or_Dec'] = GrowableColumn(dec)
         else:
-            self._ra = x
-            self._dec = y
-        self.magnitudes = {}
+            self._columns['x_or_RA'] = GrowableColumn(x)
+            self._columns['y_or_Dec'] = GrowableColumn(y)
+
+        # Magnitude system and column of values for each magnitude entry
+        self._magnitudes = {}
+
+        # The astropy table is created from the columns when it is accessed
+        self._table = None
 
         # Determine the units for the location fields. All that Mirage needs to know is whether
         # the units are pixels or not. Degrees vs hour angle is not important at this point.
@@ -67,46 +126,48 @@ class PointSourceCatalog():
             self._location_units = 'position_pixels'
 
     def add_catalog(self, catalog_to_add, magnitude_fill_value=99.):
-        """Add a catalog to the current catalog instance"""
+        """Add a catalog to the current catalog instance. Columns are
+        extended without copying the existing values, so adding a series of
+        catalogs scales with the total number of sources."""
         # If the the source positions in the two catalogs have different units, then the catalogs
         # can't be combined.
         if self._location_units != catalog_to_add.location_units:
             raise ValueError("WARNING: Sources in the catalogs do not have matching units (RA/Dec or x/y)")
 
+        if set(self._columns) != set(catalog_to_add._columns):
+            raise ValueError("WARNING: Catalogs do not have matching columns. Cannot combine.")
+
         # Check the magnitude system from each and make sure they match
-        current_mag_labels = list(self.magnitudes.keys())
-        new_mag_labels = list(catalog_to_add.magnitudes.keys())
-        mag_sys = self.magnitudes[current_mag_labels[0]][0]
-        if mag_sys != catalog_to_add.magnitudes[new_mag_labels[0]][0]:
+        current_mag_labels = list(self._magnitudes.keys())
+        new_mag_labels = list(catalog_to_add._magnitudes.keys())
+        mag_sys = self._magnitudes[current_mag_labels[0]][0]
+        if mag_sys != catalog_to_add._magnitudes[new_mag_labels[0]][0]:
             print("WARNING: Magnitude systems of the two catalogs do not match. Cannot combine.")
 
         # Get the length of the two catalogs
-        current_length = len(self._ra)
-        new_length = len(catalog_to_add._ra)
+        current_length = len(self)
+        new_length = len(catalog_to_add)
 
-        # Combine location columns
-        self._ra = np.append(self._ra, catalog_to_add._ra)
-        self._dec = np.append(self._dec, catalog_to_add._dec)
+        # Combine location and other per-source columns
+        for key in self._columns:
+            self._columns[key].append(catalog_to_add._columns[key].values)
 
         # Now we need to compare magnitude columns. Columns common to both catalogs can be
         # combined. Columns not common will have to have fill values added so that everything
         # is the same length
-        orig_current_mag_labels = copy.deepcopy(current_mag_labels)
-        current_mag_labels.extend(new_mag_labels)
-        mag_label_set = set(current_mag_labels)
-        for label in mag_label_set:
-            if ((label in orig_current_mag_labels) and (label not in new_mag_labels)):
-                fill = [magnitude_fill_value] * new_length
-                self.magnitudes[label][1] = np.append(self.magnitudes[label][1], fill)
-            if ((label not in orig_current_mag_labels) and (label in new_mag_labels)):
-                fill = [magnitude_fill_value] * current_length
-                self.magnitudes[label] = [mag_sys, np.append(fill, catalog_to_add.magnitudes[label][1])]
-            if ((label in orig_current_mag_labels) and (label in new_mag_labels)):
-                self.magnitudes[label][1] = np.append(self.magnitudes[label][1],
-                                                      catalog_to_add.magnitudes[label][1])
-
-        # Update the catalog table if it already exists, so that it is consistent
-        self.create_table()
+        for label in current_mag_labels:
+            if label in new_mag_labels:
+                self._magnitudes[label][1].append(catalog_to_add._magnitudes[label][1].values)
+            else:
+                self._magnitudes[label][1].append(np.full(new_length, magnitude_fill_value))
+        for label in new_mag_labels:
+            if label not in current_mag_labels:
+                column = GrowableColumn(np.full(current_length, magnitude_fill_value))
+                column.append(catalog_to_add._magnitudes[label][1].values)
+                self._magnitudes[label] = [mag_sys, column]
+
+        # The catalog table will be re-created when it is next accessed
+        self._table = None
 
     def add_magnitude_column(self, magnitude_list, magnitude_system='abmag', instrument='', filter_name=''):
         """Add a list of magnitudes to the catalog
@@ -115,9 +176,6 @@ class PointSourceCatalog():
         ----------
         some_stuff
         """
-        # Force magnitude list to be a numpy array
-        magnitude_list = np.array(magnitude_list)
-
         # Make sure instrument and filter are allowed values
         instrument = instrument.lower()
         filter_name = filter_name.lower()
@@ -134,14 +192,14 @@ class PointSourceCatalog():
 
         # Get a list of magnitude_system for the existing catalog. No mixing of
         # magnitude systems is currently allowed.
-        keys = self.magnitudes.keys()
+        keys = self._magnitudes.keys()
         if len(keys) > 0:
-            current_mag_sys = self.magnitudes[list(keys)[0]][0]
+            current_mag_sys = self._magnitudes[list(keys)[0]][0]
         else:
             current_mag_sys = magnitude_system
 
         # Make sure this is not a duplicate column
-        if header in self.magnitudes.keys():
+        if header in self._magnitudes.keys():
             raise ValueError(("WARNING: {} entry already exists in catalog. No duplicate entries allowed."
                               .format(header)))
         # Make sure the magnitude system is consistent
@@ -150,10 +208,10 @@ class PointSourceCatalog():
                                   "Current catalog is using {}, while the new entry is {}."
                                   .format(current_mag_sys, magnitude_system)))
         else:
-            self.magnitudes[header] = [magnitude_system, magnitude_list]
+            self._magnitudes[header] = [magnitude_system, GrowableColumn(magnitude_list)]
 
-        # Update the catalog table
-        self.create_table()
+        # The catalog table will be re-created when it is next accessed
+        self._table = None
 
     def filter_check(self, inst_name, filt_name):
         """Make sure the requested instrument/filter pair is valid
@@ -164,10 +222,12 @@ class PointSourceCatalog():
             filter_file = 'niriss_dual_wheel_list.txt'
 
         if inst_name in ['nircam', 'niriss']:
-            filter_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../config/',
-                                                            filter_file))
-            filter_table = ascii.read(filter_file_path)
-            if filt_name.upper() not in filter_table['filter']:
+            if inst_name not in _FILTER_NAMES:
+                filter_file_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../config/',
+                                                                filter_file))
+                filter_table = ascii.read(filter_file_path)
+                _FILTER_NAMES[inst_name] = set(filter_table['filter'])
+            if filt_name.upper() not in _FILTER_NAMES[inst_name]:
                 raise ValueError("WARNING: {} is not a valid filter for {}.".format(filt_name,
                                                                                     inst_name.upper()))
         if inst_name == 'fgs':
@@ -181,6 +241,19 @@ class PointSourceCatalog():
         if inst_name not in ['nircam', 'niriss', 'fgs']:
             raise ValueError("WARNING: {} is not a valid instrument.".format(inst_name))
 
+    def __len__(self):
+        return len(self._columns['x_or_RA'])
+
+    @property
+    def _ra(self):
+        """Return the first position column (RA or x)"""
+        return self._columns['x_or_RA'].values
+
+    @property
+    def _dec(self):
+        """Return the second position column (Dec or y)"""
+        return self._columns['y_or_Dec'].values
+
     @property
     def dec(self):
         """Return Dec values from catalog"""
@@ -197,7 +270,7 @@ class PointSourceCatalog():
         justone
         """
         try:
-            return self.magnitudes[key][1]
+            return self._magnitudes[key][1].values
         except KeyError:
             print("WARNING: No {} magnitude column present.".format(key))
 
@@ -206,6 +279,12 @@ class PointSourceCatalog():
         """Return RA values from catalog"""
         return self._location_units
 
+    @property
+    def magnitudes(self):
+        """Return a dictionary of [magnitude system, magnitude values] for
+        each magnitude column in the catalog"""
+        return {key: [mag_sys, column.values] for key, (mag_sys, column) in self._magnitudes.items()}
+
     @property
     def ra(self):
         """Return RA values from catalog"""
@@ -214,6 +293,19 @@ class PointSourceCatalog():
         else:
             return []
 
+    @property
+    def table(self):
+        """Return an astropy table containing the catalog. The table is
+        created from the catalog columns the first time it is accessed
+        after any change to the catalog."""
+        if self._table is None:
+            self.create_table()
+        return self._table
+
+    @table.setter
+    def table(self, value):
+        self._table = value
+
     @property
     def x(self):
         """Return x values from catalog"""
@@ -238,14 +330,49 @@ class PointSourceCatalog():
         # Make sure there are at least 4 comment lines at the top
         self.table = pad_table_comments(tab)
 
-    def save(self, output_name):
-        """Write out the catalog to an ascii file
+    def save(self, output_name, format=None):
+        """Write out the catalog to an ascii file, or to a binary FITS table.
+        Both formats keep the position units, magnitude system and other
+        metadata in the table comments, and can be read by all Mirage
+        catalog readers.
 
         Parameters
         ----------
-        something
+        output_name : str
+            Name of the file to write
+
+        format : str
+            Either 'ascii' or 'fits'. If None, a FITS table is written when
+            ``output_name`` ends with one of ``BINARY_CATALOG_EXTENSIONS``,
+            and an ascii file is written otherwise.
+        """
+        if format is None:
+            format = 'fits' if is_binary_catalog(output_name) else 'ascii'
+        if format not in ['ascii', 'fits']:
+            raise ValueError("WARNING: catalog format must be 'ascii' or 'fits', not {}.".format(format))
+        self.table.write(output_name, format=format, overwrite=True)
+
+    def select(self, indexes):
+        """Create a new catalog of the same type containing a subset of
+        the sources in this catalog
+
+        Parameters
+        ----------
+        indexes : numpy.ndarray
+            Indexes (or boolean mask) of the sources to keep
+
+        Returns
+        -------
+        new_cat : PointSourceCatalog
+            Catalog of the same type as this one, containing only the
+            selected sources
         """
-        self.table.write(output_name, format='ascii', overwrite=True)
+        new_cat = copy.copy(self)
+        new_cat._columns = {key: GrowableColumn(column.values[indexes]) for key, column in self._columns.items()}
+        new_cat._magnitudes = {key: [mag_sys, GrowableColumn(column.values[indexes])]
+                               for key, (mag_sys, column) in self._magnitudes.items()}
+        new_cat._table = None
+        return new_cat
 
 
 class GalaxyCatalog(PointSourceCatalog):
@@ -257,13 +384,10 @@ class GalaxyCatalog(PointSourceCatalog):
         PointSourceCatalog.__init__(self, ra=ra, dec=dec, x=x, y=y)
 
         # Add galaxy-specific information
-        self._morphology = {'radius': radius, 'ellipticity': ellipticity, 'sersic_index': sersic_index,
-                            'pos_angle': position_angle}
-
-        self._ellipticity = ellipticity
-        self._pos_angle = position_angle
-        self._radius = radius
-        self._sersic_index = sersic_index
+        self._columns['radius'] = GrowableColumn(radius)
+        self._columns['ellipticity'] = GrowableColumn(ellipticity)
+        self._columns['sersic_index'] = GrowableColumn(sersic_index)
+        self._columns['pos_angle'] = GrowableColumn(position_angle)
 
         if radius_units not in ['arcsec', 'pixels']:
             raise ValueError("WARNING: Galaxy radii must be in units of 'arcsec' or 'pixels'.")
@@ -275,8 +399,7 @@ class GalaxyCatalog(PointSourceCatalog):
         tab = create_basic_table(self._ra, self._dec, self.magnitudes, self.location_units)
 
         # Add morphology columns
-        for key in self._morphology:
-            values = self._morphology[key]
+        for key, values in self.morphology.items():
             col = Column(values, name=key)
             tab.add_column(col, index=3)
 
@@ -289,22 +412,22 @@ class GalaxyCatalog(PointSourceCatalog):
     @property
     def ellipticity(self):
         """Return Dec values from catalog"""
-        return self._ellipticity
+        return self._columns['ellipticity'].values
 
     @property
     def position_angle(self):
         """Return Dec values from catalog"""
-        return self._pos_angle
+        return self._columns['pos_angle'].values
 
     @property
     def radius(self):
         """Return Dec values from catalog"""
-        return self._radius
+        return self._columns['radius'].values
 
     @property
     def sersic_index(self):
         """Return Dec values from catalog"""
-        return self._sersic_index
+        return self._columns['sersic_index'].values
 
     @property
     def radius_units(self):
@@ -314,7 +437,8 @@ class GalaxyCatalog(PointSourceCatalog):
     @property
     def morphology(self):
         """Return Dec values from catalog"""
-        return self._morphology
+        return {'radius': self.radius, 'ellipticity': self.ellipticity, 'sersic_index': self.sersic_index,
+                'pos_angle': self.position_angle}
 
 
 class ExtendedCatalog(PointSourceCatalog):
@@ -323,8 +447,8 @@ class ExtendedCatalog(PointSourceCatalog):
         PointSourceCatalog.__init__(self, ra=ra, dec=dec, x=x, y=y)
 
         # Add extended source-specific information
-        self._filenames = filenames
-        self._pos_angle = position_angle
+        self._columns['filename'] = GrowableColumn(filenames)
+        self._columns['pos_angle'] = GrowableColumn(position_angle)
 
     def create_table(self):
         """Create an astropy table containing the catalog
@@ -332,11 +456,11 @@ class ExtendedCatalog(PointSourceCatalog):
         tab = create_basic_table(self._ra, self._dec, self.magnitudes, self._location_units)
 
         # Add the filename column
-        file_col = Column(self._filenames, name='filename')
+        file_col = Column(self.filenames, name='filename')
         tab.add_column(file_col, index=3)
 
         # Add the position angle column
-        pa_col = Column(self._pos_angle, name='pos_angle')
+        pa_col = Column(self.position_angle, name='pos_angle')
         tab.add_column(pa_col)
 
         # Make sure there are at least 4 comment lines at the top
@@ -345,12 +469,12 @@ class ExtendedCatalog(PointSourceCatalog):
     @property
     def filenames(self):
         """Return Dec values from catalog"""
-        return self._filenames
+        return self._columns['filename'].values
 
     @property
     def position_angle(self):
         """Return Dec values from catalog"""
-        return self._pos_angle
+        return self._columns['pos_angle'].values
 
 
 class MovingPointSourceCatalog(PointSourceCatalog):
@@ -364,17 +488,17 @@ class MovingPointSourceCatalog(PointSourceCatalog):
                               "velocities, but not both."))
         # Object velocities
         if len(ra_velocity) > 0:
-            self._ra_velocity = ra_velocity
-            self._dec_velocity = dec_velocity
+            self._columns['x_or_RA_velocity'] = GrowableColumn(ra_velocity)
+            self._columns['y_or_Dec_velocity'] = GrowableColumn(dec_velocity)
             self._velocity_units = 'velocity_RA_Dec'
         else:
-            self._ra_velocity = x_velocity
-            self._dec_velocity = y_velocity
+            self._columns['x_or_RA_velocity'] = GrowableColumn(x_velocity)
+            self._columns['y_or_Dec_velocity'] = GrowableColumn(y_velocity)
             self._velocity_units = 'velocity_pixels'
 
     def create_table(self):
         tab = create_basic_velocity_table(self._ra, self._dec, self.magnitudes, self._location_units,
-                                          self._ra_velocity, self._dec_velocity, self._velocity_units)
+                                          self.ra_velocity, self.dec_velocity, self._velocity_units)
 
         # Make sure there are at least 4 comment lines at the top
         self.table = pad_table_comments(tab)
@@ -382,12 +506,12 @@ class MovingPointSourceCatalog(PointSourceCatalog):
     @property
     def dec_velocity(self):
         """Return Dec values from catalog"""
-        return self._dec_velocity
+        return self._columns['y_or_Dec_velocity'].values
 
     @property
     def ra_velocity(self):
         """Return Dec values from catalog"""
-        return self._ra_velocity
+        return self._columns['x_or_RA_velocity'].values
 
     @property
     def velocity_units(self):
@@ -409,10 +533,9 @@ class MovingSersicCatalog(GalaxyCatalog, MovingPointSourceCatalog):
 
     def create_table(self):
         tab = create_basic_velocity_table(self._ra, self._dec, self.magnitudes, self._location_units,
-                                          self._ra_velocity, self._dec_velocity, self._velocity_units)
+                                          self.ra_velocity, self.dec_velocity, self._velocity_units)
         # Add morphology columns
-        for key in self._morphology:
-            values = self._morphology[key]
+        for key, values in self.morphology.items():
             col = Column(values, name=key)
             tab.add_column(col, index=3)
 
@@ -435,13 +558,13 @@ class MovingExtendedCatalog(ExtendedCatalog, MovingPointSourceCatalog):
 
     def create_table(self):
         tab = create_basic_velocity_table(self._ra, self._dec, self.magnitudes, self._location_units,
-                                          self._ra_velocity, self._dec_velocity, self._velocity_units)
+                                          self.ra_velocity, self.dec_velocity, self._velocity_units)
         # Add filename column
-        file_col = Column(self._filenames, name='filename')
+        file_col = Column(self.filenames, name='filename')
         tab.add_column(file_col, index=1)
 
         # Add position_angle column
-        pa_col = Column(self._pos_angle, name='pos_angle')
+        pa_col = Column(self.position_angle, name='pos_angle')
         tab.add_column(pa_col, index=6)
 
         # Make sure there are at least 4 comment lines at the top
@@ -462,19 +585,24 @@ class NonSiderealCatalog(MovingPointSourceCatalog):
             if obj not in valid_objects:
                 raise ValueError(("WARNING: object_type list members must be one of: {}"
                                   .format(obj, valid_objects)))
-        self.object_type = object_type
+        self._columns['object'] = GrowableColumn(object_type)
 
     def create_table(self):
         """Create an astropy table containing the catalog
         """
         tab = create_basic_velocity_table(self._ra, self._dec, self.magnitudes, self._location_units,
-                                          self._ra_velocity, self._dec_velocity, self._velocity_units)
+                                          self.ra_velocity, self.dec_velocity, self._velocity_units)
         obj_col = Column(self.object_type, name='object')
         tab.add_column(obj_col, index=1)
 
         # Make sure there are at least 4 comment lines at the top
         self.table = pad_table_comments(tab)
 
+    @property
+    def object_type(self):
+        """Return the type of each source in the catalog"""
+        return self._columns['object'].values
+
 
 def add_velocity_columns(input_table, ra_velocities, dec_velocities, velocity_units):
     """
@@ -488,13 +616,13 @@ def add_velocity_columns(input_table, ra_velocities, dec_velocities, velocity_un
 
 
 def cat_from_file(filename, catalog_type='point_source'):
-    """Read in a Mirage-formatted ascii catalog file and place into an
-    instance of a catalog object
+    """Read in a Mirage-formatted ascii or binary catalog file and place
+    into an instance of a catalog object
 
     Parameters
     ----------
     filename : str
-        Name of ascii catalog to be read in
+        Name of catalog file to be read in
 
     catalog_type : str
         Type of source catalog. Allowed values are:
@@ -512,7 +640,7 @@ def cat_from_file(filename, catalog_type='point_source'):
         raise ValueError(("Input catalog type {} is not one of the allowed types: {}"
                          .format(catalog_type, allowed_types)))
 
-    cat_table = ascii.read(filename)
+    cat_table = read_catalog_table(filename)
 
     if 'position_pixels' in cat_table.meta['comments'][0:4]:
         xpos = 'x'
@@ -695,6 +823,55 @@ def get_inst_filter_from_colname(column_name):
     return instrument, filter_name
 
 
+def is_binary_catalog(filename):
+    """Determine whether a catalog file is in the binary (FITS table)
+    format, based on its extension
+
+    Parameters
+    ----------
+    filename : str
+        Name of the catalog file
+
+    Returns
+    -------
+    binary : bool
+        True if the file is a binary catalog
+    """
+    return filename.lower().endswith(BINARY_CATALOG_EXTENSIONS)
+
+
+def read_catalog_table(filename, memmap=False, **kwargs):
+    """Read a Mirage-formatted catalog file, in either the ascii or the
+    binary (FITS table) format, into an astropy table. The comment lines
+    containing the position units, magnitude system, etc are returned in
+    ``meta['comments']`` for both formats.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the catalog file
+
+    memmap : bool
+        If True, binary catalogs are memory-mapped rather than read into
+        memory, so that subsets of rows can be read quickly
+
+    kwargs : dict
+        Keyword arguments passed to astropy.io.ascii.read when reading an
+        ascii catalog
+
+    Returns
+    -------
+    table : astropy.table.Table
+        Catalog contents
+    """
+    if is_binary_catalog(filename):
+        table = Table.read(filename, format='fits', character_as_bytes=False, memmap=memmap)
+        if 'comments' not in table.meta:
+            table.meta['comments'] = []
+        return table
+    return ascii.read(filename, **kwargs)
+
+
 def pad_table_comments(input_table):
     """do it"""
     if len(input_table.meta['comments']) < 4:
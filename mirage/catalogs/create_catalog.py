@@ -21,8 +21,23 @@ from astroquery.irsa import Irsa
 from pysiaf.utils.projection import deproject_from_tangent_plane
 
 from mirage.apt.apt_inputs import get_filters
+from mirage.catalogs.catalog_cache import get_catalog_cache
+from mirage.catalogs import sky_index
 from mirage.catalogs.catalog_generator import PointSourceCatalog, GalaxyCatalog, ExtendedCatalog
 
+# Column of the F200W magnitude in the GOODS-S catalog, used for the
+# bright limit of background galaxies
+GOODSS_F200W_COLUMN = 11
+
+# Half-width, in arcsec, of the region around each pointing covered by
+# the catalogs from for_proposal. This encloses the full NIRCam field of
+# view at any roll angle.
+POINTING_HALF_WIDTH = 0.062 * 2048 * 1.5
+
+# GOODS-S catalog values and F200W magnitude sort order, read by
+# read_goodss_catalog
+_GOODSS_CATALOG = {}
+
 
 def create_basic_exposure_list(xml_file, pointing_file):
     """Create an exposure table from an APT (xml and pointing) file.
@@ -66,6 +81,20 @@ def for_proposal(xml_filename, pointing_filename, point_source=True, extragalact
     Given a pointing dictionary from an APT file, generate source catalogs
     that cover all of the coordinates specifired.
 
+    The pointings of all observations are first grouped into regions, such
+    that each pointing lies within ``catalog_splitting_threshold`` of
+    another pointing in its region. A single master catalog is created for
+    each region, covering the union of the footprints of its pointings.
+    The master catalog is built from a set of boxes that follow the
+    footprints (see ``sky_index.covering_boxes``), so that chained or
+    L-shaped mosaics do not lead to sources over their whole bounding box.
+    The catalog for each observation is then cut from the master catalog
+    of its region. Overlapping observations (mosaics, dithers, repeated
+    visits) therefore do not lead to repeated queries or repeated
+    generation of sources. The Besancon model, which is not covered by the
+    local catalog cache, is queried once for each region rather than once
+    for each box.
+
     Parameters
     ----------
     xml_filename : str
@@ -81,9 +110,9 @@ def for_proposal(xml_filename, pointing_filename, point_source=True, extragalact
         If True, a catalog of background galaxies is created
 
     catalog_splitting_threshold : float
-        Maximum distance in degrees between targets that will be contained
-        in a given catalog. Sources farther than this distance will be placed
-        into a separate catalog.
+        Maximum distance in degrees between pointings that will be covered
+        by a given master catalog. Pointings farther than this distance from
+        all others will be placed into a separate master catalog.
 
     email : str
         A valid email address is a required input for a call to the Besancon
@@ -98,192 +127,218 @@ def for_proposal(xml_filename, pointing_filename, point_source=True, extragalact
 
     besancon_seed : int
         Seed to use in the random number generator when choosing RA and
-        Dec values for Besancon sources.
+        Dec values for Besancon sources. The seed of each region is offset
+        by the region number.
 
     galaxy_seed : int
-        Seed to use in the random number generator used in galaxy_background
+        Seed to use in the random number generator used in galaxy_background.
+        The seed of each box is offset by the box number.
 
     Returns
     -------
     ptsrc_catalog_list : list
-        List of Mirage point source catalog objects
+        List of Mirage point source catalog objects, one per observation
 
     galaxy_catalog_list : list
-        List of Mirage galaxy source catalog objects
+        List of Mirage galaxy source catalog objects, one per observation
 
     ptsrc_catalog_names : list
         List of filenames of the saved point source catalogs
 
     galaxy_catalog_names : list
         List of filenames of the saved galaxy catalogs
+
+    ptsrc_catalog_mapping : dict
+        Name of the point source catalog for each observation number
+
+    galaxy_catalog_mapping : dict
+        Name of the galaxy catalog for each observation number
     """
     pointing_dictionary = create_basic_exposure_list(xml_filename, pointing_filename)
     instrument_filter_dict = get_filters(pointing_dictionary)
 
-    threshold = catalog_splitting_threshold * u.deg
-    ra_apertures = np.array(pointing_dictionary['ra_ref'] * u.deg)
-    dec_apertures = np.array(pointing_dictionary['dec_ref'] * u.deg)
-
-    ra_targets = np.array([np.float(num) for num in pointing_dictionary['ra']] * u.deg)
-    dec_targets = np.array([np.float(num) for num in pointing_dictionary['dec']] * u.deg)
-    mapped = np.array([False] * len(ra_targets))
-    index = np.arange(len(ra_targets))
+    ra_apertures = np.array(pointing_dictionary['ra_ref'], dtype=float)
+    dec_apertures = np.array(pointing_dictionary['dec_ref'], dtype=float)
+    observation_ids = np.array(pointing_dictionary['ObservationID'])
 
-    targets = SkyCoord(ra=pointing_dictionary['ra'], dec=pointing_dictionary['dec'], frame='icrs', unit=u.deg)
-    apertures = []
-    for ra, dec in zip(pointing_dictionary['ra_ref'], pointing_dictionary['dec_ref']):
-        apertures.append(SkyCoord(ra=ra, dec=dec, frame='icrs', unit=u.deg))
+    # Each unique aperture position is a pointing. Group the pointings
+    # into regions that will each be covered by one master catalog.
+    pointings, pointing_index = np.unique(np.array([ra_apertures, dec_apertures]).T, axis=0,
+                                          return_inverse=True)
+    pointing_index = pointing_index.ravel()
+    region_labels = sky_index.group_positions(pointings[:, 0], pointings[:, 1],
+                                              catalog_splitting_threshold * 3600.)
+
+    xml_base = os.path.basename(xml_filename).split('.xml')[0]
+    if out_dir is None:
+        out_dir = os.path.dirname(xml_filename)
+
+    # Functions creating the point source and galaxy catalogs for one box
+    # of a region, for all instruments in the proposal. Point sources use
+    # the Besancon stars of the region that fall within the box.
+    def ptsrc_for_box(region_besancon, box_number, ra, dec, width):
+        besancon_cat, besancon_model = region_besancon
+        in_box = sky_index.in_boxes(besancon_cat.ra, besancon_cat.dec, [(ra, dec, width)])
+        for i, instrument in enumerate(instrument_filter_dict):
+            filter_list = instrument_filter_dict[instrument]
+            tmp_cat, tmp_filters = get_all_catalogs(ra, dec, width, instrument=instrument,
+                                                    filters=filter_list, email=email,
+                                                    besancon_result=(besancon_cat.select(in_box),
+                                                                     besancon_model[in_box]))
+            if i == 0:
+                box_cat = copy.deepcopy(tmp_cat)
+            else:
+                box_cat = combine_catalogs(box_cat, tmp_cat)
+        return box_cat
+
+    def galaxies_for_box(box_number, ra, dec, width):
+        seed = None if galaxy_seed is None else galaxy_seed + box_number
+        for i, instrument in enumerate(instrument_filter_dict):
+            filter_list = instrument_filter_dict[instrument]
+            tmp_cat, tmp_seed = galaxy_background(ra, dec, 0., width, instrument, filter_list,
+                                                  boxflag=False, brightlimit=14.0, seed=seed)
+            if i == 0:
+                box_cat = copy.deepcopy(tmp_cat)
+            else:
+                box_cat = combine_catalogs(box_cat, tmp_cat)
+        return box_cat
 
-    observation_ids = np.array(pointing_dictionary['ObservationID'])
-    unique_observation_ids = list(set(observation_ids))
-    mapped_observations = {}
     ptsrc_catalog_mapping = {}
     ptsrc_catalog_list = []
     ptsrc_catalog_names = []
     galaxy_catalog_mapping = {}
     galaxy_catalog_list = []
     galaxy_catalog_names = []
-    for observation in unique_observation_ids:
-        # Skip observations that have already been examined because their
-        # targets match those in a previous observation
-        mapped_observation = False
-        for values in mapped_observations.values():
-            if observation in values:
-                mapped_observation = True
-            else:
-                mapped_observation = False
-        if mapped_observation:
-            continue
-
-        match = np.where(observation_ids == observation)[0]
-        target_ra = ra_targets[match[0]]
-        target_dec = dec_targets[match[0]]
-        target_pos = targets[match[0]]
-
-        dithers = ((ra_targets == target_ra) & (dec_targets == target_dec))
-        all_dithers = np.array(copy.deepcopy(dithers))
-        aperture_position = [(r, d) for r, d in zip(np.array(pointing_dictionary['ra_ref'])[dithers],
-                                                    np.array(pointing_dictionary['dec_ref'])[dithers])]
-        all_obs = observation_ids[dithers]
-        mapped_observations[str(observation)] = list(set(all_obs))
-
-        # Create a list of relative SkyCoords
-        targ_pos_relative = [pos.transform_to(targets[match[0]].skyoffset_frame()) for pos in targets[dithers]]
-
-        separation_distances = target_pos.separation(targets)
-        nearby_targets = ((separation_distances < threshold) & (mapped == False))
-
-        if any(nearby_targets):
-            nearby_target_ra = np.array(pointing_dictionary['ra'])[nearby_targets]
-            nearby_target_dec = np.array(pointing_dictionary['dec'])[nearby_targets]
-            near_positions = np.array([(ra_val, dec_val) for ra_val, dec_val in zip(nearby_target_ra,
-                                                                                    nearby_target_dec)])
-            unique_nearby = np.unique(near_positions, axis=0)
-            for near_coords in unique_nearby:
-                near_ra = float(near_coords[0])
-                near_dec = float(near_coords[1])
-                tmp_dither = ((ra_targets == near_ra) & (dec_targets == near_dec))
-                all_dithers = all_dithers | np.array(tmp_dither)
-                tmp_aperture_position = [(r, d) for r, d in zip(np.array(pointing_dictionary['ra_ref'])[tmp_dither],
-                                                                np.array(pointing_dictionary['dec_ref'])[tmp_dither])]
-                aperture_position.extend(tmp_aperture_position)
-
-                # Add to list of relative SkyCoords
-                relative = [pos.transform_to(targets[match[0]].skyoffset_frame()) for pos in targets[tmp_dither]]
-                targ_pos_relative.extend(relative)
-
-                tmp_obs = observation_ids[tmp_dither]
-                temp = mapped_observations[str(observation)]
-                temp.extend(list(set(tmp_obs)))
-                mapped_observations[str(observation)] = list(set(temp))
-
-        longitudes = [pos.lon.arcsec for pos in targ_pos_relative]
-        latitudes = [pos.lat.arcsec for pos in targ_pos_relative]
-        ralist = np.array([pos.ra.degree for pos in targets[all_dithers]])
-        declist = np.array([pos.dec.degree for pos in targets[all_dithers]])
-
-        pad = 0.062 * 1024 * 1.5
-        delta_lon = np.max(longitudes) - np.min(longitudes) + pad
-        delta_lat = np.max(latitudes) - np.min(latitudes) + pad
-        full_width = max(delta_lon, delta_lat)
-
-        if ((np.min(ralist) <= (catalog_splitting_threshold)) & (np.max(ralist) >= (360.-catalog_splitting_threshold))):
-            ralist[ralist >= 360.-catalog_splitting_threshold] -= 360.
-
-        mean_ra = np.mean(ralist)
-        mean_dec = np.mean(declist)
-
-        # Generate a string listing which observations the catalog covers
-        for_obs = mapped_observations[str(observation)]
-        for_obs_str = ''
-        for value in for_obs:
-            for_obs_str += str(value)+'_'
-        for_obs_str = for_obs_str[0:-1]
-        xml_base = os.path.basename(xml_filename).split('.xml')[0]
-        if out_dir is None:
-            out_dir = os.path.dirname(xml_filename)
+    for region in np.unique(region_labels):
+        region_pointings = pointings[region_labels == region]
+        boxes = sky_index.covering_boxes(region_pointings[:, 0], region_pointings[:, 1],
+                                         2. * POINTING_HALF_WIDTH)
+        print('Creating catalogs covering {} pointings using {} boxes with a total area of {} square arcsec'
+              .format(len(region_pointings), len(boxes), sum(width**2 for ra, dec, width in boxes)))
 
         if point_source:
-            for i, instrument in enumerate(instrument_filter_dict):
-                filter_list = instrument_filter_dict[instrument]
-                tmp_cat, tmp_filters = get_all_catalogs(mean_ra, mean_dec, full_width,
-                                                        instrument=instrument, filters=filter_list,
-                                                        email=email, besancon_seed=besancon_seed)
-                if i == 0:
-                    ptsrc_cat = copy.deepcopy(tmp_cat)
-                else:
-                    ptsrc_cat = combine_catalogs(ptsrc_cat, tmp_cat)
-
-            if save_catalogs:
-                ptsrc_catalog_name = 'ptsrc_for_{}_observations_{}.cat'.format(xml_base, for_obs_str)
-
-                # Populate dictionary listing ptsrc catalog name associated with each
-                # observation number
-                ptsrc_catalog_mapping[str(observation)] = ptsrc_catalog_name
-                for value in for_obs:
-                    ptsrc_catalog_mapping[str(value)] = ptsrc_catalog_name
-
-                print('POINT SOURCE CATALOG SAVED: {}'.format(ptsrc_catalog_name))
-                full_catalog_path = os.path.join(out_dir, ptsrc_catalog_name)
-                ptsrc_cat.save(full_catalog_path)
-                ptsrc_catalog_names.append(full_catalog_path)
-
-            ptsrc_catalog_list.append(ptsrc_cat)
-        else:
-            ptsrc_cat = None
+            seed = None if besancon_seed is None else besancon_seed + int(region)
+            region_besancon = besancon_for_boxes(boxes, email=email, seed=seed)
+            ptsrc_cat = catalog_for_boxes(boxes, lambda *box: ptsrc_for_box(region_besancon, *box))
+            ptsrc_index = sky_index.SkyIndex(ptsrc_cat.ra, ptsrc_cat.dec)
 
         if extragalactic:
-            for i, instrument in enumerate(instrument_filter_dict):
-                filter_list = instrument_filter_dict[instrument]
-                tmp_cat, tmp_seed = galaxy_background(mean_ra, mean_dec, 0., full_width, instrument,
-                                                      filter_list, boxflag=False, brightlimit=14.0,
-                                                      seed=galaxy_seed)
-                if i == 0:
-                    galaxy_cat = copy.deepcopy(tmp_cat)
-                else:
-                    galaxy_cat = combine_catalogs(galaxy_cat, tmp_cat)
-
-            if save_catalogs:
-                gal_catalog_name = 'galaxies_for_{}_observations_{}.cat'.format(xml_base, for_obs_str)
-
-                # Populate dictionary listing galaxy catalog name associated with each
-                # observation number
-                galaxy_catalog_mapping[str(observation)] = gal_catalog_name
-                for value in for_obs:
-                    galaxy_catalog_mapping[str(value)] = gal_catalog_name
-
-                print('GALAXY CATALOG SAVED: {}'.format(gal_catalog_name))
-                full_catalog_path = os.path.join(out_dir, gal_catalog_name)
-                galaxy_cat.save(full_catalog_path)
-                galaxy_catalog_names.append(full_catalog_path)
-
-            galaxy_catalog_list.append(galaxy_cat)
-        else:
-            galaxy_cat = None
+            galaxy_cat = catalog_for_boxes(boxes, galaxies_for_box)
+            galaxy_index = sky_index.SkyIndex(galaxy_cat.ra, galaxy_cat.dec)
+
+        # Cut the catalog for each observation in the region from the
+        # master catalogs
+        in_region = region_labels[pointing_index] == region
+        for observation in sorted(set(observation_ids[in_region])):
+            obs_pointings = pointings[np.unique(pointing_index[observation_ids == observation])]
+
+            if point_source:
+                rows = ptsrc_index.query_boxes(obs_pointings[:, 0], obs_pointings[:, 1],
+                                               2. * POINTING_HALF_WIDTH)
+                obs_ptsrc_cat = ptsrc_cat.select(rows)
+
+                if save_catalogs:
+                    ptsrc_catalog_name = 'ptsrc_for_{}_observations_{}.cat'.format(xml_base, observation)
+                    ptsrc_catalog_mapping[str(observation)] = ptsrc_catalog_name
+
+                    print('POINT SOURCE CATALOG SAVED: {}'.format(ptsrc_catalog_name))
+                    full_catalog_path = os.path.join(out_dir, ptsrc_catalog_name)
+                    obs_ptsrc_cat.save(full_catalog_path)
+                    ptsrc_catalog_names.append(full_catalog_path)
+
+                ptsrc_catalog_list.append(obs_ptsrc_cat)
+
+            if extragalactic:
+                rows = galaxy_index.query_boxes(obs_pointings[:, 0], obs_pointings[:, 1],
+                                                2. * POINTING_HALF_WIDTH)
+                obs_galaxy_cat = galaxy_cat.select(rows)
+
+                if save_catalogs:
+                    gal_catalog_name = 'galaxies_for_{}_observations_{}.cat'.format(xml_base, observation)
+                    galaxy_catalog_mapping[str(observation)] = gal_catalog_name
+
+                    print('GALAXY CATALOG SAVED: {}'.format(gal_catalog_name))
+                    full_catalog_path = os.path.join(out_dir, gal_catalog_name)
+                    obs_galaxy_cat.save(full_catalog_path)
+                    galaxy_catalog_names.append(full_catalog_path)
+
+                galaxy_catalog_list.append(obs_galaxy_cat)
     return (ptsrc_catalog_list, galaxy_catalog_list, ptsrc_catalog_names, galaxy_catalog_names,
             ptsrc_catalog_mapping, galaxy_catalog_mapping)
 
 
+def catalog_for_boxes(boxes, make_catalog):
+    """Create a catalog covering the union of a set of boxes. A catalog
+    is created for each box in turn, and trimmed to the sources within
+    that box but not within an earlier box, so that areas where boxes
+    overlap are covered once.
+
+    Parameters
+    ----------
+    boxes : list
+        (RA center, Dec center, full width) of each box, in degrees and
+        arcseconds, e.g. from ``sky_index.covering_boxes``
+
+    make_catalog : func
+        Function called as ``make_catalog(box_number, ra, dec, width)``,
+        returning a Mirage catalog object covering the box
+
+    Returns
+    -------
+    catalog : mirage.catalogs.catalog_generator.XXCatalog
+        Catalog covering all of the boxes
+    """
+    catalog = None
+    for box_number, (ra, dec, width) in enumerate(boxes):
+        box_cat = make_catalog(box_number, ra, dec, width)
+        keep = (sky_index.in_boxes(box_cat.ra, box_cat.dec, boxes[box_number:box_number + 1])
+                & ~sky_index.in_boxes(box_cat.ra, box_cat.dec, boxes[:box_number]))
+        box_cat = box_cat.select(keep)
+        if catalog is None:
+            catalog = box_cat
+        else:
+            catalog.add_catalog(box_cat)
+    return catalog
+
+
+def besancon_for_boxes(boxes, kmag_limits=(13, 29), email='', seed=None):
+    """Query the Besancon model once for the square region enclosing a set
+    of boxes, and keep the stars that fall within the boxes
+
+    Parameters
+    ----------
+    boxes : list
+        (RA center, Dec center, full width) of each box, in degrees and
+        arcseconds, e.g. from ``sky_index.covering_boxes``
+
+    kmag_limits : tup
+        Minimum and maximum K magnitudes for the Besancon model query
+
+    email : str
+        A valid email address is required for the Besancon model server
+
+    seed : int
+        Seed to use in the random number generator for the RA and Dec
+        values for the Besancon sources
+
+    Returns
+    -------
+    cat : mirage.catalogs.create_catalog.PointSourceCatalog
+        Catalog containing the Besancon stars within the boxes, with
+        their VJHKL magnitudes
+
+    model : astropy.table.Table
+        Rows of the Besancon model table for the stars in ``cat``
+    """
+    box_ra = np.array([box[0] for box in boxes])
+    box_dec = np.array([box[1] for box in boxes])
+    pad = max(box[2] for box in boxes) / 2.
+    ra, dec, width = sky_index.region_center_and_width(box_ra, box_dec, pad=pad)
+    cat, model = besancon(ra, dec, width, email=email, kmag_limits=kmag_limits, seed=seed)
+    in_boxes = sky_index.in_boxes(cat.ra, cat.dec, boxes)
+    return cat.select(in_boxes), model[in_boxes]
+
+
 def query_2MASS_ptsrc_catalog(ra, dec, box_width):
     """
     Query the 2MASS All-Sky Point Source Catalog in a square region around
@@ -311,12 +366,16 @@ def query_2MASS_ptsrc_catalog(ra, dec, box_width):
         List of column header names corresponding to columns containing
         source magnitude
     """
-    # Don't artificially limit how many sources are returned
-    Irsa.ROW_LIMIT = -1
+    cache = get_catalog_cache()
+    if cache is not None:
+        query_table = cache.query_box('2MASS', ra, dec, box_width)
+    else:
+        # Don't artificially limit how many sources are returned
+        Irsa.ROW_LIMIT = -1
 
-    ra_dec_string = "{}  {}".format(ra, dec)
-    query_table = Irsa.query_region(ra_dec_string, catalog='fp_psc', spatial='Box',
-                                    width=box_width * u.arcsec)
+        ra_dec_string = "{}  {}".format(ra, dec)
+        query_table = Irsa.query_region(ra_dec_string, catalog='fp_psc', spatial='Box',
+                                        width=box_width * u.arcsec)
 
     # Exclude any entries with missing RA or Dec values
     radec_mask = filter_bad_ra_dec(query_table)
@@ -370,12 +429,16 @@ def query_WISE_ptsrc_catalog(ra, dec, box_width):
     magnitude_column_names : list
         List of column header names corresponding to columns containing source magnitude
     """
-    # Don't artificially limit how many sources are returned
-    Irsa.ROW_LIMIT = -1
+    cache = get_catalog_cache()
+    if cache is not None:
+        query_table = cache.query_box('WISE', ra, dec, box_width)
+    else:
+        # Don't artificially limit how many sources are returned
+        Irsa.ROW_LIMIT = -1
 
-    ra_dec_string = "{}  {}".format(ra, dec)
-    query_table = Irsa.query_region(ra_dec_string, catalog='allsky_4band_p3as_psd', spatial='Box',
-                                    width=box_width * u.arcsec)
+        ra_dec_string = "{}  {}".format(ra, dec)
+        query_table = Irsa.query_region(ra_dec_string, catalog='allsky_4band_p3as_psd', spatial='Box',
+                                        width=box_width * u.arcsec)
 
     # Exclude any entries with missing RA or Dec values
     radec_mask = filter_bad_ra_dec(query_table)
@@ -477,7 +540,7 @@ def twoMASS_plus_background(ra, dec, box_width, kmag_limits=(17, 29), email='',
 
 
 def get_all_catalogs(ra, dec, box_width, kmag_limits=(13, 29), email='', instrument='NIRISS', filters=[],
-                     besancon_seed=None):
+                     besancon_seed=None, besancon_result=None):
     """
     This is a driver function to query the GAIA/2MASS/WISE catalogues
     plus the Besancon model and combine these into a single JWST source list.
@@ -522,6 +585,11 @@ def get_all_catalogs(ra, dec, box_width, kmag_limits=(13, 29), email='', instrum
             Seed to use in the random number generator when choosing RA and
             Dec values for Besancon sources.
 
+        besancon_result : tuple
+            (catalog, model table) of Besancon stars covering the field, as
+            returned by ``besancon``. If given, the Besancon model is not
+            queried. The catalog is modified in place.
+
     Returns
     -------
         source_list : mirage.catalogs.create_catalogs.PointSourceCatalog
@@ -544,8 +612,10 @@ def get_all_catalogs(ra, dec, box_width, kmag_limits=(13, 29), email='', instrum
         gaia_wise_crossref = query_GAIA_ptsrc_catalog(outra, outdec, box_width)
     twomass_cat, twomass_cols = query_2MASS_ptsrc_catalog(outra, outdec, box_width)
     wise_cat, wise_cols = query_WISE_ptsrc_catalog(outra, outdec, box_width)
-    besancon_cat, besancon_model = besancon(outra, outdec, box_width,
-                                            email=email, kmag_limits=kmag_limits, seed=besancon_seed)
+    if besancon_result is None:
+        besancon_result = besancon(outra, outdec, box_width, email=email, kmag_limits=kmag_limits,
+                                   seed=besancon_seed)
+    besancon_cat, besancon_model = besancon_result
     besancon_jwst = transform_besancon(besancon_cat, besancon_model, filter_names)
     if len(filter_names) != len(filters):
         newfilters = []
@@ -604,28 +674,26 @@ def transform_besancon(besancon_cat, besancon_model, filter_names):
     nfilters = len(filter_names)
     out_magnitudes = np.zeros((nstars, nfilters), dtype=np.float32)
     inds = crossmatch_filter_names(filter_names, standard_filters)
-    in_magnitudes = np.zeros((4), dtype=np.float32)
     vmags = besancon_model['V'].data
     kmags = (besancon_model['V'] - besancon_model['V-K']).data
     jmags = kmags + besancon_model['J-K'].data
     hmags = jmags - besancon_model['J-H'].data
     lmags = jmags - besancon_model['J-L'].data
     in_filters = ['Johnson V', 'Johnson J', 'Johnson H', 'Johnson K']
-    for loop in range(nstars):
-        # Exclude any bad values returned by the Besancon query
-        if vmags[loop] < 90:
-            in_magnitudes[0] = vmags[loop]
-            in_magnitudes[1] = jmags[loop]
-            in_magnitudes[2] = hmags[loop]
-            in_magnitudes[3] = kmags[loop]
-            newmags = match_model_magnitudes(in_magnitudes, in_filters, standard_magnitudes, standard_values,
-                                             standard_filters, standard_labels)
-            if newmags is None:
-                return None
-            newmags = besancon_model['Av'][loop]*standard_values[3, :] + newmags
-            out_magnitudes[loop, :] = newmags[inds]
-        else:
-            out_magnitudes[loop, :] = np.repeat(99., len(inds))
+
+    # Exclude any bad values returned by the Besancon query
+    good = vmags < 90
+    out_magnitudes[~good, :] = 99.
+    if np.any(good):
+        in_magnitudes = np.array([vmags[good], jmags[good], hmags[good], kmags[good]],
+                                 dtype=np.float32).transpose()
+        newmags = match_model_magnitude_array(in_magnitudes, in_filters, standard_magnitudes, standard_values,
+                                              standard_filters, standard_labels)
+        if newmags is None:
+            return None
+        extinction = np.asarray(besancon_model['Av'])[good]
+        newmags = extinction[:, np.newaxis] * standard_values[3, :] + newmags
+        out_magnitudes[good, :] = newmags[:, inds]
     return out_magnitudes
 
 
@@ -786,6 +854,64 @@ def match_model_magnitudes(in_magnitudes, in_filters, standard_magnitudes,
     return out_magnitudes
 
 
+def match_model_magnitude_array(in_magnitudes, in_filters, standard_magnitudes,
+                                standard_values, standard_filters, standard_labels):
+    """
+    Batched version of ``match_model_magnitudes``, matching each row of a
+    2D array of input magnitudes to the BOSZ model with the smallest
+    root-mean-square deviation.
+
+    Parameters
+    ----------
+    in_magnitudes : numpy.ndarray
+        2D array (sources x filters) of (A0V) magnitude values to match.
+
+    in_filters : list
+        The labels for the magnitudes.
+
+    standard_magntudes : numpy,ndarray
+        2D array of standard simulated magnitude values.
+
+    standard_values : numpy.ndarray
+        2D array of other filter values (wavelengths,
+        zero magnitude flux density values, extinction)
+
+    standard_filters : list
+        The list of the standard magnitude filter names
+
+    standard_labels : list
+        The labels for the input stellar atmosphere models
+        used to calculate the standard magnitudes.
+
+    Returns
+    -------
+    out_magnitudes : numpy.ndarray or None
+        2D array (sources x standard filters) of the full set of estimated
+        magnitudes from the model matching, or None if a problem occurs.
+    """
+    inds = crossmatch_filter_names(in_filters, standard_filters)
+    nmatch = float(len(inds))
+    if nmatch != len(in_filters):
+        print('Error in matching the requested filters for model matching.')
+        return None
+    subset = np.copy(standard_magnitudes[:, inds])
+    out_magnitudes = np.zeros((in_magnitudes.shape[0], standard_magnitudes.shape[1]))
+
+    # Limit the size of the (sources x models x filters) arrays
+    chunk = max(1, 2000000 // max(subset.size, 1))
+    for start in range(0, in_magnitudes.shape[0], chunk):
+        mags = in_magnitudes[start:start + chunk, np.newaxis, :]
+        offset = np.mean(subset[np.newaxis, :, :] - mags, axis=2)
+        delm = subset[np.newaxis, :, :] - offset[:, :, np.newaxis] - mags
+        rms = np.sqrt(np.sum(delm * delm, axis=2) / nmatch)
+        rms[~(rms < 1.e+20)] = np.inf
+        nmin = np.argmin(rms, axis=1)
+        omin = offset[np.arange(len(nmin)), nmin]
+        omin[np.isinf(rms[np.arange(len(nmin)), nmin])] = 0.
+        out_magnitudes[start:start + chunk] = standard_magnitudes[nmin, :] - omin[:, np.newaxis]
+    return out_magnitudes
+
+
 def read_standard_magnitudes():
     """
     The code reads a file magslist_bosz_normal_mirage1.new to get the simulated
@@ -1041,10 +1167,8 @@ def combine_and_interpolate(gaia_cat, gaia_2mass, gaia_2mass_crossref, gaia_wise
     if len(inds) == 1:
         out_wavelengths = np.zeros((1), dtype=np.float32)+out_wavelengths
     nfinal = noff + n1
-    for loop in range(nfinal):
-        values = interpolate_magnitudes(in_wavelengths, in_magnitudes[loop, :],
-                                        out_wavelengths, out_filter_names)
-        out_magnitudes[loop, :] = np.copy(values)
+    out_magnitudes[0:nfinal, :] = interpolate_magnitude_array(in_wavelengths, in_magnitudes[0:nfinal, :],
+                                                              out_wavelengths, out_filter_names)
     raout = np.copy(raout[0:nfinal])
     decout = np.copy(decout[0:nfinal])
     out_magnitudes = np.copy(out_magnitudes[0:nfinal, :])
@@ -1069,6 +1193,9 @@ def twomass_crossmatch(gaia_cat, gaia_2mass, gaia_2mass_crossref, twomass_cat):
     Take the GAIA to 2MASS cross references and make sure that there is only
     one GAIA source cross-matched to a given 2MASS source in the table.
 
+    Sources are related through dictionaries keyed on designation, so the
+    run time scales linearly with the size of the catalogs.
+
     Parameters
     ----------
     gaia_cat : astropy.table.Table
@@ -1091,66 +1218,73 @@ def twomass_crossmatch(gaia_cat, gaia_2mass, gaia_2mass_crossref, twomass_cat):
                     GAIA source in the main GAIA table, or a value of -10
                     where there is no match
     """
-    ntable1 = len(gaia_cat['designation'])
     ntable2 = len(gaia_2mass['ra'])
-    ntable3 = len(gaia_2mass_crossref['designation'])
     ntable4 = len(twomass_cat['ra'])
-    ngaia2mass = np.zeros((ntable2), dtype=np.int16) - 10
-    ngaia2masscr = np.zeros((ntable4), dtype=np.int16) - 10
-    for loop in range(ntable2):
-        # find the number of entries of each 2MASS source in the cross references
-        nmatch = 0
-        namematch = []
-        match1 = []
-        for l1 in range(ntable3):
-            if gaia_2mass['designation'][loop] == gaia_2mass_crossref['designation_2'][l1]:
-                nmatch = nmatch + 1
-                namematch.append(gaia_2mass_crossref['designation'][l1])
-                match1.append(loop)
-        # Find the matching GAIA sources and select the one with the best
-        # magnitude match within a radius of 0.3 arc-seconds of the 2MASS
-        # position.
-        magkeys = ['j_m', 'h_m', 'ks_m']
-        if nmatch > 0:
-            mindelm = 10000.0
-            ncross = -10
-            for l1 in range(nmatch):
-                for l2 in range(ntable1):
-                    gmag = 0.
-                    irmag = -10000.0
-                    if gaia_cat['designation'][l2] == namematch[l1]:
-                        ra1 = gaia_cat['ra'][l2]
-                        dec1 = gaia_cat['dec'][l2]
-                        ra2 = gaia_2mass['ra'][match1[l1]]
-                        dec2 = gaia_2mass['dec'][match1[l1]]
-                        p1 = SkyCoord(ra1*u.deg, dec1*u.deg)
-                        p2 = SkyCoord(ra2*u.deg, dec2*u.deg)
-                        if p2.separation(p1).arcsec < 0.3:
-                            gmag = gaia_cat['phot_g_mean_mag'][l2]
-                            # select 2MASS magnitude: first ph_qual = A or if none
-                            # is of quality A the first ph_qual = B or if none is
-                            # of quality A or B then the first non U value.
-                            for l3 in range(3):
-                                if (irmag < -100.) and (gaia_2mass['ph_qual'][match1[l1]].decode()[l3:l3+1] == "A"):
-                                    irmag = gaia_2mass[magkeys[l3]][match1[l1]]
-                            for l3 in range(3):
-                                if (irmag < -100.) and (gaia_2mass['ph_qual'][match1[l1]].decode()[l3:l3+1] == "B"):
-                                    irmag = gaia_2mass[magkeys[l3]][match1[l1]]
-                            for l3 in range(3):
-                                if (irmag < -100.) and (gaia_2mass['ph_qual'][match1[l1]].decode()[l3:l3+1] != "U"):
-                                    irmag = gaia_2mass[magkeys[l3]][match1[l1]]
-                            delm = gmag - irmag
-                            if (delm > -1.2) and (delm < 30.0):
-                                if delm < mindelm:
-                                    ncross = l2
-                                    mindelm = delm
-                ngaia2mass[loop] = ncross
+    ngaia2mass = np.zeros((ntable2), dtype=np.int32) - 10
+    ngaia2masscr = np.zeros((ntable4), dtype=np.int32) - 10
+
+    # GAIA names cross-referenced to each 2MASS name, and the GAIA table
+    # rows with each GAIA name, in table order
+    crossref_names = _designation_index(gaia_2mass_crossref['designation_2'],
+                                        values=gaia_2mass_crossref['designation'])
+    gaia_rows = _designation_index(gaia_cat['designation'])
+
+    # Candidate (2MASS, GAIA) pairs, in the order in which they were
+    # considered by the original nested loops
+    candidates = []
+    for loop, name in enumerate(_designation_list(gaia_2mass['designation'])):
+        for gaia_name in crossref_names.get(name, []):
+            for l2 in gaia_rows.get(gaia_name, []):
+                candidates.append((loop, l2))
+
+    if len(candidates) > 0:
+        candidates = np.array(candidates)
+        p1 = SkyCoord(np.asarray(gaia_cat['ra'])[candidates[:, 1]] * u.deg,
+                      np.asarray(gaia_cat['dec'])[candidates[:, 1]] * u.deg)
+        p2 = SkyCoord(np.asarray(gaia_2mass['ra'])[candidates[:, 0]] * u.deg,
+                      np.asarray(gaia_2mass['dec'])[candidates[:, 0]] * u.deg)
+        close = p2.separation(p1).arcsec < 0.3
+    else:
+        close = []
+
+    # Find the matching GAIA sources and select the one with the best
+    # magnitude match within a radius of 0.3 arc-seconds of the 2MASS
+    # position.
+    magkeys = ['j_m', 'h_m', 'ks_m']
+    mindelm = {}
+    for (loop, l2), is_close in zip(candidates, close):
+        if not is_close:
+            continue
+        gmag = gaia_cat['phot_g_mean_mag'][l2]
+        # select 2MASS magnitude: first ph_qual = A or if none
+        # is of quality A the first ph_qual = B or if none is
+        # of quality A or B then the first non U value.
+        ph_qual = gaia_2mass['ph_qual'][loop]
+        if isinstance(ph_qual, bytes):
+            ph_qual = ph_qual.decode()
+        irmag = -10000.0
+        for l3 in range(3):
+            if (irmag < -100.) and (ph_qual[l3:l3+1] == "A"):
+                irmag = gaia_2mass[magkeys[l3]][loop]
+        for l3 in range(3):
+            if (irmag < -100.) and (ph_qual[l3:l3+1] == "B"):
+                irmag = gaia_2mass[magkeys[l3]][loop]
+        for l3 in range(3):
+            if (irmag < -100.) and (ph_qual[l3:l3+1] != "U"):
+                irmag = gaia_2mass[magkeys[l3]][loop]
+        delm = gmag - irmag
+        if (delm > -1.2) and (delm < 30.0):
+            if delm < mindelm.get(loop, 10000.0):
+                ngaia2mass[loop] = l2
+                mindelm[loop] = delm
+
     # Now locate the 2MASS sources in the IPAC 2MASS table, and put in the
-    # index values.
-    for loop in range(ntable4):
-        for n1 in range(ntable2):
-            if twomass_cat['designation'][loop] == gaia_2mass['designation'][n1]:
-                ngaia2masscr[loop] = ngaia2mass[n1]
+    # index values. Where a designation appears more than once in the GAIA
+    # 2MASS table, the last entry is used.
+    twomass_rows = {name: n1 for n1, name in enumerate(_designation_list(gaia_2mass['designation']))}
+    for loop, name in enumerate(_designation_list(twomass_cat['designation'])):
+        if name in twomass_rows:
+            ngaia2masscr[loop] = ngaia2mass[twomass_rows[name]]
     return ngaia2masscr
 
 
@@ -1160,6 +1294,10 @@ def wise_crossmatch(gaia_cat, gaia_wise, gaia_wise_crossref, wise_cat, twomass_c
     change a little between the different catalogues.  Return the boolean list of matches and
     the index values in wise_cat.
 
+    GAIA sources are located through a dictionary keyed on designation, and
+    2MASS counterparts through a sorted array of J magnitudes, so the run
+    time scales with the size of the catalogs rather than their product.
+
     Parameters
     ----------
     gaia_cat : astropy.table.Table
@@ -1195,41 +1333,165 @@ def wise_crossmatch(gaia_cat, gaia_wise, gaia_wise_crossref, wise_cat, twomass_c
         the 2MASS number to which the WISE source corresponds)
     """
     num_entries = len(wise_cat['ra'])
-    num_gaia = len(gaia_cat['ra'])
     matchwise = [False] * num_entries
     gaiawiseinds = [-1] * num_entries
     twomasswiseinds = [-1] * num_entries
     ra1 = np.copy(wise_cat['ra'])
     dec1 = np.copy(wise_cat['dec'])
-    ra2 = np.copy(gaia_wise['ra'])
-    dec2 = np.copy(gaia_wise['dec'])
     ra3 = np.copy(gaia_wise_crossref['ra'])
     dec3 = np.copy(gaia_wise_crossref['dec'])
     sc1 = SkyCoord(ra=ra1*u.degree, dec=dec1*u.degree)
-    sc2 = SkyCoord(ra=ra2*u.degree, dec=dec2*u.degree)
     sc3 = SkyCoord(ra=ra3*u.degree, dec=dec3*u.degree)
-    n2mass = len(twomass_cat['ra'])
-    # look at the WISE data and find the sources with listed 2MASS counterparts
+
+    # look at the WISE data and find the sources with listed 2MASS
+    # counterparts, i.e. the first 2MASS source with J, H, and K all
+    # within 0.001 magnitudes of the 2MASS values listed in the WISE table
+    twomass_mags = [_filled_float(twomass_cat[key]) for key in ['j_m', 'h_m', 'k_m']]
+    wise_mags = [_filled_float(wise_cat[key]) for key in ['j_m_2mass', 'h_m_2mass', 'k_m_2mass']]
+    j_order = np.argsort(twomass_mags[0], kind='stable')
+    j_sorted = twomass_mags[0][j_order]
+    first = np.searchsorted(j_sorted, wise_mags[0] - 0.001, side='left')
+    last = np.searchsorted(j_sorted, wise_mags[0] + 0.001, side='right')
     for loop in range(num_entries):
-        if not np.isnan(wise_cat['h_m_2mass'][loop]):
-            for n1 in range(n2mass):
-                if (abs(twomass_cat['j_m'][n1] - wise_cat['j_m_2mass'][loop]) < 0.001) and \
-                   (abs(twomass_cat['h_m'][n1] - wise_cat['h_m_2mass'][loop]) < 0.001) and \
-                   (abs(twomass_cat['k_m'][n1] - wise_cat['k_m_2mass'][loop]) < 0.001):
-                    twomasswiseinds[loop] = n1
-                    break
+        if np.isnan(wise_mags[1][loop]):
+            continue
+        for n1 in np.sort(j_order[first[loop]:last[loop]]):
+            if all([abs(twomass_mags[i][n1] - wise_mags[i][loop]) < 0.001 for i in range(3)]):
+                twomasswiseinds[loop] = int(n1)
+                break
+
     # match WISE to gaia_wise by position
-    idx, d2d, d3d = sc3.match_to_catalog_sky(sc1)
+    gaia_rows = _designation_index(gaia_cat['designation'])
+    crossref_names = _designation_list(gaia_wise_crossref['designation'])
+    if len(sc3) > 0 and len(sc1) > 0:
+        idx, d2d, d3d = sc3.match_to_catalog_sky(sc1)
+    else:
+        idx, d2d = [], []
     for loop in range(len(idx)):
         if (d2d[loop].arcsec) < 0.4:
             matchwise[idx[loop]] = True
-            for n2 in range(num_gaia):
-                if gaia_cat['designation'][n2] == gaia_wise_crossref['designation'][loop]:
-                    gaiawiseinds[idx[loop]] = n2
-                    break
+            if crossref_names[loop] in gaia_rows:
+                gaiawiseinds[idx[loop]] = gaia_rows[crossref_names[loop]][0]
     return matchwise, gaiawiseinds, twomasswiseinds
 
 
+def _designation_index(designations, values=None):
+    """Create a dictionary mapping each designation to the list of table
+    rows (or associated values) with that designation, in table order
+
+    Parameters
+    ----------
+    designations : astropy.table.Column
+        Source designations
+
+    values : astropy.table.Column
+        Values to list for each designation. If None, the row indexes are
+        listed.
+
+    Returns
+    -------
+    index : dict
+        Lists of rows or values, keyed by designation
+    """
+    index = {}
+    if values is None:
+        values = range(len(designations))
+    else:
+        values = _designation_list(values)
+    for name, value in zip(_designation_list(designations), values):
+        index.setdefault(name, []).append(value)
+    return index
+
+
+def _designation_list(designations):
+    """Convert a column of designations into a list of hashable values"""
+    return np.asarray(designations).tolist()
+
+
+def _filled_float(column):
+    """Return a column as a float array, with masked entries set to NaN"""
+    if hasattr(column, 'filled'):
+        column = column.astype(float).filled(np.nan)
+    return np.asarray(column, dtype=float)
+
+
+def interpolate_magnitude_array(wl1, magnitudes, wl2, filternames):
+    """
+    Batched version of ``interpolate_magnitudes``. Sources are grouped by
+    which case applies to them (no data, GAIA magnitudes only, or some
+    infrared magnitudes), and by which input magnitudes are available, and
+    each group is transformed or interpolated in a single vectorized
+    operation.
+
+    Parameters
+    ----------
+    wl1 : numpy.ndarray
+        The pivot wavelengths, in microns, for the input filters.  The
+        values need to be sorted before passing to the routine.
+
+    magnitudes : numpy.ndarray
+        2D array (sources x input filters) of the associated magnitudes
+        (A0V by assumption).  Values > 100. indicate "no data". NaN
+        values are replaced by 10000. in place.
+
+    wl2 : numpy.ndarray
+        The pivot wavelengths, in microns, for the output filters
+
+    filternames : list
+        The names of the output filters, used when the GAIA blue/red
+        magnitudes are available but no near-infrared magnitudes
+        are available.
+
+    Returns
+    -------
+    out_magnitudes : numpy.ndarray
+        2D array (sources x output filters) of the output interpolated
+        magnitudes corresponding to the wavelengths.
+    """
+    wl1 = np.asarray(wl1)
+    wl2 = np.atleast_1d(wl2)
+    magnitudes[np.isnan(magnitudes)] = 10000.
+    nsources = magnitudes.shape[0]
+    outmags = np.zeros((nsources, len(wl2))) + 10000.
+
+    # Case 1:  All dummy values, output magnitudes = 10000.0 (this should
+    #          not happen)
+    good = magnitudes < 100.
+    has_data = np.any(good, axis=1)
+
+    # Case 2,  Only GAIA magnitudes.  Either transform from the GAIA BP and RP
+    #          colour to the JWST magnitudes or assume a default colour value
+    #          for the star, equivalent to a star of type K4V.
+    gaia_only = has_data & ~np.any(good[:, 3:], axis=1)
+    if np.any(gaia_only):
+        gaia_mags = magnitudes[gaia_only]
+        inmags = gaia_mags[:, [0, 2]].astype(np.float32)
+        # Where the BP and RP magnitudes are not available, make colours
+        # matching a K4V star (assumed T=4500, log(g)=5.0)
+        no_colour = (gaia_mags[:, 0] > 100.) | (gaia_mags[:, 2] > 100.)
+        inmags[no_colour, 0] = gaia_mags[no_colour, 1] + 0.5923
+        inmags[no_colour, 1] = gaia_mags[no_colour, 1] - 0.7217
+        standard_magnitudes, standard_values, standard_filters, standard_labels = read_standard_magnitudes()
+        in_filters = ['GAIA gbp', 'GAIA grp']
+        newmags = match_model_magnitude_array(inmags, in_filters, standard_magnitudes, standard_values,
+                                              standard_filters, standard_labels)
+        inds = crossmatch_filter_names(filternames, standard_filters)
+        outmags[gaia_only] = newmags[:, inds]
+
+    # Case 3, some infrared magnitudes are available, interpolate good values
+    # (magnitude = 10000 for bad values). Sources with the same set of good
+    # values share the interpolation weights.
+    infrared = has_data & ~gaia_only
+    if np.any(infrared):
+        rows = np.where(infrared)[0]
+        patterns, pattern_index = np.unique(good[rows], axis=0, return_inverse=True)
+        pattern_index = np.ravel(pattern_index)
+        for i, pattern in enumerate(patterns):
+            group = rows[pattern_index == i]
+            outmags[group] = _interpolate_rows(wl2, wl1[pattern], magnitudes[group][:, pattern])
+    return outmags
+
+
 def interpolate_magnitudes(wl1, mag1, wl2, filternames):
     """
     Given an input set of magnitudes and associated wavelengths, interpolate
@@ -1248,6 +1510,8 @@ def interpolate_magnitudes(wl1, mag1, wl2, filternames):
 
     The input magnitudes must be A0V magnitudes not AB or ST magnitudes.
 
+    To transform many sources, use ``interpolate_magnitude_array``.
+
     Parameters
     ----------
     wl1 : numpy.ndarray
@@ -1272,40 +1536,42 @@ def interpolate_magnitudes(wl1, mag1, wl2, filternames):
         The output interpolated magnitudes corresponding to the
         wavelengths.
     """
-    inds = np.isnan(mag1)
-    mag1[inds] = 10000.
-    nout = len(wl2)
-    outmags = wl2*0.+10000.
-    # Case 1:  All dummy values, return all magnitudes = 10000.0 (this should
-    #          not happen)
-    if np.min(mag1) > 100.:
-        return outmags
-    # Case 2,  Only GAIA magnitudes.  Either transform from the GAIA BP and RP
-    #          colour to the JWST magnitudes or assume a default colour value
-    #          for the star, equivalent to a star of type K4V.
-    if np.min(mag1[3:]) > 100.:
-        if (mag1[0] > 100.) or (mag1[2] > 100.):
-            # Where the BP and RP magnitudes are not available, make colours
-            # matching a K4V star (assumed T=4500, log(g)=5.0)
-            inmags = np.zeros((2), dtype=np.float32)
-            inmags[0] = mag1[1] + 0.5923
-            inmags[1] = mag1[1] - 0.7217
-        else:
-            inmags = np.copy(mag1[[0, 2]])
-        standard_magnitudes, standard_values, standard_filters, standard_labels = read_standard_magnitudes()
-        in_filters = ['GAIA gbp', 'GAIA grp']
-        newmags = match_model_magnitudes(inmags, in_filters, standard_magnitudes, standard_values,
-                                         standard_filters, standard_labels)
-        inds = crossmatch_filter_names(filternames, standard_filters)
-        outmags = np.copy(newmags[inds])
-        return outmags
-    # Case 3, some infrared magnitudes are available, interpolate good values
-    # (magnitude = 10000 for bad values)
-    inds = np.where(mag1 < 100.)
-    inmags = mag1[inds]
-    inwl = wl1[inds]
-    outmags = np.interp(wl2, inwl, inmags)
-    return outmags
+    mag1[np.isnan(mag1)] = 10000.
+    return interpolate_magnitude_array(wl1, mag1[np.newaxis, :], wl2, filternames)[0]
+
+
+def _interpolate_rows(x, xp, fp):
+    """Linearly interpolate each row of fp, sampled at xp, onto x, with the
+    same conventions as numpy.interp (values outside xp take the value at
+    the nearest end point)
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        1D array of points at which to interpolate
+
+    xp : numpy.ndarray
+        1D array of increasing sample points
+
+    fp : numpy.ndarray
+        2D array (rows x len(xp)) of values at the sample points
+
+    Returns
+    -------
+    values : numpy.ndarray
+        2D array (rows x len(x)) of interpolated values
+    """
+    fp = np.asarray(fp, dtype=np.float64)
+    xp = np.asarray(xp, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    if len(xp) == 1:
+        return np.repeat(fp, len(x), axis=1)
+    lower = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    slope = (fp[:, lower + 1] - fp[:, lower]) / (xp[lower + 1] - xp[lower])
+    values = slope * (x - xp[lower]) + fp[:, lower]
+    values[:, x <= xp[0]] = fp[:, [0]]
+    values[:, x >= xp[-1]] = fp[:, [-1]]
+    return values
 
 
 def make_filter_names(instrument, filters):
@@ -1745,10 +2011,14 @@ def query_GAIA_ptsrc_catalog(ra, dec, box_width):
         """.format(ra, dec, boxwidth, boxwidth)
 
     outvalues = {}
+    cache = get_catalog_cache()
     print('Searching the GAIA DR2 catalog')
     for key in data.keys():
-        job = Gaia.launch_job_async(data[key]['query'], dump_to_file=False)
-        table = job.get_results()
+        if cache is not None:
+            table = cache.query_box(key, ra, dec, box_width)
+        else:
+            job = Gaia.launch_job_async(data[key]['query'], dump_to_file=False)
+            table = job.get_results()
         outvalues[key] = table
         print('Retrieved {} sources for catalog {}'.format(len(table), key))
     gaia_mag_cols = ['phot_g_mean_mag', 'phot_bp_mean_mag', 'phot_rp_mean_mag']
@@ -2041,14 +2311,18 @@ def filter_bad_ra_dec(table_data):
     return position_mask
 
 
-def generate_ra_dec(number_of_stars, ra_min, ra_max, dec_min, dec_max, seed=None):
+def generate_ra_dec(number_of_stars, ra_min, ra_max, dec_min, dec_max, seed=None,
+                    chunk_size=1000000):
     """
     Generate a list of random RA, Dec values in a square region.  Note that
     this assumes a small sky area so that the change in the sky area per
     a degree of right ascension is negligible.  This routine will break down
     at the north or south celestial poles.
-    The np uniform random number generator is used to make the source
-    postions.
+    The source positions are written into the output arrays chunk_size
+    values at a time, so that very large numbers of positions can be made
+    without large temporary copies. An integer seed gives the same
+    positions as earlier versions of Mirage, which seeded numpy's global
+    random state, but the global state is no longer changed.
 
     Parameters
     ----------
@@ -2067,8 +2341,13 @@ def generate_ra_dec(number_of_stars, ra_min, ra_max, dec_min, dec_max, seed=None
         dec_max : float
             The minimum Dec value of the area, in degrees
 
-        seed : int
-            Optional seed for random number generator
+        seed : int or numpy.random.Generator
+            Optional seed for a numpy.random.RandomState, or a
+            numpy.random.Generator to use. If None, numpy's global random
+            state is used.
+
+        chunk_size : int
+            Number of values generated at a time
 
     Returns
     -------
@@ -2078,19 +2357,36 @@ def generate_ra_dec(number_of_stars, ra_min, ra_max, dec_min, dec_max, seed=None
         dec_list : numpy.ndarray
             The list of output Dec values in degrees.
     """
+    unit = None
+    if isinstance(ra_min, u.Quantity):
+        unit = ra_min.unit
+        ra_min, ra_max, dec_min, dec_max = [value.to(unit).value for value in
+                                            [ra_min, ra_max, dec_min, dec_max]]
     delta_ra = ra_max - ra_min
     delta_dec = dec_max - dec_min
 
-    # If a seed is provided, seed the generator
-    if seed is not None:
-        np.random.seed(seed)
-
-    # Generate random numbers
-    numbers = np.random.random(2 * number_of_stars)
+    if isinstance(seed, np.random.Generator):
+        generator = seed
+    else:
+        generator = None
+        random = np.random if seed is None else np.random.RandomState(seed)
+
+    # Create RA and Dec values in place. All RA values are drawn before
+    # the Dec values, as in a single draw of 2 * number_of_stars values.
+    ra_list = np.empty(number_of_stars)
+    dec_list = np.empty(number_of_stars)
+    for values, delta, minimum in [(ra_list, delta_ra, ra_min), (dec_list, delta_dec, dec_min)]:
+        for start in range(0, number_of_stars, chunk_size):
+            chunk = values[start:start + chunk_size]
+            if generator is not None:
+                generator.random(out=chunk)
+            else:
+                chunk[:] = random.random_sample(len(chunk))
+            chunk *= delta
+            chunk += minimum
 
-    # Create RA and Dec values
-    ra_list = numbers[0: number_of_stars] * delta_ra + ra_min
-    dec_list = numbers[number_of_stars:] * delta_dec + dec_min
+    if unit is not None:
+        return ra_list * unit, dec_list * unit
     return ra_list, dec_list
 
 
@@ -2204,9 +2500,7 @@ def galaxy_background(ra0, dec0, v3rotangle, box_width, instrument, filters,
                   'niriss_f430m_magnitude': 28, 'niriss_f444w_magnitude': 21,
                   'niriss_f480m_magnitude': 30, 'guider1_magnitude': 11,
                   'guider2_magnitude': 11}
-    module_path = pkg_resources.resource_filename('mirage', '')
-    catalog_file = os.path.join(module_path, 'config/goodss_3dhst.v4.1.jwst_galfit.cat')
-    catalog_values = np.loadtxt(catalog_file, comments='#')
+    catalog_values, magnitude_order = read_goodss_catalog()
     outinds = np.zeros((nfilters), dtype=np.int16)
     try:
         loop = 0
@@ -2223,11 +2517,9 @@ def galaxy_background(ra0, dec0, v3rotangle, box_width, instrument, filters,
     sersicerrorinds = [60, 62, 64, 66]
     ncat = catalog_values.shape[0]
     select = np.random.random(ncat)
-    magselect = np.copy(catalog_values[:, filterinds['niriss_f200w_magnitude']+8])
-    outputinds = []
-    for loop in range(ncat):
-        if (magselect[loop] >= brightlimit) and (select[loop] < threshold):
-            outputinds.append(loop)
+    magselect = catalog_values[magnitude_order, GOODSS_F200W_COLUMN]
+    faint = magnitude_order[np.searchsorted(magselect, brightlimit, side='left'):]
+    outputinds = np.sort(faint[select[faint] < threshold])
     nout = len(outputinds)
     if boxflag:
         delx0 = (-0.5+np.random.random(nout))*box_width/3600.
@@ -2239,10 +2531,7 @@ def galaxy_background(ra0, dec0, v3rotangle, box_width, instrument, filters,
         angle = 2.*math.pi*np.random.random(nout)
     delx = radius*np.cos(angle)
     dely = radius*np.sin(angle)
-    raout = delx * 0.
-    decout = dely * 0.
-    for loop in range(len(delx)):
-        raout[loop], decout[loop] = deproject_from_tangent_plane(delx[loop], dely[loop], ra0, dec0)
+    raout, decout = deproject_from_tangent_plane(delx, dely, ra0, dec0)
     rot1 = 360.*np.random.random(nout)-180.
     rout = np.copy(catalog_values[outputinds, sersicinds[0]])
     drout = np.copy(catalog_values[outputinds, sersicerrorinds[0]])
@@ -2259,11 +2548,8 @@ def galaxy_background(ra0, dec0, v3rotangle, box_width, instrument, filters,
     paout = np.copy(catalog_values[outputinds, sersicinds[3]])
     dpaout = np.copy(catalog_values[outputinds, sersicinds[3]])
     paout = paout+dpaout*np.random.normal(0., 1., nout)
-    for loop in range(len(paout)):
-        if paout[loop] < -180.:
-            paout[loop] = paout[loop]+360.
-        if paout[loop] > 180.:
-            paout[loop] = paout[loop]-360.
+    paout[paout < -180.] += 360.
+    paout[paout > 180.] -= 360.
     galaxy_cat = GalaxyCatalog(ra=raout, dec=decout, ellipticity=elout,
                                radius=rout, sersic_index=sindout,
                                position_angle=paout, radius_units='arcsec')
@@ -2284,3 +2570,59 @@ def galaxy_background(ra0, dec0, v3rotangle, box_width, instrument, filters,
                                         filter_name=filter_name,
                                         magnitude_system='abmag')
     return galaxy_cat, seedvalue
+
+
+def read_goodss_catalog(catalog_file=None):
+    """Read the GOODS-S galaxy catalog used by ``galaxy_background``.
+
+    The ascii catalog is converted once into binary numpy files stored
+    alongside it (if that directory is writable): the catalog values, and
+    the order of the rows sorted by F200W magnitude. Later calls memory-map
+    these files, and results are also kept in memory for the rest of the
+    session.
+
+    Parameters
+    ----------
+    catalog_file : str
+        Name of the ascii GOODS-S catalog. If None, the catalog in the
+        Mirage config directory is used.
+
+    Returns
+    -------
+    catalog_values : numpy.ndarray
+        2D array of catalog values (galaxies x columns)
+
+    magnitude_order : numpy.ndarray
+        Indexes of the rows with finite F200W magnitudes, sorted by
+        increasing F200W magnitude
+    """
+    if catalog_file is None:
+        module_path = pkg_resources.resource_filename('mirage', '')
+        catalog_file = os.path.join(module_path, 'config/goodss_3dhst.v4.1.jwst_galfit.cat')
+    mtime = os.path.getmtime(catalog_file)
+    if catalog_file in _GOODSS_CATALOG and _GOODSS_CATALOG[catalog_file][0] == mtime:
+        return _GOODSS_CATALOG[catalog_file][1:]
+
+    base = os.path.splitext(catalog_file)[0]
+    values_file = '{}_values.npy'.format(base)
+    order_file = '{}_f200w_order.npy'.format(base)
+    if (os.path.isfile(values_file) and os.path.isfile(order_file)
+            and os.path.getmtime(values_file) >= mtime and os.path.getmtime(order_file) >= mtime):
+        catalog_values = np.load(values_file, mmap_mode='r')
+        magnitude_order = np.load(order_file)
+    else:
+        catalog_values = np.loadtxt(catalog_file, comments='#')
+        magnitudes = catalog_values[:, GOODSS_F200W_COLUMN]
+        finite = np.where(np.isfinite(magnitudes))[0]
+        magnitude_order = finite[np.argsort(magnitudes[finite], kind='stable')]
+        try:
+            for filename, data in [(values_file, catalog_values), (order_file, magnitude_order)]:
+                temp_file = '{}.{}.tmp.npy'.format(filename[:-4], os.getpid())
+                np.save(temp_file, data)
+                os.replace(temp_file, filename)
+        except OSError:
+            print('Unable to save binary copy of {}. It will be read from ascii each session.'
+                  .format(catalog_file))
+
+    _GOODSS_CATALOG[catalog_file] = (mtime, catalog_values, magnitude_order)
+    return catalog_values, magnitude_order
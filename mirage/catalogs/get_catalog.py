@@ -36,6 +36,7 @@ from astropy.coordinates import SkyCoord
 from astroquery.vizier import Vizier
 
 from ..apt import apt_inputs
+from .catalog_cache import get_catalog_cache
 
 SCRIPTS_DIR = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 PACKAGE_DIR = os.path.dirname(SCRIPTS_DIR)
@@ -117,10 +118,15 @@ def get_sw_catalog(target_coords, search_radius=15 * u.arcmin):
             continue
 
         # If not, query shortwave sources from the 2MASS catalog from Vizier
-        v = Vizier(catalog='II/246/out', columns=['_RAJ2000', '_DEJ2000', 'Kmag'])
-        v.ROW_LIMIT = -1
-        result = v.query_region(t, radius=search_radius)
-        queried_catalog_sw = result['II/246/out']
+        cache = get_catalog_cache()
+        if cache is not None:
+            queried_catalog_sw = cache.query_cone('II/246/out', t.ra.deg, t.dec.deg,
+                                                  search_radius.to(u.arcsec).value)
+        else:
+            v = Vizier(catalog='II/246/out', columns=['_RAJ2000', '_DEJ2000', 'Kmag'])
+            v.ROW_LIMIT = -1
+            result = v.query_region(t, radius=search_radius)
+            queried_catalog_sw = result['II/246/out']
 
         print('Queried {} 2MASS objects within {} {} of RA, Dec ({:.2f}, {:.2f}).'.
               format(len(queried_catalog_sw), search_radius.value,
@@ -183,10 +189,15 @@ def get_lw_catalog(target_coords, search_radius=15 * u.arcmin):
             continue
 
         # If not, query longwave sources from the WISE catalog from Vizier
-        v = Vizier(catalog='II/328/allwise', columns=['RAJ2000', 'DEJ2000', 'W2mag'])
-        v.ROW_LIMIT = -1
-        result = v.query_region(t, radius=search_radius)
-        queried_catalog_lw = result['II/328/allwise']
+        cache = get_catalog_cache()
+        if cache is not None:
+            queried_catalog_lw = cache.query_cone('II/328/allwise', t.ra.deg, t.dec.deg,
+                                                  search_radius.to(u.arcsec).value)
+        else:
+            v = Vizier(catalog='II/328/allwise', columns=['RAJ2000', 'DEJ2000', 'W2mag'])
+            v.ROW_LIMIT = -1
+            result = v.query_region(t, radius=search_radius)
+            queried_catalog_lw = result['II/328/allwise']
 
         print('Queried {} WISE objects within {} {} of RA, Dec ({:.2f}, {:.2f}).'.
               format(len(queried_catalog_lw), search_radius.value,
@@ -20,15 +20,183 @@ Use
         spectra_dict = hdf5_catalog.open('my_catalog_file.hdf5')
 
         hdf5_catalog.save(spectra_dict, 'my_updated_catalog_file.hdf5')
+
+    For large catalogs, spectra can instead be read on demand:
+
+    ::
+
+        with hdf5_catalog.open('my_catalog_file.hdf5', lazy=True) as spectra:
+            source_spectrum = spectra[42]
 """
 
+from collections.abc import Mapping
+
 import astropy.units as u
 import h5py
 
 from mirage.utils.constants import FLAMBDA_CGS_UNITS, FLAMBDA_MKS_UNITS, FNU_CGS_UNITS, FNU_MKS_UNITS
 
 
-def open(filename):
+class SpectraCatalog(Mapping):
+    """Read-only, dictionary-like view of an hdf5 spectra file. Spectra
+    are read from the file and converted to microns and f_lambda only when
+    they are accessed, so that callers needing a small subset of the
+    sources do not pay for reading the entire file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of hdf5 file
+
+    chunk_cache_bytes : int
+        Size in bytes of the h5py chunk cache used when reading chunked,
+        compressed datasets. If None, the h5py default is used.
+    """
+    def __init__(self, filename, chunk_cache_bytes=None):
+        self.filename = filename
+        file_kwargs = {}
+        if chunk_cache_bytes is not None:
+            file_kwargs['rdcc_nbytes'] = chunk_cache_bytes
+        self._file = h5py.File(filename, 'r', **file_kwargs)
+        self._keys = {int(key): key for key in self._file.keys()}
+        self._warned = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getitem__(self, index):
+        if self._file is None:
+            raise ValueError('{} has been closed.'.format(self.filename))
+        key = self._keys[int(index)]
+        waves, fluxes, missing_units = _read_dataset(self._file[key], key)
+        for missing in set(missing_units) - self._warned:
+            _print_missing_units_message(self.filename, missing)
+            self._warned.add(missing)
+        return {'wavelengths': waves, 'fluxes': fluxes}
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def close(self):
+        """Close the underlying hdf5 file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def subset(self, indexes):
+        """Read the spectra for the given source indexes
+
+        Parameters
+        ----------
+        indexes : list
+            Source index numbers. Indexes not present in the file are
+            ignored.
+
+        Returns
+        -------
+        contents : dict
+            Dictionary in the same format as that returned by ``open``,
+            containing only the requested sources
+        """
+        return {int(index): self[index] for index in indexes if int(index) in self._keys}
+
+
+def _print_missing_units_message(filename, missing):
+    """Print a message noting which units were assumed for a file
+
+    Parameters
+    ----------
+    filename : str
+        Name of hdf5 file
+
+    missing : str
+        'wavelength' or 'flux'
+    """
+    if missing == 'wavelength':
+        print("{}: No wavelength units provided. Assuming MIRCONS.".format(filename))
+    else:
+        print("{}: No flux density units provided. Assuming F_lambda in CGS (erg/sec/cm^2/A)".format(filename))
+
+
+def _read_dataset(dataset, key):
+    """Read a single spectrum from an hdf5 dataset and convert it to
+    microns and f_lambda in cgs units
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        Dataset containing wavelengths in row 0 and fluxes in row 1
+
+    key : str
+        Name of the dataset, used in error messages
+
+    Returns
+    -------
+    waves : astropy.units.Quantity
+        Wavelengths in microns
+
+    fluxes : astropy.units.Quantity
+        Flux densities in f_lambda cgs units (or percent for normalized
+        spectra)
+
+    missing_units : list
+        Contains 'wavelength' and/or 'flux' if the corresponding units
+        were not given in the dataset attributes and defaults were assumed
+    """
+    missing_units = []
+    try:
+        wave_units_string = dataset.attrs['wavelength_units']
+    except KeyError:
+        wave_units_string = 'micron'
+        missing_units.append('wavelength')
+    try:
+        flux_units_string = dataset.attrs['flux_units']
+    except KeyError:
+        flux_units_string = 'flam_cgs'
+        missing_units.append('flux')
+
+    # Catch common errors
+    if wave_units_string.lower() in ['microns', 'angstroms', 'nanometers']:
+        wave_units_string = wave_units_string[0:-1]
+
+    # Convert the unit strings into astropy.units Unit object
+    wave_units = string_to_units(wave_units_string)
+    flux_units = string_to_units(flux_units_string)
+
+    # Get the data
+    data = dataset[()]
+    waves = data[0] * wave_units
+    fluxes = data[1] * flux_units
+
+    # Convert wavelengths to microns and flux values to f_lambda in cgs
+    if wave_units != u.micron:
+        if wave_units.is_equivalent(u.micron):
+            waves = waves.to(u.micron)
+        elif wave_units.is_equivalent(u.Hz):
+            waves = waves.to(u.micron, equivalencies=u.spectral())
+        else:
+            raise ValueError("Wavelength units of {} in dataset {} are not compatible with microns."
+                             .format(wave_units, key))
+    if flux_units != FLAMBDA_CGS_UNITS:
+        if flux_units.is_equivalent(FLAMBDA_CGS_UNITS):
+            fluxes = fluxes.to(FLAMBDA_CGS_UNITS)
+        elif flux_units.is_equivalent(FNU_CGS_UNITS):
+            fluxes = fluxes.to(FLAMBDA_CGS_UNITS, u.spectral_density(waves))
+        elif flux_units == u.pct:
+            pass
+        else:
+            raise ValueError("Flux density units of {} in dataset {} are not compatible with f_lambda."
+                             .format(flux_units, key))
+    return waves, fluxes, missing_units
+
+
+def open(filename, lazy=False, chunk_cache_bytes=None):
     """Read in contents of an hdf5 file
 
     Parameters
@@ -36,6 +204,16 @@ def open(filename):
     filename : str
         Name of file to be opened
 
+    lazy : bool
+        If True, return a ``SpectraCatalog`` that reads each spectrum from
+        the file only when it is accessed, rather than reading all spectra
+        up front. The returned object should be closed (or used as a
+        context manager) when no longer needed.
+
+    chunk_cache_bytes : int
+        Size in bytes of the h5py chunk cache. Only used if ``lazy`` is
+        True.
+
     Returns
     -------
     contents : dict
@@ -47,64 +225,24 @@ def open(filename):
         and a wavelength unit
         'fluxes' is an astropy.units Quantity composed of a list of flux values with flux unit
     """
+    if lazy:
+        return SpectraCatalog(filename, chunk_cache_bytes=chunk_cache_bytes)
+
     contents = {}
+    all_missing_units = set()
     with h5py.File(filename, 'r') as file_obj:
-        no_wave_units = False
-        no_flux_units = False
         for key in file_obj.keys():
-            dataset = file_obj[key]
-            try:
-                wave_units_string = dataset.attrs['wavelength_units']
-            except KeyError:
-                wave_units_string = 'micron'
-                no_wave_units = True
-            try:
-                flux_units_string = dataset.attrs['flux_units']
-            except KeyError:
-                flux_units_string = 'flam_cgs'
-                no_flux_units = True
-
-            # Catch common errors
-            if wave_units_string.lower() in ['microns', 'angstroms', 'nanometers']:
-                wave_units_string = wave_units_string[0:-1]
-
-            # Convert the unit strings into astropy.units Unit object
-            wave_units = string_to_units(wave_units_string)
-            flux_units = string_to_units(flux_units_string)
-
-            # Get the data
-            waves = dataset[0] * wave_units
-            fluxes = dataset[1] * flux_units
-
-            # Convert wavelengths to microns and flux values to f_lambda in cgs
-            if wave_units != u.micron:
-                if wave_units.is_equivalent(u.micron):
-                    waves = waves.to(u.micron)
-                elif wave_units.is_equivalent(u.Hz):
-                    waves = waves.to(u.micron, equivalencies=u.spectral())
-                else:
-                    raise ValueError("Wavelength units of {} in dataset {} are not compatible with microns."
-                                     .format(wave_units, key))
-            if flux_units != FLAMBDA_CGS_UNITS:
-                if flux_units.is_equivalent(FLAMBDA_CGS_UNITS):
-                    fluxes = fluxes.to(FLAMBDA_CGS_UNITS)
-                elif flux_units.is_equivalent(FNU_CGS_UNITS):
-                    fluxes = fluxes.to(FLAMBDA_CGS_UNITS, u.spectral_density(waves))
-                elif flux_units == u.pct:
-                    pass
-                else:
-                    raise ValueError("Flux density units of {} in dataset {} are not compatible with f_lambda."
-                                     .format(flux_units, key))
-
+            waves, fluxes, missing_units = _read_dataset(file_obj[key], key)
+            all_missing_units.update(missing_units)
             contents[int(key)] = {'wavelengths': waves, 'fluxes': fluxes}
-    if no_wave_units:
-        print("{}: No wavelength units provided. Assuming MIRCONS.".format(filename))
-    if no_flux_units:
-        print("{}: No flux density units provided. Assuming F_lambda in CGS (erg/sec/cm^2/A)".format(filename))
+    for missing in ['wavelength', 'flux']:
+        if missing in all_missing_units:
+            _print_missing_units_message(filename, missing)
     return contents
 
 
-def save(contents, filename, wavelength_unit='', flux_unit=''):
+def save(contents, filename, wavelength_unit='', flux_unit='', chunk_size=None,
+         compression='gzip', compression_opts=9):
     """Save a dictionary into an hdf5 file
 
     Paramters
@@ -119,7 +257,30 @@ def save(contents, filename, wavelength_unit='', flux_unit=''):
 
     filename : str
         Name of hdf5 file to produce
+
+    wavelength_unit : str
+        Wavelength units to record for spectra whose wavelengths are not
+        Quantities
+
+    flux_unit : str
+        Flux units to record for spectra whose fluxes are not Quantities
+
+    chunk_size : int
+        Number of wavelength points per chunk in each dataset. If None,
+        h5py chooses the chunk shape. Smaller chunks allow partial reads of
+        very long spectra without decompressing the whole dataset.
+
+    compression : str
+        Compression filter passed to h5py (e.g. 'gzip', 'lzf'), or None for
+        no compression
+
+    compression_opts : int
+        Compression level for gzip compression
     """
+    dataset_kwargs = {'compression': compression}
+    if compression == 'gzip':
+        dataset_kwargs['compression_opts'] = compression_opts
+
     with h5py.File(filename, "w") as file_obj:
         for key in contents.keys():
             flux = contents[key]['fluxes']
@@ -141,8 +302,11 @@ def save(contents, filename, wavelength_unit='', flux_unit=''):
                 flux_units = flux_unit
                 flux_values = flux
 
+            chunks = True
+            if chunk_size is not None:
+                chunks = (2, max(1, min(chunk_size, len(wavelength_values))))
             dset = file_obj.create_dataset(str(key), data=[wavelength_values, flux_values], dtype='f',
-                                           compression="gzip", compression_opts=9)
+                                           chunks=chunks, **dataset_kwargs)
 
             # Set dataset units. Not currently inspected by mirage.
             if wavelength_units != '':
@@ -0,0 +1,515 @@
+#! /usr/bin/env python
+
+"""This module contains tools for spatially indexing source positions on
+the sky. Positions are converted to unit vectors and placed in a KD-tree,
+so that the sources near a given pointing can be found without computing
+the separation of every source in a catalog.
+
+Authors
+-------
+
+    - Bryan Hilbert
+
+Use
+---
+
+    ::
+
+        from mirage.catalogs.sky_index import SkyIndex
+        index = SkyIndex(ra_values, dec_values)
+        rows = index.query_box(80.4, -69.8, 120.)
+
+    To read only the sources of a catalog file near a given position, using
+    an index that is saved next to the catalog and re-used by later calls:
+
+    ::
+
+        from mirage.catalogs.sky_index import read_catalog_near
+        table = read_catalog_near('my_catalog.cat', 80.4, -69.8, 200.)
+"""
+
+import os
+import pickle
+
+from astropy.table import Column
+import numpy as np
+from pysiaf.utils.projection import deproject_from_tangent_plane, project_to_tangent_plane
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from mirage.catalogs.catalog_generator import is_binary_catalog, read_catalog_table
+
+# Suffix added to a catalog filename to give the names of the files that
+# hold its spatial index, and (for ascii catalogs) a binary copy of its rows
+CATALOG_INDEX_SUFFIX = '.skyindex'
+
+# Catalog files smaller than this (in bytes) are read in full, as reading
+# them is faster than maintaining an index
+INDEX_MIN_FILE_SIZE = 10 * 1024 ** 2
+
+# Pointings whose boxes overlap are covered by a single box, as long as
+# that box is no wider than this multiple of the pointing box width
+MAX_MERGED_BOX_FACTOR = 1.5
+
+# Spatial indexes of catalog files already used in this process, keyed by
+# catalog filename
+_CATALOG_INDEXES = {}
+
+
+class SkyIndex():
+    def __init__(self, ra, dec):
+        """Build a KD-tree over the unit vectors of a set of sky positions
+
+        Parameters
+        ----------
+        ra : numpy.ndarray
+            RA values in degrees
+
+        dec : numpy.ndarray
+            Dec values in degrees
+        """
+        self.ra = np.asarray(ra, dtype=float)
+        self.dec = np.asarray(dec, dtype=float)
+        self.tree = cKDTree(unit_vectors(self.ra, self.dec))
+
+    def __len__(self):
+        return len(self.ra)
+
+    def query_box(self, ra, dec, box_width):
+        """Find the sources within a square box, aligned with the local
+        RA and Dec directions, centered on the given position
+
+        Parameters
+        ----------
+        ra : float
+            RA of the center of the box in degrees
+
+        dec : float
+            Dec of the center of the box in degrees
+
+        box_width : float
+            Full width of the box in arcseconds
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Sorted indexes of the sources within the box
+        """
+        if len(self) == 0:
+            return np.array([], dtype=int)
+
+        # The box is enclosed by a circle whose radius is half of the
+        # diagonal. Select candidates using the tree, and then check
+        # them against the box itself.
+        half_width = box_width / 2.
+        radius = chord_length(half_width * np.sqrt(2.))
+        candidates = np.array(self.tree.query_ball_point(unit_vectors(ra, dec), radius), dtype=int)
+        if len(candidates) == 0:
+            return candidates
+
+        inside = in_boxes(self.ra[candidates], self.dec[candidates], [(ra, dec, box_width)])
+        return np.sort(candidates[inside])
+
+    def query_cone(self, ra, dec, radius):
+        """Find the sources within a given distance of a position
+
+        Parameters
+        ----------
+        ra : float
+            RA of the center of the cone in degrees
+
+        dec : float
+            Dec of the center of the cone in degrees
+
+        radius : float
+            Radius of the cone in arcseconds
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Sorted indexes of the sources within the cone
+        """
+        if len(self) == 0:
+            return np.array([], dtype=int)
+        rows = self.tree.query_ball_point(unit_vectors(ra, dec), chord_length(radius))
+        return np.sort(np.array(rows, dtype=int))
+
+    def query_boxes(self, ra_list, dec_list, box_width):
+        """Find the sources within any of a set of boxes of the same size.
+
+        Parameters
+        ----------
+        ra_list : list
+            RA values of the box centers in degrees
+
+        dec_list : list
+            Dec values of the box centers in degrees
+
+        box_width : float
+            Full width of each box in arcseconds
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Sorted indexes of the sources within at least one of the boxes
+        """
+        rows = [self.query_box(ra, dec, box_width) for ra, dec in zip(ra_list, dec_list)]
+        if len(rows) == 0:
+            return np.array([], dtype=int)
+        return np.unique(np.concatenate(rows))
+
+
+def build_catalog_index(filename):
+    """Create the spatial index of a catalog file, and save it next to the
+    catalog. For ascii catalogs, a binary copy of the catalog is saved as
+    well, so that subsets of rows can be read without parsing the entire
+    file. Only catalogs with source positions given as RA and Dec in
+    decimal degrees can be indexed.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the catalog file
+
+    Returns
+    -------
+    catalog_index : dict
+        Index information. Keys are 'index' (SkyIndex of the source
+        positions), 'index_range' (minimum and maximum index numbers of the
+        sources in the full catalog) and 'data_file' (file from which rows
+        are read). None if the catalog cannot be indexed.
+    """
+    table = read_catalog_table(filename)
+    if 'position_pixels' in table.meta['comments'][0:4] or table['x_or_RA'].dtype.kind not in 'fiu':
+        return None
+
+    index_file, data_file = catalog_index_files(filename)
+    if 'index' in table.colnames:
+        index_range = (int(np.min(table['index'])), int(np.max(table['index'])))
+    else:
+        index_range = (1, len(table))
+    catalog_index = {'index': SkyIndex(table['x_or_RA'], table['y_or_Dec']), 'index_range': index_range,
+                     'data_file': os.path.basename(data_file)}
+
+    # Write to temporary files first, so that other processes reading the
+    # same catalog never see partially written files. If the catalog
+    # directory is not writable, keep the index in memory only.
+    try:
+        if data_file != filename:
+            temp_file = '{}.{}.tmp.fits'.format(data_file, os.getpid())
+            table.write(temp_file, format='fits', overwrite=True)
+            os.replace(temp_file, data_file)
+        temp_file = '{}.{}.tmp'.format(index_file, os.getpid())
+        with open(temp_file, 'wb') as file_obj:
+            pickle.dump(catalog_index, file_obj, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, index_file)
+    except OSError as error:
+        print('WARNING: Unable to save the spatial index of {}: {}'.format(filename, error))
+        return None
+    return catalog_index
+
+
+def catalog_index_files(filename):
+    """Names of the files holding the spatial index of a catalog, and the
+    binary table from which catalog rows are read
+
+    Parameters
+    ----------
+    filename : str
+        Name of the catalog file
+
+    Returns
+    -------
+    index_file : str
+        Name of the file containing the pickled index
+
+    data_file : str
+        Name of the binary (FITS) catalog file from which rows are read.
+        This is the catalog itself if it is already in the binary format.
+    """
+    index_file = '{}{}.pkl'.format(filename, CATALOG_INDEX_SUFFIX)
+    if is_binary_catalog(filename):
+        data_file = filename
+    else:
+        data_file = '{}{}.fits'.format(filename, CATALOG_INDEX_SUFFIX)
+    return index_file, data_file
+
+
+def chord_length(separation):
+    """Convert an angular separation into the distance between the
+    corresponding unit vectors
+
+    Parameters
+    ----------
+    separation : float
+        Angular separation in arcseconds
+
+    Returns
+    -------
+    chord : float
+        Straight-line distance between two unit vectors with the given
+        angular separation
+    """
+    angle = np.radians(min(separation / 3600., 180.))
+    return 2. * np.sin(angle / 2.)
+
+
+def covering_boxes(ra, dec, box_width):
+    """Find a set of boxes that covers the boxes of width ``box_width``
+    centered on each position. Positions whose boxes overlap by more than
+    half are merged into one enclosing box, provided the merged box is no
+    wider than ``MAX_MERGED_BOX_FACTOR`` times ``box_width``. Other
+    positions keep their own box, so the boxes follow the shape of chained
+    or L-shaped mosaics rather than filling their bounding square.
+
+    Parameters
+    ----------
+    ra : numpy.ndarray
+        RA values of the box centers in degrees
+
+    dec : numpy.ndarray
+        Dec values of the box centers in degrees
+
+    box_width : float
+        Full width of the box around each position in arcseconds
+
+    Returns
+    -------
+    boxes : list
+        (RA center, Dec center, full width) of each box, in degrees and
+        arcseconds
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    labels = group_positions(ra, dec, box_width / 2.)
+
+    boxes = []
+    for label in np.unique(labels):
+        members = labels == label
+        ra_center, dec_center, width = region_center_and_width(ra[members], dec[members], pad=box_width / 2.)
+        if width <= MAX_MERGED_BOX_FACTOR * box_width:
+            boxes.append((ra_center, dec_center, width))
+        else:
+            boxes.extend((float(ra_value), float(dec_value), box_width)
+                         for ra_value, dec_value in zip(ra[members], dec[members]))
+    return boxes
+
+
+def group_positions(ra, dec, separation):
+    """Group sky positions so that each position is within ``separation``
+    of at least one other position in its group (i.e. friends-of-friends)
+
+    Parameters
+    ----------
+    ra : numpy.ndarray
+        RA values in degrees
+
+    dec : numpy.ndarray
+        Dec values in degrees
+
+    separation : float
+        Linking distance in arcseconds
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Group number of each position
+    """
+    vectors = unit_vectors(ra, dec)
+    pairs = cKDTree(vectors).query_pairs(chord_length(separation), output_type='ndarray')
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])),
+                       shape=(len(vectors), len(vectors)))
+    number_of_groups, labels = connected_components(graph, directed=False)
+    return labels
+
+
+def in_boxes(ra, dec, boxes):
+    """Determine which positions fall within at least one of a set of
+    square boxes, aligned with the local RA and Dec directions
+
+    Parameters
+    ----------
+    ra : numpy.ndarray
+        RA values in degrees
+
+    dec : numpy.ndarray
+        Dec values in degrees
+
+    boxes : list
+        (RA center, Dec center, full width) of each box, in degrees and
+        arcseconds
+
+    Returns
+    -------
+    inside : numpy.ndarray
+        Boolean array, True for positions within any of the boxes
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    vectors = unit_vectors(ra, dec)
+    inside = np.zeros(len(ra), dtype=bool)
+    for ra_center, dec_center, box_width in boxes:
+        half_width = box_width / 2.
+
+        # Positions far from the box can be projected into it by the
+        # tangent plane projection, so require them to be within the
+        # circle enclosing the box
+        diagonal = np.radians(min(half_width * np.sqrt(2.) / 3600., 90.))
+        near = vectors.dot(unit_vectors(ra_center, dec_center)) >= np.cos(diagonal)
+        if not np.any(near):
+            continue
+        x, y = project_to_tangent_plane(ra[near], dec[near], ra_center, dec_center)
+        near[near] = (np.abs(x * 3600.) <= half_width) & (np.abs(y * 3600.) <= half_width)
+        inside |= near
+    return inside
+
+
+def load_catalog_index(filename):
+    """Return the spatial index of a catalog file. The index is read from
+    the file saved next to the catalog if it is newer than the catalog, and
+    created otherwise.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the catalog file
+
+    Returns
+    -------
+    catalog_index : dict
+        Index information, as returned by ``build_catalog_index``. None if
+        the catalog cannot be indexed.
+    """
+    catalog_time = os.path.getmtime(filename)
+    if filename in _CATALOG_INDEXES and _CATALOG_INDEXES[filename][0] == catalog_time:
+        return _CATALOG_INDEXES[filename][1]
+
+    index_file, data_file = catalog_index_files(filename)
+    catalog_index = None
+    if (os.path.isfile(index_file) and os.path.isfile(data_file)
+            and os.path.getmtime(index_file) >= catalog_time):
+        with open(index_file, 'rb') as file_obj:
+            catalog_index = pickle.load(file_obj)
+    else:
+        catalog_index = build_catalog_index(filename)
+
+    _CATALOG_INDEXES[filename] = (catalog_time, catalog_index)
+    return catalog_index
+
+
+def read_catalog_near(filename, ra, dec, radius):
+    """Read the sources in a Mirage-formatted catalog file that are within
+    a given distance of a position. For large catalogs with RA, Dec source
+    positions, a spatial index saved next to the catalog is used to read
+    only those rows. Other catalogs are read in full.
+
+    The returned table always has an index column. The number of sources
+    and index numbers in the full catalog are given by
+    ``meta['index_range']`` when only a subset of the rows was read.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the catalog file
+
+    ra : float
+        RA in degrees of the center of the region
+
+    dec : float
+        Dec in degrees of the center of the region
+
+    radius : float
+        Radius of the region in arcseconds
+
+    Returns
+    -------
+    table : astropy.table.Table
+        Catalog contents
+    """
+    catalog_index = None
+    if os.path.getsize(filename) >= INDEX_MIN_FILE_SIZE:
+        catalog_index = load_catalog_index(filename)
+    if catalog_index is None:
+        return read_catalog_table(filename)
+
+    rows = catalog_index['index'].query_cone(ra, dec, radius)
+    data_file = os.path.join(os.path.dirname(filename), catalog_index['data_file'])
+    table = read_catalog_table(data_file, memmap=True)[rows]
+
+    # Number the sources by their row in the full catalog, as is done when
+    # the full catalog is read
+    if 'index' not in table.colnames:
+        table.add_column(Column(rows + 1, name='index'), index=0)
+    table.meta['index_range'] = catalog_index['index_range']
+    return table
+
+
+def region_center_and_width(ra, dec, pad=0.):
+    """Find the center, and the width of the smallest square aligned with
+    the local RA and Dec directions, that encloses a set of positions
+
+    Parameters
+    ----------
+    ra : numpy.ndarray
+        RA values in degrees
+
+    dec : numpy.ndarray
+        Dec values in degrees
+
+    pad : float
+        Distance in arcseconds to extend the region beyond the outermost
+        positions on each side
+
+    Returns
+    -------
+    ra_center : float
+        RA of the center of the region in degrees
+
+    dec_center : float
+        Dec of the center of the region in degrees
+
+    width : float
+        Full width of the region in arcseconds
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+
+    # The mean unit vector is well defined across RA=0
+    mean_vector = np.mean(unit_vectors(ra, dec), axis=0)
+    ra_mean = np.degrees(np.arctan2(mean_vector[1], mean_vector[0])) % 360.
+    dec_mean = np.degrees(np.arctan2(mean_vector[2], np.hypot(mean_vector[0], mean_vector[1])))
+
+    # Center the region on the middle of the extent of the positions
+    # in the tangent plane
+    x, y = project_to_tangent_plane(ra, dec, ra_mean, dec_mean)
+    x = np.atleast_1d(x) * 3600.
+    y = np.atleast_1d(y) * 3600.
+    x_mid = (np.max(x) + np.min(x)) / 2.
+    y_mid = (np.max(y) + np.min(y)) / 2.
+    width = float(max(np.max(x) - np.min(x), np.max(y) - np.min(y)) + 2. * pad)
+
+    ra_center, dec_center = deproject_from_tangent_plane(x_mid / 3600., y_mid / 3600., ra_mean, dec_mean)
+    return float(ra_center) % 360., float(dec_center), width
+
+
+def unit_vectors(ra, dec):
+    """Convert RA and Dec values to cartesian unit vectors
+
+    Parameters
+    ----------
+    ra : float or numpy.ndarray
+        RA values in degrees
+
+    dec : float or numpy.ndarray
+        Dec values in degrees
+
+    Returns
+    -------
+    vectors : numpy.ndarray
+        Array of shape (N, 3), or (3,) for scalar inputs
+    """
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], axis=-1)
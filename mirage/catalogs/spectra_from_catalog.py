@@ -32,6 +32,7 @@ import numpy as np
 from scipy.interpolate import interp1d
 
 from . import hdf5_catalog
+from .catalog_generator import read_catalog_table
 from mirage.utils.constants import FLAMBDA_CGS_UNITS, FNU_CGS_UNITS
 from mirage.utils.utils import magnitude_to_countrate
 
@@ -41,6 +42,11 @@ ZEROPOINT_FILES = {'niriss': os.path.join(CONFIG_PATH, 'niriss_zeropoints.list')
                    'nircam': os.path.join(CONFIG_PATH, 'NIRCam_zeropoints.list'),
                    'fgs': os.path.join(CONFIG_PATH, 'guider_zeropoints.list')}
 
+# Parsed zeropoint tables, keyed by (instrument, zeropoint file). Each value
+# is a dictionary mapping (filter, module) and (filter, None) to the first
+# matching table row, itself a dictionary of column values.
+_ZEROPOINT_CACHE = {}
+
 
 def add_flam_columns(cat, mag_sys):
     """Convert magnitudes to flux densities in units of f_lambda and add
@@ -101,6 +107,23 @@ def add_flam_columns(cat, mag_sys):
     return cat, parameters
 
 
+def clear_zeropoint_cache(instrument=None):
+    """Discard parsed zeropoint tables, so that they are read again the
+    next time they are needed (e.g. after a zeropoint file is updated).
+
+    Parameters
+    ----------
+    instrument : str
+        Instrument whose table is discarded. If None, all tables are
+        discarded.
+    """
+    if instrument is None:
+        _ZEROPOINT_CACHE.clear()
+    else:
+        for key in [key for key in _ZEROPOINT_CACHE if key[0] == instrument.lower()]:
+            del _ZEROPOINT_CACHE[key]
+
+
 def convert_to_flam(magnitudes, param_tuple, magnitude_system):
     """Convert the magnitude values for a given magnitude column into
     units of f_lambda.
@@ -193,8 +216,56 @@ def create_spectra(catalog_with_flambda, filter_params, extrapolate_SED=True):
         are numpy arrays of values. These can optionally have astropy units
         attached to them.
     """
+    indexes, wavelengths, fluxes = create_spectra_array(catalog_with_flambda, filter_params,
+                                                        extrapolate_SED=extrapolate_SED)
+
+    # Attach units once for all sources. Each source's spectrum is a row
+    # of the combined array.
+    wavelengths = wavelengths * u.micron
+    fluxes = fluxes * FLAMBDA_CGS_UNITS
+
+    spectra = OrderedDict({})
+    for row, index in enumerate(indexes):
+        spectra[index] = {'wavelengths': wavelengths,
+                          'fluxes': fluxes[row]}
+
+    return spectra
+
+
+def create_spectra_array(catalog_with_flambda, filter_params, extrapolate_SED=True):
+    """Create continuum spectra for all sources in a catalog at once, as
+    a single (number of sources x number of wavelengths) array. Sources
+    with one magnitude get a flat spectrum, and those with several are
+    interpolated (and optionally extrapolated) linearly between the
+    filter pivot wavelengths.
+
+    Parameters
+    ----------
+    catalog_with_flambda : astropy.table.Table
+        Source catalog containing f_lambda columns (i.e. output from
+        add_flam_columns)
+
+    filter_params : tup
+        Tuple of photometric information for a filter.
+        (photflam, photfnu, zeropoint, pivot wavelength)
+
+    extrapolate_SED : bool
+        If True and an input SED does not cover the entire wavelength range
+        of the grism, linear interpolation is used to extend the SED
+
+    Returns
+    -------
+    indexes : numpy.ndarray
+        Index numbers of the sources
+
+    final_wavelengths : numpy.ndarray
+        1D array of wavelengths, in microns, common to all spectra
+
+    final_sorted_fluxes : numpy.ndarray
+        2D array of flux densities in f_lambda (cgs) units. Row i is the
+        spectrum of source indexes[i].
+    """
     flambda_cols = [col for col in catalog_with_flambda.colnames if 'flam' in col]
-    filter_name = [colname.split('_')[1] for colname in flambda_cols]
     instrument = np.array([colname.split('_')[0] for colname in flambda_cols])
     min_wave = 0.9  # microns
     max_wave = 5.15  # microns
@@ -208,11 +279,17 @@ def create_spectra(catalog_with_flambda, filter_params, extrapolate_SED=True):
         pivots.append(pivot.value)
     pivots = np.array(pivots)
 
+    # Fluxes for all sources, one column per filter
+    flux = np.array([catalog_with_flambda[column].data for column in flambda_cols], dtype=float).T
+    flux = flux.reshape(len(catalog_with_flambda), len(flambda_cols))
+
+    # Case where a single magnitude is all that's given
     if (len(pivots) == 1):
         print(("INFO: single filter magnitude input. Extrapolating to produce "
                "a flat continuum."))
         extrapolate_SED = True
         pivots = np.append(pivots, pivots[0] + 0.01)
+        flux = np.hstack([flux, flux])
 
     # Put the pivot wavelengths into increasing order
     sorted_indexes = np.argsort(np.array(pivots))
@@ -223,31 +300,21 @@ def create_spectra(catalog_with_flambda, filter_params, extrapolate_SED=True):
     if (np.max(wavelengths) < max_wave) and extrapolate_SED:
         final_wavelengths = np.append(final_wavelengths, max_wave)
 
-    spectra = OrderedDict({})
-    for idx, source in enumerate(catalog_with_flambda):
-        index = source['index']
-        flux = []
-        for column in flambda_cols:
-            flux.append(source[column])
-        # Case where a single magnitude is all that's given
-        if len(flux) == 1:
-            flux.append(flux[0])
-
-        sorted_fluxes = np.array(flux)[sorted_indexes]
-        final_sorted_fluxes = copy.deepcopy(sorted_fluxes)
-
-        # If the provided flux values don't cover the complete wavelength
-        # range, extrapolate, if requested.
-        if ((np.min(wavelengths) > min_wave) or (np.max(wavelengths) < max_wave)) and extrapolate_SED:
-            interp_func = interp1d(wavelengths, sorted_fluxes, fill_value="extrapolate", bounds_error=False)
-            final_sorted_fluxes = interp_func(final_wavelengths)
-        # Set any flux values that are less than zero to zero
-        final_sorted_fluxes[final_sorted_fluxes < 0.] = 0.
-
-        spectra[index] = {'wavelengths': final_wavelengths * u.micron,
-                          'fluxes': final_sorted_fluxes * FLAMBDA_CGS_UNITS}
+    sorted_fluxes = flux[:, sorted_indexes]
+    final_sorted_fluxes = copy.deepcopy(sorted_fluxes)
 
-    return spectra
+    # If the provided flux values don't cover the complete wavelength
+    # range, extrapolate, if requested.
+    if ((np.min(wavelengths) > min_wave) or (np.max(wavelengths) < max_wave)) and extrapolate_SED \
+            and len(flux) > 0:
+        interp_func = interp1d(wavelengths, sorted_fluxes, axis=1, fill_value="extrapolate",
+                               bounds_error=False)
+        final_sorted_fluxes = interp_func(final_wavelengths)
+
+    # Set any flux values that are less than zero to zero
+    final_sorted_fluxes[final_sorted_fluxes < 0.] = 0.
+
+    return np.array(catalog_with_flambda['index']), final_wavelengths, final_sorted_fluxes
 
 
 def get_filter_info(column_names, magsys):
@@ -270,13 +337,7 @@ def get_filter_info(column_names, magsys):
         (e.g. info['nircam_f480m_magnitude'] = (<photflam>, <photfnu>,
         <zeropoint>, <pivot>))
     """
-    # Get the correct zeropoint file name
     instrument = column_names[0].split('_')[0].lower()
-    zp_file = ZEROPOINT_FILES[instrument]
-
-    # Read in the file
-    zp_table = ascii.read(zp_file)
-
     magsys = magsys.upper()
     info = {}
 
@@ -284,19 +345,18 @@ def get_filter_info(column_names, magsys):
         for entry in column_names:
             filter_name = entry.split('_')[1].upper()
             if instrument == 'nircam':
-                match = ((zp_table['Filter'] == filter_name) & (zp_table['Module'] == 'B'))
+                line = get_zeropoint_entry(instrument, filter_name, module='B')
             elif instrument == 'niriss':
-                match = zp_table['Filter'] == filter_name
-            zp = zp_table[magsys].data[match][0]
-            photflam = zp_table['PHOTFLAM'].data[match][0] * FLAMBDA_CGS_UNITS
-            photfnu = zp_table['PHOTFNU'].data[match][0] * FNU_CGS_UNITS
-            pivot = zp_table['Pivot_wave'].data[match][0] * u.micron
+                line = get_zeropoint_entry(instrument, filter_name)
+            zp = line[magsys]
+            photflam = line['PHOTFLAM'] * FLAMBDA_CGS_UNITS
+            photfnu = line['PHOTFNU'] * FNU_CGS_UNITS
+            pivot = line['Pivot_wave'] * u.micron
             info[entry] = (photflam, photfnu, zp, pivot)
 
     # For FGS, just use the values for GUIDER1 detector.
     elif instrument == 'fgs':
-        line = zp_table[0]
-        # detector = line['Detector']
+        line = get_zeropoint_entry(instrument)
         zp = line[magsys]
         photflam = line['PHOTFLAM'] * FLAMBDA_CGS_UNITS
         photfnu = line['PHOTFNU'] * FNU_CGS_UNITS
@@ -306,6 +366,57 @@ def get_filter_info(column_names, magsys):
     return info
 
 
+def get_zeropoint_entry(instrument, filter_name=None, module=None):
+    """Return the zeropoint table entry for an instrument, filter, and
+    module. The zeropoint file for each instrument is read and indexed
+    only once per process; see ``clear_zeropoint_cache``.
+
+    Parameters
+    ----------
+    instrument : str
+        Name of instrument (e.g. 'nircam')
+
+    filter_name : str
+        Name of filter (e.g. 'F444W'). If None, the first entry in the
+        table is returned.
+
+    module : str
+        Name of module (e.g. 'B'). If None, the first entry for
+        ``filter_name`` is returned, regardless of module.
+
+    Returns
+    -------
+    entry : dict
+        Values of all table columns for the entry (e.g. entry['PHOTFLAM'])
+    """
+    instrument = instrument.lower()
+    zp_file = ZEROPOINT_FILES[instrument]
+    key = (instrument, zp_file)
+    if key not in _ZEROPOINT_CACHE:
+        zp_table = ascii.read(zp_file)
+        entries = {}
+        for i in range(len(zp_table)):
+            entry = {col: zp_table[col].data[i] for col in zp_table.colnames}
+            filt = str(entry['Filter']).upper()
+            mod = str(entry['Module']).upper()
+            if i == 0:
+                entries[(None, None)] = entry
+            for entry_key in [(filt, mod), (filt, None)]:
+                if entry_key not in entries:
+                    entries[entry_key] = entry
+        _ZEROPOINT_CACHE[key] = entries
+
+    if filter_name is None:
+        return _ZEROPOINT_CACHE[key][(None, None)]
+    if module is not None:
+        module = module.upper()
+    try:
+        return _ZEROPOINT_CACHE[key][(filter_name.upper(), module)]
+    except KeyError:
+        raise ValueError('No {} zeropoint entry found for filter {}, module {}.'
+                         .format(instrument, filter_name, module))
+
+
 def make_all_spectra(catalog_files, input_spectra=None, input_spectra_file=None,
                      extrapolate_SED=True, output_filename=None, normalizing_mag_column=None):
     """Overall wrapper function
@@ -326,7 +437,8 @@ def make_all_spectra(catalog_files, input_spectra=None, input_spectra_file=None,
         in microns and flux densities in Flambda units.
 
     input_specctra_file : str
-        Name of an hdf5 file containing spectra for some/all targets
+        Name of an hdf5 file containing spectra for some/all targets. Only
+        the spectra of sources in the catalogs are read from the file.
 
     extrapolate_SED : bool
         If True and an input SED does not cover the entire wavelength range
@@ -351,10 +463,23 @@ def make_all_spectra(catalog_files, input_spectra=None, input_spectra_file=None,
     if output_filename is None:
         output_filename = create_output_sed_filename(catalog_files[0], input_spectra_file)
 
+    # If a single input source catalog is provided, make it a list, in order
+    # to be consistent with the case of multiple input catalogs
+    if isinstance(catalog_files, str):
+        catalog_files = [catalog_files]
+
+    # Read in the input catalogs, which may be of different types
+    # (e.g. point source, galaxy, etc)
+    catalogs = [read_catalog(catalog_file) for catalog_file in catalog_files]
+
     all_input_spectra = {}
-    # Read in input spectra from file, add to all_input_spectra dictionary
+    # Read in input spectra from file, add to all_input_spectra dictionary.
+    # Only the spectra of sources in the catalogs are read from the file.
     if input_spectra_file is not None:
-        spectra_from_file = hdf5_catalog.open(input_spectra_file)
+        catalog_indexes = np.unique(np.concatenate([ascii_catalog['index']
+                                                    for ascii_catalog, mag_sys in catalogs]))
+        with hdf5_catalog.open(input_spectra_file, lazy=True) as spectra_file:
+            spectra_from_file = spectra_file.subset(catalog_indexes)
         all_input_spectra = {**all_input_spectra, **spectra_from_file}
 
     # If both an input spectra file and dictionary are given, combine into
@@ -363,17 +488,8 @@ def make_all_spectra(catalog_files, input_spectra=None, input_spectra_file=None,
     if input_spectra is not None:
         all_input_spectra = {**all_input_spectra, **input_spectra}
 
-    # If a single input source catalog is provided, make it a list, in order
-    # to be consistent with the case of multiple input catalogs
-    if isinstance(catalog_files, str):
-        catalog_files = [catalog_files]
-
-    # Loop over input catalogs, which may be of different types
-    # (e.g. point source, galaxy, etc)
-    for catalog_file in catalog_files:
-        # Read in input catalog
-        ascii_catalog, mag_sys = read_catalog(catalog_file)
-
+    # Loop over input catalogs
+    for catalog_file, (ascii_catalog, mag_sys) in zip(catalog_files, catalogs):
         # Create catalog output name if none is given
         cat_dir, cat_file = os.path.split(catalog_file)
         index = cat_file.rindex('.')
@@ -422,7 +538,7 @@ def read_catalog(filename):
     Parameters
     ----------
     filename : str
-        Name of (ascii) catalog file
+        Name of (ascii or binary) catalog file
 
     Returns
     -------
@@ -433,7 +549,7 @@ def read_catalog(filename):
         Magnitude system (e.g. 'abmag', 'stmag', 'vegamag') of the
         source magnitudes in the catalog
     """
-    catalog = ascii.read(filename)
+    catalog = read_catalog_table(filename)
 
     # Check to be sure index column is present
     if 'index' not in catalog.colnames:
@@ -11,8 +11,17 @@ Use
         deployment_errors = reduce_deployment_errors(deployment_errors, reduction_factor=0.2, out_dir=out_dir)
         ote, segment_tilts = apply_deployment_errors(ote, deployment_errors, out_dir=out_dir)
         ote = remove_piston_tip_tilt(ote, out_dir=out_dir)
+
+    Deployment realizations can be kept in a store directory and reused
+    in later runs, by seed or by deployments yaml file, without
+    regenerating the mirror state:
+    ::
+        ote, segment_tilts, ote_opd_with_tilts = generate_random_ote_deployment(
+            out_dir, seed=3, store_dir=store_dir)
 """
 
+import hashlib
+import json
 import os
 import time
 import yaml
@@ -22,7 +31,7 @@ import numpy as np
 import webbpsf
 
 
-def load_ote_from_deployment_yaml(deployments_file, out_dir, save=True):
+def load_ote_from_deployment_yaml(deployments_file, out_dir, save=True, store_dir=None):
     """Create a WebbPSF adjustable OTE object representing a perturbed OTE
     mirror state using mirror deployments defined in a YAML file.
 
@@ -36,6 +45,10 @@ def load_ote_from_deployment_yaml(deployments_file, out_dir, save=True):
     save : bool, optional
         Denotes whether to save out the OPD (with and without tip/tilt)
         as FITs files
+    store_dir : str, optional
+        Directory of stored deployment realizations. If the realization
+        for the contents of ``deployments_file`` is present, it is reused;
+        otherwise it is added after being computed.
 
     Returns
     -------
@@ -46,6 +59,13 @@ def load_ote_from_deployment_yaml(deployments_file, out_dir, save=True):
     ote_opd_with_tilts : numpy.ndarray
         Array representing perturbed OTE OPD pupil before tip/tilt is removed
     """
+    if store_dir is not None:
+        with open(deployments_file, 'rb') as f:
+            key = realization_key(deployments_file_hash=hashlib.sha1(f.read()).hexdigest())
+        realization = load_ote_realization(store_dir, key)
+        if realization is not None:
+            return ote_from_realization(realization, save=save, out_dir=out_dir)
+
     # Make an adjustable OTE object with WebbPSF
     nc = webbpsf.NIRCam()
     nc, ote = webbpsf.enable_adjustable_ote(nc)
@@ -63,10 +83,14 @@ def load_ote_from_deployment_yaml(deployments_file, out_dir, save=True):
     # Remove tip and tilt
     ote = remove_piston_tip_tilt(ote, out_dir=out_dir, save=save)
 
+    if store_dir is not None:
+        save_ote_realization(store_dir, key, deployment_errors, ote, segment_tilts, ote_opd_with_tilts)
+
     return ote, segment_tilts, ote_opd_with_tilts
 
 
-def generate_random_ote_deployment(out_dir, reduction_factor=0.2, save=True):
+def generate_random_ote_deployment(out_dir, reduction_factor=0.2, save=True, seed=None,
+                                   store_dir=None):
     """Create a WebbPSF adjustable OTE object representing a perturbed OTE
     mirror state by randomly generating mirror deployment errors.
 
@@ -80,6 +104,14 @@ def generate_random_ote_deployment(out_dir, reduction_factor=0.2, save=True):
     save : bool, optional
         Denotes whether to save out the OPD (with and without tip/tilt)
         as FITs files and the deployment error dictionary as a yaml
+    seed : int, optional
+        Seed for the random number generator. If None, the global numpy
+        random state is used.
+    store_dir : str, optional
+        Directory of stored deployment realizations. Only used if ``seed``
+        is given. If the realization for ``seed`` and ``reduction_factor``
+        is present, it is reused; otherwise it is added after being
+        computed. Either way, the same files are saved if ``save`` is True.
 
     Returns
     -------
@@ -90,12 +122,26 @@ def generate_random_ote_deployment(out_dir, reduction_factor=0.2, save=True):
     ote_opd_with_tilts : numpy.ndarray
         Array representing perturbed OTE OPD pupil before tip/tilt is removed
     """
+    use_store = store_dir is not None and seed is not None
+    if use_store:
+        key = realization_key(seed=seed, reduction_factor=reduction_factor)
+        realization = load_ote_realization(store_dir, key)
+        if realization is not None:
+            if save:
+                # Regenerating the errors from the seed is cheap, and saves
+                # the same deployment error yaml files as an unstored run
+                deployment_errors = generate_deployment_errors(out_dir=out_dir, save=save, seed=seed)
+                reduce_deployment_errors(
+                    deployment_errors, reduction_factor=reduction_factor, out_dir=out_dir, save=save
+                )
+            return ote_from_realization(realization, save=save, out_dir=out_dir)
+
     # Make an adjustable OTE object with WebbPSF
     nc = webbpsf.NIRCam()
     nc, ote = webbpsf.enable_adjustable_ote(nc)
 
     # Generate OPD and vector list with reduced deployment errors
-    deployment_errors = generate_deployment_errors(out_dir=out_dir, save=save)
+    deployment_errors = generate_deployment_errors(out_dir=out_dir, save=save, seed=seed)
     deployment_errors = reduce_deployment_errors(
         deployment_errors, reduction_factor=reduction_factor, out_dir=out_dir, save=save
     )
@@ -109,10 +155,13 @@ def generate_random_ote_deployment(out_dir, reduction_factor=0.2, save=True):
     # Remove tip and tilt
     ote = remove_piston_tip_tilt(ote, out_dir=out_dir, save=save)
 
+    if use_store:
+        save_ote_realization(store_dir, key, deployment_errors, ote, segment_tilts, ote_opd_with_tilts)
+
     return ote, segment_tilts, ote_opd_with_tilts
 
 
-def generate_deployment_errors(save=True, out_dir=None):
+def generate_deployment_errors(save=True, out_dir=None, seed=None):
     """Randomly generate a expected deployment tolerances.
 
     Parameters:
@@ -121,6 +170,9 @@ def generate_deployment_errors(save=True, out_dir=None):
         Denotes whether to save out the deployment error dictionary as a yaml
     out_dir : str, optional
         Directory in which to store the saved yaml file
+    seed : int, optional
+        Seed for the random number generator, so that the same errors can
+        be generated again. If None, the global numpy random state is used.
 
     Returns:
     --------
@@ -132,20 +184,21 @@ def generate_deployment_errors(save=True, out_dir=None):
     Deployment tolerances taken from JWST WFS&C Commissioning and Operations Plan (OTE-24):
     D36168 / 2299462 Rev C Page 10
     """
+    random = np.random if seed is None else np.random.RandomState(seed)
 
     deployment_errors = {
-        'sm_piston': np.random.normal(loc=0, scale=2500/5),  # microns
-        'sm_tilt': np.random.normal(loc=0, scale=1300/5, size=2),  # microradians
-        'sm_decenter': np.random.normal(loc=0, scale=2500/5, size=2),  # microns
-        'pm_piston': np.random.normal(loc=0, scale=1500/5, size=18),  # microns
-        'pm_tilt': np.random.normal(loc=0, scale=1100/5, size=(18, 2)),  # microradians
-        'pm_decenter': np.random.normal(loc=0, scale=1300/5, size=(18, 2)),  # microns
-        'pm_roc': np.random.normal(loc=0, scale=151/5, size=(18)),  # microns
-        'pm_clocking': np.random.normal(loc=0, scale=1200/5, size=(18)),  # microradians
-        'global_pm_piston': np.random.normal(loc=0, scale=700/5),  # microns
-        'global_pm_tilt': np.random.normal(loc=0, scale=190/5, size=2),  # microradians
-        'global_pm_decenter': np.random.normal(loc=0, scale=200/5, size=2),  # microns
-        'global_pm_clocking': np.random.normal(loc=0, scale=150/5),  # microradians
+        'sm_piston': random.normal(loc=0, scale=2500/5),  # microns
+        'sm_tilt': random.normal(loc=0, scale=1300/5, size=2),  # microradians
+        'sm_decenter': random.normal(loc=0, scale=2500/5, size=2),  # microns
+        'pm_piston': random.normal(loc=0, scale=1500/5, size=18),  # microns
+        'pm_tilt': random.normal(loc=0, scale=1100/5, size=(18, 2)),  # microradians
+        'pm_decenter': random.normal(loc=0, scale=1300/5, size=(18, 2)),  # microns
+        'pm_roc': random.normal(loc=0, scale=151/5, size=(18)),  # microns
+        'pm_clocking': random.normal(loc=0, scale=1200/5, size=(18)),  # microradians
+        'global_pm_piston': random.normal(loc=0, scale=700/5),  # microns
+        'global_pm_tilt': random.normal(loc=0, scale=190/5, size=2),  # microradians
+        'global_pm_decenter': random.normal(loc=0, scale=200/5, size=2),  # microns
+        'global_pm_clocking': random.normal(loc=0, scale=150/5),  # microradians
     }
 
     # Save the deployments dictionary to a yaml file that can be opened
@@ -159,6 +212,97 @@ def generate_deployment_errors(save=True, out_dir=None):
 
     return deployment_errors
 
+
+def load_ote_realization(store_dir, key):
+    """Read a stored deployment realization.
+
+    Parameters:
+    -----------
+    store_dir : str
+        Directory of stored deployment realizations
+    key : str
+        Key of the realization, from ``realization_key``
+
+    Returns:
+    --------
+    realization : dict or None
+        Dictionary with the deployment errors, segment states, segment tilts,
+        and OPD with tilts of the realization, or None if it is not stored
+    """
+    filename = os.path.join(store_dir, 'ote_realization_{}.npz'.format(key))
+    if not os.path.isfile(filename):
+        return None
+
+    print('Using stored OTE deployment realization {}'.format(filename))
+    with np.load(filename) as stored:
+        realization = {name: stored[name] for name in stored.files}
+    realization['deployment_errors'] = {name[len('error_'):]: realization.pop(name)
+                                        for name in list(realization) if name.startswith('error_')}
+    return realization
+
+
+def ote_from_realization(realization, save=True, out_dir=None):
+    """Create a WebbPSF adjustable OTE object from a stored deployment
+    realization, with piston, tip, and tilt removed.
+
+    Parameters:
+    -----------
+    realization : dict
+        Realization as returned by ``load_ote_realization``
+    save : bool, optional
+        Denotes whether to save out the OPD (with and without tip/tilt)
+        as FITs files
+    out_dir : str, optional
+        Directory in which to store the saved FITS files
+
+    Returns:
+    --------
+    ote : webbpsf.opds.OTE_Linear_Model_WSS object
+        WebbPSF OTE object describing perturbed OTE state with tip and tilt removed
+    segment_tilts : numpy.ndarray
+        List of X and Y tilts for each mirror segment, in microradians
+    ote_opd_with_tilts : numpy.ndarray
+        Array representing perturbed OTE OPD pupil before tip/tilt is removed
+    """
+    nc = webbpsf.NIRCam()
+    nc, ote = webbpsf.enable_adjustable_ote(nc)
+
+    ote.reset()
+    ote.remove_piston_tip_tilt = True
+    ote.segment_state[:] = realization['segment_state']
+    ote.update_opd()
+
+    if out_dir is not None and save:
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        for opd, prefix in [(realization['opd_with_tilts'], 'OPD_withtilt'), (ote.opd, 'OPD_notilt')]:
+            save_file = os.path.join(out_dir, '{}_{}.fits'.format(prefix, timestamp))
+            hdu = fits.PrimaryHDU(opd, header=ote.opd_header)
+            hdu.writeto(save_file)
+            print('Saved OPD to {}'.format(save_file))
+    elif save:
+        raise IOError('Cannot save OPDs; no out_dir provided')
+
+    return ote, realization['segment_tilts'], realization['opd_with_tilts']
+
+
+def realization_key(**parameters):
+    """Create the key identifying a deployment realization from the
+    parameters that define it (e.g. seed and reduction factor, or the
+    hash of a deployments yaml file).
+
+    Parameters:
+    -----------
+    parameters : dict
+        Parameters defining the realization. Values must be JSON serializable.
+
+    Returns:
+    --------
+    key : str
+        Hash of the parameters
+    """
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+
+
 def reduce_deployment_errors(deployment_errors, reduction_factor=0.2, save=True, out_dir=None):
     """Reduce an existing dictionary of deployment errors by a given factor.
 
@@ -284,3 +428,34 @@ def remove_piston_tip_tilt(ote, save=True, out_dir=None):
         raise IOError('Cannot save deployment errors to yaml; no out_dir provided')
 
     return ote
+
+
+def save_ote_realization(store_dir, key, deployment_errors, ote, segment_tilts, ote_opd_with_tilts):
+    """Add a deployment realization to the store.
+
+    Parameters:
+    -----------
+    store_dir : str
+        Directory of stored deployment realizations
+    key : str
+        Key of the realization, from ``realization_key``
+    deployment_errors : dict
+        Dictionary containing lists of deployment errors
+    ote : webbpsf.opds.OTE_Linear_Model_WSS object
+        Adjustable OTE object with piston/tip/tilt removed
+    segment_tilts : numpy.ndarray
+        List of X and Y tilts for each mirror segment, in microradians
+    ote_opd_with_tilts : numpy.ndarray
+        Array representing perturbed OTE OPD pupil before tip/tilt is removed
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    filename = os.path.join(store_dir, 'ote_realization_{}.npz'.format(key))
+    arrays = {'error_{}'.format(name): np.asarray(value) for name, value in deployment_errors.items()}
+
+    # Write to a temporary file first, so that concurrent runs never read
+    # a partial realization
+    temp_file = '{}.{}.tmp.npz'.format(filename[:-4], os.getpid())
+    np.savez_compressed(temp_file, segment_state=ote.segment_state, segment_tilts=segment_tilts,
+                        opd_with_tilts=ote_opd_with_tilts, **arrays)
+    os.replace(temp_file, filename)
+    print('Saved OTE deployment realization to {}'.format(filename))
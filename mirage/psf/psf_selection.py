@@ -10,6 +10,26 @@ For both of these files, once they are identified, they are read in via
 the appropriate mechanisms for the data they contain, and the resulting
 object is returned.
 
+In order to avoid opening the header of every file in a large library
+each time a file is selected, the header keywords used for selection are
+kept in an index file (``mirage_psf_library_index.json``) within the
+library directory. Entries in the index are validated against the
+modification time and size of each file, so that new or changed library
+files are re-read automatically.
+
+Gridded PSF models that have been read in are kept in an in-process
+cache keyed by the resolved filename and modification time of the
+library file, so that repeated simulations within one process using the
+same library share a single model. The cache is limited by a memory
+budget, which can be changed with ``set_library_cache_limit``.
+
+For batch runs in which many processes on one node use the same
+library, set the ``MIRAGE_SHARED_PSF_DIR`` environment variable to a
+directory on local disk. The PSF library and wings data are then exported
+once to ``.npy`` files in that directory and memory-mapped read-only by
+every process, so the operating system holds a single copy of the data
+regardless of the number of workers.
+
 Author
 ------
 
@@ -28,22 +48,163 @@ Use
 """
 
 
+from collections import OrderedDict
 from copy import copy
 from glob import glob
+import hashlib
+import json
 import os
 
 from astropy.io import fits
+from astropy.nddata import NDData
 import numpy as np
+from photutils.psf import GriddedPSFModel
 from webbpsf.utils import to_griddedpsfmodel
 
 from mirage.utils.constants import NIRISS_PUPIL_WHEEL_FILTERS
 from mirage.utils.utils import expand_environment_variable
 
+LIBRARY_INDEX_FILENAME = 'mirage_psf_library_index.json'
+LIBRARY_INDEX_VERSION = 1
+
+# Header keywords needed to select a library file
+INDEX_KEYWORDS = ['INSTRUME', 'DETECTOR', 'DET_NAME', 'FILTER', 'PUPIL', 'PUPIL_MASK',
+                  'OPD_FILE', 'OPDSLICE', 'SEGID', 'ORIGIN']
+
+# Loaded GriddedPSFModel objects, ordered from least to most recently used.
+# Keys are (resolved filename, modification time) tuples.
+_LIBRARY_CACHE = OrderedDict()
+LIBRARY_CACHE_MAX_BYTES = 2 * 1024**3
+
+# Most recently read PSF wings image, keyed like _LIBRARY_CACHE
+_WINGS_CACHE = {}
+
+# Environment variable pointing to the directory of memory-mapped library data
+SHARED_LIBRARY_ENV_VAR = 'MIRAGE_SHARED_PSF_DIR'
+
+
+class PSFLibraryIndex():
+    """Persistent index of the header keywords used to select files
+    from a PSF library directory.
+
+    Headers are read from the FITS files only for files that are not yet
+    in the index, or whose modification time or size has changed since
+    they were indexed. Entries for files that no longer exist are dropped.
+
+    Parameters
+    ----------
+    library_path : str
+        Path pointing to the location of the PSF library
+
+    index_file : str, optional
+        Name of the JSON file in which to store the index. If None, the
+        index is saved as ``LIBRARY_INDEX_FILENAME`` within ``library_path``.
+    """
+    def __init__(self, library_path, index_file=None):
+        self.library_path = library_path
+        if index_file is None:
+            index_file = os.path.join(library_path, LIBRARY_INDEX_FILENAME)
+        self.index_file = index_file
+        self.entries = {}
+        self.modified = False
+        self.load()
+
+    def files(self):
+        """Return the full paths of all FITS files in the library
+
+        Returns
+        -------
+        psf_files : list
+            List of FITS files in ``library_path``
+        """
+        return sorted(glob(os.path.join(self.library_path, '*.fits')))
+
+    def get_header(self, filename, extname='PRIMARY'):
+        """Return the selection keywords from the header of one extension
+        of a library file, reading the file only if the index entry is
+        missing or out of date.
+
+        Parameters
+        ----------
+        filename : str
+            Name of the PSF library file
+
+        extname : str
+            Name of the extension whose header is needed
+
+        Returns
+        -------
+        header : dict
+            Dictionary of the ``INDEX_KEYWORDS`` present in the header
+        """
+        extname = extname.upper()
+        basename = os.path.basename(filename)
+        full_filename = os.path.join(self.library_path, basename)
+        stat = os.stat(full_filename)
+
+        entry = self.entries.get(basename)
+        if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+            entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'headers': {}}
+            self.entries[basename] = entry
+            self.modified = True
+
+        if extname not in entry['headers']:
+            if extname == 'PRIMARY':
+                header = fits.getheader(full_filename)
+            else:
+                header = fits.getheader(full_filename, extname=extname)
+            entry['headers'][extname] = {key: header[key] for key in INDEX_KEYWORDS
+                                         if isinstance(header.get(key), (str, int, float, bool))}
+            self.modified = True
+        return entry['headers'][extname]
+
+    def load(self):
+        """Read the index file, if present. An unreadable index file or
+        one written by a different version of the index is ignored.
+        """
+        if not os.path.isfile(self.index_file):
+            return
+        try:
+            with open(self.index_file) as index_obj:
+                contents = json.load(index_obj)
+        except (OSError, ValueError):
+            print("Unable to read PSF library index {}. Ignoring it.".format(self.index_file))
+            return
+        if contents.get('version') == LIBRARY_INDEX_VERSION:
+            self.entries = contents['files']
+
+    def save(self):
+        """Write the index to disk if it has changed. Failure to write
+        (e.g. a read-only library directory) is not fatal.
+        """
+        if not self.modified:
+            return
+
+        # Drop entries for files no longer in the library
+        present = set(os.path.basename(filename) for filename in self.files())
+        self.entries = {key: value for key, value in self.entries.items() if key in present}
+
+        temp_file = '{}.{}.tmp'.format(self.index_file, os.getpid())
+        try:
+            with open(temp_file, 'w') as index_obj:
+                json.dump({'version': LIBRARY_INDEX_VERSION, 'files': self.entries}, index_obj)
+            os.replace(temp_file, self.index_file)
+            self.modified = False
+        except OSError:
+            print("Unable to write PSF library index {}.".format(self.index_file))
+            if os.path.isfile(temp_file):
+                os.remove(temp_file)
+
+
+def clear_library_cache():
+    """Remove all gridded PSF models and PSF wings from the in-process cache"""
+    _LIBRARY_CACHE.clear()
+    _WINGS_CACHE.clear()
 
 
 def confirm_gridded_properties(filename, instrument, detector, filtername, pupilname,
                                wavefront_error_type, wavefront_error_group, file_path,
-                               extname='PRIMARY'):
+                               extname='PRIMARY', use_index=True):
     """Examine the header of the gridded PSF model file to confirm that
     the properties of the data match those expected.
 
@@ -76,6 +237,10 @@ def confirm_gridded_properties(filename, instrument, detector, filtername, pupil
     extname : str
         Name of the extension within ``filename`` to check
 
+    use_index : bool, optional
+        If True, get the header keywords from the library index rather
+        than opening the file, updating the index as needed.
+
     Returns
     -------
     full_filename : str
@@ -89,8 +254,13 @@ def confirm_gridded_properties(filename, instrument, detector, filtername, pupil
                                                '{}/gridded_psf_library'.format(instrument.lower()))
 
     full_filename = os.path.join(file_path, filename)
-    with fits.open(full_filename) as hdulist:
-        header = hdulist[extname.upper()].header
+    if use_index:
+        library_index = PSFLibraryIndex(os.path.dirname(full_filename))
+        header = library_index.get_header(full_filename, extname)
+        library_index.save()
+    else:
+        with fits.open(full_filename) as hdulist:
+            header = hdulist[extname.upper()].header
 
     inst = header['INSTRUME']
     try:
@@ -206,20 +376,14 @@ def get_gridded_psf_library(instrument, detector, filtername, pupilname, wavefro
     print("PSFs will be generated using: {}".format(os.path.abspath(library_file)))
 
     try:
-        library = to_griddedpsfmodel(library_file)
-    except KeyError:
-        # Handle input ITM images
-        itm_sim = fits.getval(library_file, 'ORIGIN')
-        if itm_sim:
-            library = _load_itm_library(library_file)
-
+        library = load_gridded_psf_model(library_file)
     except OSError:
         print("OSError: Unable to open {}.".format(library_file))
     return library
 
 
 def get_library_file(instrument, detector, filt, pupil, wfe, wfe_group,
-                     library_path, wings=False, segment_id=None):
+                     library_path, wings=False, segment_id=None, use_index=True):
     """Given an instrument and filter name along with the path of
     the PSF library, find the appropriate library file to load.
 
@@ -253,12 +417,298 @@ def get_library_file(instrument, detector, filt, pupil, wfe, wfe_group,
         If specified, returns a segment PSF library file and denotes the ID
         of the mirror segment
 
+    use_index : bool, optional
+        If True, read header keywords from the library index, updating
+        the index as needed, rather than opening every library file.
+
     Returns
     --------
     matches : str
         Name of the PSF library file for the instrument and filter name
     """
-    psf_files = glob(os.path.join(library_path, '*.fits'))
+    matches = query_library_index(instrument, detector, filt, pupil, wfe, wfe_group,
+                                  library_path, wings=wings, segment_id=segment_id,
+                                  use_index=use_index)
+
+    # Find files matching the requested inputs
+    if len(matches) == 1:
+        return matches[0]
+    elif len(matches) == 0:
+        raise ValueError("No PSF library file found matching requested parameters.")
+    elif len(matches) > 1:
+        raise ValueError("More than one PSF library file matches requested parameters: {}".format(matches))
+
+
+def get_psf_wings(instrument, detector, filtername, pupilname, wavefront_error, wavefront_error_group,
+                  library_path):
+    """Locate the file containing PSF wing image and read them in. The
+    idea is that there will only be one file for a given detector/filter/
+    pupil/WFE/realization combination. This file will contain a PSF
+    sampled at detector resolution and covering some large area in pixels.
+    Later, when making the seed image, the appropriate subarray will be
+    pulled out of this array for each input source depending on its
+    magnitude.
+
+    Parameters
+    ----------
+    instrument : str
+        Name of instrument the PSFs are from
+
+    detector : str
+        Name of the detector within ```instrument```
+
+    filtername : str
+        Name of filter used for PSF library creation
+
+    pupilname : str
+        Name of pupil wheel element used for PSF library creation
+
+    wavefront_error : str
+        Wavefront error. Can be 'predicted' or 'requirements'
+
+    wavefront_error_group : int
+        Wavefront error realization group. Must be an integer from 0 - 9.
+
+    library_path : str
+        Path pointing to the location of the PSF library
+
+    Returns
+    -------
+    psf_wings : numpy.ndarray
+        Read-only array containing the PSF wing data. Note that the
+        outermost row and column are not returned, in order to avoid edge
+        effects. The most recently read wings image is kept in memory and
+        returned again if the same file is requested.
+
+    """
+    # First, as a way to save time, let's assume a file naming convention
+    # and search for the appropriate file that way. If we find a match,
+    # confirm the properties of the file via the header. This way we don't
+    # need to open and examine every file in the gridded library, which
+    # saves at least a handful of seconds.
+    default_file_pattern = '{}_{}_{}_{}_fovp*_samp*_{}_realization{}.fits'.format(instrument.lower(),
+                                                                                  detector.lower(),
+                                                                                  filtername.lower(),
+                                                                                  pupilname.lower(),
+                                                                                  wavefront_error.lower(),
+                                                                                  wavefront_error_group)
+    default_matches = glob(os.path.join(library_path, default_file_pattern))
+
+    wings_file = None
+    if len(default_matches) == 1:
+        wings_file = confirm_gridded_properties(default_matches[0], instrument, detector, filtername,
+                                                pupilname, wavefront_error, wavefront_error_group,
+                                                library_path, extname='DET_DIST')
+
+    # If the above search found no matching files, or multiple matching
+    # files (based only on filename), or if the matching file's gridded
+    # PSF model properties don't match what's expected, then resort to
+    # opening and examining all files in the library.
+    if wings_file is None:
+        # Find the file containing the PSF wings
+        wings_file = get_library_file(instrument, detector, filtername, pupilname,
+                                      wavefront_error, wavefront_error_group, library_path, wings=True)
+
+    print("PSF wings will be from: {}".format(os.path.basename(wings_file)))
+    key = (os.path.realpath(wings_file), os.path.getmtime(wings_file))
+    if key in _WINGS_CACHE:
+        return _WINGS_CACHE[key]
+
+    shared_dir = os.environ.get(SHARED_LIBRARY_ENV_VAR)
+    if shared_dir:
+        psf_wing = load_shared_wings(wings_file, shared_dir)
+    else:
+        with fits.open(wings_file) as hdulist:
+            psf_wing = hdulist['DET_DIST'].data
+    # Crop the outer row and column in order to remove any potential edge
+    # effects leftover from creation
+    psf_wing = psf_wing[1:-1, 1:-1]
+
+    for shape in psf_wing.shape:
+        if shape % 2 == 0:
+            print(("WARNING: PSF wing file contains an even number of rows or columns. "
+                   "These must be even."))
+            raise ValueError
+
+    # The wings image is shared by every source and every caller, so
+    # protect it from modification
+    psf_wing.setflags(write=False)
+    _WINGS_CACHE.clear()
+    _WINGS_CACHE[key] = psf_wing
+    return psf_wing
+
+
+def load_gridded_psf_model(library_file, use_cache=True):
+    """Read a gridded PSF library file into a griddedPSFModel, returning
+    the model from the in-process cache if the same file (with the same
+    modification time) has already been read.
+
+    Parameters
+    ----------
+    library_file : str
+        Name of the PSF library file
+
+    use_cache : bool, optional
+        If False, always read the file and do not add the resulting
+        model to the cache.
+
+        If the ``MIRAGE_SHARED_PSF_DIR`` environment variable is set, the
+        model is built over memory-mapped data via
+        ``load_shared_gridded_psf_model``.
+
+    Returns
+    -------
+    library : photutils.griddedPSFModel
+        Object containing PSF library. Models returned from the cache are
+        shared, and should not be modified.
+    """
+    key = (os.path.realpath(library_file), os.path.getmtime(library_file))
+    if use_cache and key in _LIBRARY_CACHE:
+        _LIBRARY_CACHE.move_to_end(key)
+        return _LIBRARY_CACHE[key]
+
+    shared_dir = os.environ.get(SHARED_LIBRARY_ENV_VAR)
+    if shared_dir:
+        library = load_shared_gridded_psf_model(library_file, shared_dir)
+    else:
+        library = _read_gridded_psf_model(library_file)
+
+    if use_cache and library.data.nbytes <= LIBRARY_CACHE_MAX_BYTES:
+        # Drop any older version of the same file before adding this one
+        for cached_key in [cached for cached in _LIBRARY_CACHE if cached[0] == key[0]]:
+            del _LIBRARY_CACHE[cached_key]
+        _LIBRARY_CACHE[key] = library
+        _evict_library_cache()
+    return library
+
+
+def load_shared_gridded_psf_model(library_file, shared_dir):
+    """Create a griddedPSFModel whose data are memory-mapped from a
+    ``.npy`` export of the library in ``shared_dir``. The export is
+    created the first time a given library file (and modification time)
+    is requested, so all processes using the same ``shared_dir`` share
+    one copy of the data.
+
+    Parameters
+    ----------
+    library_file : str
+        Name of the PSF library file
+
+    shared_dir : str
+        Directory holding the exported library data
+
+    Returns
+    -------
+    library : photutils.griddedPSFModel
+        Object containing PSF library, with read-only data
+    """
+    stem = _shared_file_stem(library_file, 'PRIMARY', shared_dir)
+    data_file = '{}.npy'.format(stem)
+    meta_file = '{}.json'.format(stem)
+
+    if not os.path.isfile(meta_file):
+        # The data and positions of a griddedPSFModel are already sorted
+        # into grid order, so the export can be used without reordering
+        library = _read_gridded_psf_model(library_file)
+        meta = {'grid_xypos': np.asarray(library.grid_xypos).tolist(),
+                'oversampling': np.asarray(library.oversampling).tolist()}
+        _write_shared_file(data_file, lambda obj: np.save(obj, np.asarray(library.data)))
+        # The metadata file is written last and marks the export as complete
+        _write_shared_file(meta_file, lambda obj: obj.write(json.dumps(meta).encode()))
+
+    with open(meta_file) as meta_obj:
+        meta = json.load(meta_obj)
+    data = np.load(data_file, mmap_mode='r')
+    meta['grid_xypos'] = [tuple(xypos) for xypos in meta['grid_xypos']]
+    library = GriddedPSFModel(NDData(data, meta=meta))
+
+    # The export holds the PSFs in the model's grid order (sorted by y,
+    # then x), but some photutils versions copy the data while sorting it
+    # anyway. Point those models back at the memory-mapped array so that
+    # the data are not duplicated in every process.
+    if not np.shares_memory(library.data, data):
+        if not np.array_equal(library.grid_xypos, np.array(meta['grid_xypos'])):
+            raise ValueError('Shared PSF library {} is not in grid order.'.format(data_file))
+        library._data = data
+    return library
+
+
+def load_shared_wings(wings_file, shared_dir):
+    """Return the PSF wings image from ``wings_file`` as a read-only
+    array memory-mapped from a ``.npy`` export in ``shared_dir``,
+    creating the export if necessary.
+
+    Parameters
+    ----------
+    wings_file : str
+        Name of the file containing the PSF wings in its DET_DIST extension
+
+    shared_dir : str
+        Directory holding the exported wings data
+
+    Returns
+    -------
+    psf_wing : numpy.memmap
+        Full PSF wings image
+    """
+    data_file = '{}.npy'.format(_shared_file_stem(wings_file, 'DET_DIST', shared_dir))
+    if not os.path.isfile(data_file):
+        psf_wing = fits.getdata(wings_file, extname='DET_DIST')
+        _write_shared_file(data_file, lambda obj: np.save(obj, psf_wing))
+    return np.load(data_file, mmap_mode='r')
+
+
+def query_library_index(instrument, detector, filt, pupil, wfe, wfe_group,
+                        library_path, wings=False, segment_id=None, use_index=True):
+    """Find all files in the PSF library whose header keywords match the
+    given instrument, detector, filter, pupil, wavefront error and
+    realization. Header keywords are taken from the library index where
+    possible.
+
+    Parameters
+    -----------
+    instrument : str
+        Name of instrument the PSFs are from
+
+    detector : str
+        Name of the detector within ```instrument```
+
+    filt : str
+        Name of filter used for PSF library creation
+
+    pupil : str
+        Name of pupil wheel element used for PSF library creation
+
+    wfe : str
+        Wavefront error. Can be 'predicted' or 'requirements'
+
+    wfe_group : int
+        Wavefront error realization group. Must be an integer from 0 - 9.
+
+    library_path : str
+        Path pointing to the location of the PSF library
+
+    wings : bool, optional
+        Must the library file contain PSF wings or PSF cores? Default is False.
+
+    segment_id : int or None, optional
+        If specified, returns a segment PSF library file and denotes the ID
+        of the mirror segment
+
+    use_index : bool, optional
+        If True, read header keywords from the library index, updating
+        the index as needed, rather than opening every library file.
+
+    Returns
+    -------
+    matches : list
+        Full paths of the matching PSF library files
+    """
+    if use_index:
+        library_index = PSFLibraryIndex(library_path)
+        psf_files = library_index.files()
+    else:
+        psf_files = glob(os.path.join(library_path, '*.fits'))
 
     # Determine if the PSF path is default or not
     mirage_dir = expand_environment_variable('MIRAGE_DATA')
@@ -280,7 +730,10 @@ def get_library_file(instrument, detector, filt, pupil, wfe, wfe_group,
 
     for filename in psf_files:
         try:
-            header = fits.getheader(filename)
+            if use_index:
+                header = library_index.get_header(filename)
+            else:
+                header = fits.getheader(filename)
 
             # Determine if it is an ITM file
             itm_sim = header.get('ORIGIN', '') == 'ITM'
@@ -354,96 +807,34 @@ def get_library_file(instrument, detector, filt, pupil, wfe, wfe_group,
         except KeyError:
             continue
 
-    # Find files matching the requested inputs
-    if len(matches) == 1:
-        return matches[0]
-    elif len(matches) == 0:
-        raise ValueError("No PSF library file found matching requested parameters.")
-    elif len(matches) > 1:
-        raise ValueError("More than one PSF library file matches requested parameters: {}".format(matches))
+    if use_index:
+        library_index.save()
+    return matches
 
 
-def get_psf_wings(instrument, detector, filtername, pupilname, wavefront_error, wavefront_error_group,
-                  library_path):
-    """Locate the file containing PSF wing image and read them in. The
-    idea is that there will only be one file for a given detector/filter/
-    pupil/WFE/realization combination. This file will contain a PSF
-    sampled at detector resolution and covering some large area in pixels.
-    Later, when making the seed image, the appropriate subarray will be
-    pulled out of this array for each input source depending on its
-    magnitude.
+def set_library_cache_limit(max_bytes):
+    """Set the memory budget of the in-process gridded PSF model cache,
+    evicting the least recently used models if necessary.
 
     Parameters
     ----------
-    instrument : str
-        Name of instrument the PSFs are from
-
-    detector : str
-        Name of the detector within ```instrument```
-
-    filtername : str
-        Name of filter used for PSF library creation
-
-    pupilname : str
-        Name of pupil wheel element used for PSF library creation
-
-    wavefront_error : str
-        Wavefront error. Can be 'predicted' or 'requirements'
-
-    wavefront_error_group : int
-        Wavefront error realization group. Must be an integer from 0 - 9.
-
-    library_path : str
-        Path pointing to the location of the PSF library
-
-    Returns
-    -------
-    psf_wings : numpy.ndarray
-        Array containing the PSF wing data. Note that the outermost row
-        and column are not returned, in order to avoid edge effects
-
+    max_bytes : int
+        Maximum total size, in bytes, of the PSF data held in the cache.
+        Use 0 to disable caching.
     """
-    # First, as a way to save time, let's assume a file naming convention
-    # and search for the appropriate file that way. If we find a match,
-    # confirm the properties of the file via the header. This way we don't
-    # need to open and examine every file in the gridded library, which
-    # saves at least a handful of seconds.
-    default_file_pattern = '{}_{}_{}_{}_fovp*_samp*_{}_realization{}.fits'.format(instrument.lower(),
-                                                                                  detector.lower(),
-                                                                                  filtername.lower(),
-                                                                                  pupilname.lower(),
-                                                                                  wavefront_error.lower(),
-                                                                                  wavefront_error_group)
-    default_matches = glob(os.path.join(library_path, default_file_pattern))
+    global LIBRARY_CACHE_MAX_BYTES
+    LIBRARY_CACHE_MAX_BYTES = max_bytes
+    _evict_library_cache()
 
-    wings_file = None
-    if len(default_matches) == 1:
-        wings_file = confirm_gridded_properties(default_matches[0], instrument, detector, filtername,
-                                                pupilname, wavefront_error, wavefront_error_group,
-                                                library_path, extname='DET_DIST')
 
-    # If the above search found no matching files, or multiple matching
-    # files (based only on filename), or if the matching file's gridded
-    # PSF model properties don't match what's expected, then resort to
-    # opening and examining all files in the library.
-    if wings_file is None:
-        # Find the file containing the PSF wings
-        wings_file = get_library_file(instrument, detector, filtername, pupilname,
-                                      wavefront_error, wavefront_error_group, library_path, wings=True)
-
-    print("PSF wings will be from: {}".format(os.path.basename(wings_file)))
-    with fits.open(wings_file) as hdulist:
-        psf_wing = hdulist['DET_DIST'].data
-    # Crop the outer row and column in order to remove any potential edge
-    # effects leftover from creation
-    psf_wing = psf_wing[1:-1, 1:-1]
-
-    for shape in psf_wing.shape:
-        if shape % 2 == 0:
-            print(("WARNING: PSF wing file contains an even number of rows or columns. "
-                   "These must be even."))
-            raise ValueError
-    return psf_wing
+def _evict_library_cache():
+    """Remove least recently used models from the cache until the total
+    size of the cached PSF data is within ``LIBRARY_CACHE_MAX_BYTES``
+    """
+    total = sum(library.data.nbytes for library in _LIBRARY_CACHE.values())
+    while _LIBRARY_CACHE and total > LIBRARY_CACHE_MAX_BYTES:
+        _, library = _LIBRARY_CACHE.popitem(last=False)
+        total -= library.data.nbytes
 
 
 def _load_itm_library(library_file):
@@ -478,3 +869,74 @@ def _load_itm_library(library_file):
         return library
     else:
         raise ValueError('Expecting ITM data of size (2048, 2048), not {}'.format(data.shape))
+
+
+def _read_gridded_psf_model(library_file):
+    """Read a gridded PSF library file, or ITM image, into a griddedPSFModel
+
+    Parameters
+    ----------
+    library_file : str
+        Name of the PSF library file
+
+    Returns
+    -------
+    library : photutils.griddedPSFModel
+        Object containing PSF library
+    """
+    try:
+        library = to_griddedpsfmodel(library_file)
+    except KeyError:
+        # Handle input ITM images
+        itm_sim = fits.getval(library_file, 'ORIGIN')
+        if itm_sim:
+            library = _load_itm_library(library_file)
+    return library
+
+
+def _shared_file_stem(filename, extname, shared_dir):
+    """Construct the name, minus extension, of the shared export of one
+    extension of a library file. The name includes a hash of the resolved
+    filename and modification time, so changed files are exported anew.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the PSF library file
+
+    extname : str
+        Name of the extension being exported
+
+    shared_dir : str
+        Directory holding the exported data
+
+    Returns
+    -------
+    stem : str
+        Full path of the export, without file extension
+    """
+    full_filename = os.path.realpath(filename)
+    identity = '{}:{}:{}'.format(full_filename, os.path.getmtime(full_filename), extname.upper())
+    digest = hashlib.sha1(identity.encode()).hexdigest()[:16]
+    basename = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(shared_dir, '{}_{}_{}'.format(basename, extname.lower(), digest))
+
+
+def _write_shared_file(filename, writer):
+    """Write a shared export atomically, so that concurrent processes
+    never see a partially written file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the file to create
+
+    writer : func
+        Function that writes the contents to the open binary file object
+        it is given
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    temp_file = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(temp_file, 'wb') as file_obj:
+        writer(file_obj)
+    os.replace(temp_file, filename)
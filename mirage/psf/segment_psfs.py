@@ -19,24 +19,90 @@ Use
         lib = get_gridded_segment_psf_library_list(instrument, detector, filter,
                 out_dir, pupilname="CLEAR")
 """
+import hashlib
+from multiprocessing import Pool
 import os
 import time
 
 from astropy.io import fits
 import numpy as np
-import pysiaf
+from pysiaf.constants import JWST_PRD_DATA_ROOT
 import webbpsf
 from webbpsf.gridded_library import CreatePSFLibrary
-from webbpsf.utils import to_griddedpsfmodel
 
-from mirage.psf.psf_selection import get_library_file
+from mirage.psf.psf_selection import get_library_file, load_gridded_psf_model
+from mirage.utils import siaf_interface
+
+
+class SegmentLibraryList():
+    """List of segment PSF libraries in which each library is read into a
+    griddedPSFModel only when it is first accessed. Segments that never
+    contribute to a simulation are therefore never read.
+
+    Parameters
+    ----------
+    library_files : list
+        Names of the segment PSF library files, in order of segment ID
+    """
+    def __init__(self, library_files):
+        self.library_files = list(library_files)
+        self._libraries = [None] * len(self.library_files)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if self._libraries[index] is None:
+            self._libraries[index] = load_gridded_psf_model(self.library_files[index])
+        return self._libraries[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self.library_files)
+
+    def data_shape(self, index=0):
+        """Return the shape of a library's PSF data from its header,
+        without reading the library
+
+        Parameters
+        ----------
+        index : int
+            Position of the library in the list
+
+        Returns
+        -------
+        shape : tuple
+            Shape of the PSF data array
+        """
+        if self._libraries[index] is not None:
+            return self._libraries[index].data.shape
+        header = fits.getheader(self.library_files[index])
+        return tuple(header['NAXIS{}'.format(axis)] for axis in range(header['NAXIS'], 0, -1))
+
+    def loaded(self):
+        """Return the indexes of the libraries that have been read
+
+        Returns
+        -------
+        indexes : list
+            Positions in the list of the libraries read so far
+        """
+        return [i for i, library in enumerate(self._libraries) if library is not None]
 
 
 def generate_segment_psfs(ote, segment_tilts, out_dir, filters=['F212N', 'F480M'],
-                          detectors='all', fov_pixels=1024, overwrite=False):
+                          detectors='all', fov_pixels=1024, overwrite=False, processes=1):
     """Generate NIRCam PSF libraries for all 18 mirror segments given a perturbed OTE
     mirror state. Saves each PSF library as a FITS file named in the following format:
-        nircam_{filter}_fovp{fov size}_samp1_npsf1_seg{segment number}.fits
+        nircam_{detector}_{filter}_fovp{fov size}_samp1_npsf1_seg{segment number}.fits
+
+    Each (segment, detector, filter) library is an independent task. Tasks
+    can be spread over a pool of worker processes, and tasks whose output
+    file already exists and was made from the same OTE state and segment
+    tilts are skipped unless ``overwrite`` is True, so an interrupted run
+    can be restarted.
 
     Parameters
     ----------
@@ -61,12 +127,20 @@ def generate_segment_psfs(ote, segment_tilts, out_dir, filters=['F212N', 'F480M'
 
     overwrite : bool, optional
             True/False boolean to overwrite the output file if it already
-            exists. Default is True.
+            exists. Default is False, in which case existing files made
+            from the same OTE state and segment tilts are kept and not
+            regenerated. Files made from other inputs are always regenerated.
 
-    """
-    # Create webbpsf NIRCam instance
-    nc = webbpsf.NIRCam()
+    processes : int, optional
+        Number of worker processes to use. Default is 1, which generates
+        the libraries serially in the calling process.
 
+    Returns
+    -------
+    filepaths : list
+        Names of all segment PSF library files, in order of segment,
+        detector and filter
+    """
     # Create dummy CreatePSFLibrary instance to get lists of filter and detectors
     lib = CreatePSFLibrary
 
@@ -85,71 +159,52 @@ def generate_segment_psfs(ote, segment_tilts, out_dir, filters=['F212N', 'F480M'
     elif not isinstance(detectors, list):
         raise TypeError('Please define detectors as a string or list, not {}'.format(type(detectors)))
 
-
-    # Create PSF grids for all segments, detectors, and filters
+    # Make sure the detectors and filters match
+    det_filt_pairs = []
+    for det in sorted(detectors):
+        for filt in list(filters):
+            if (det in lib.nrca_short_detectors and filt not in lib.nrca_short_filters) \
+                    or (det in lib.nrca_long_detectors and filt not in lib.nrca_long_filters):
+                continue
+            det_filt_pairs.append((det, filt))
+
+    if len(det_filt_pairs) == 0:
+        raise ValueError('No matching filters and detectors given - all '
+                         'filters are longwave but detectors are shortwave, '
+                         'or vice versa.')
+
+    # Create the list of PSF grids to make for all segments, detectors, and
+    # filters, skipping those already made
+    tasks = []
+    filepaths = []
     for i in range(18):
-        start_time = time.time()
         i_segment = i + 1
-        segname = webbpsf.webbpsf_core.segname(i_segment)
-        print('GENERATING SEGMENT {} DATA'.format(segname))
-        print('------------------------------')
-
-        det_filt_match = False
-        for det in sorted(detectors):
-            for filt in list(filters):
-                # Make sure the detectors and filters match
-                if (det in lib.nrca_short_detectors and filt not in lib.nrca_short_filters) \
-                        or (det in lib.nrca_long_detectors and filt not in lib.nrca_long_filters):
-                    continue
-
-                det_filt_match = True
-
-                # Define the filter and detector
-                nc.filter = filt
-                nc.detector = det
-
-                # Restrict the pupil to the current segment
-                pupil = webbpsf.webbpsf_core.one_segment_pupil(i_segment)
-                ote.amplitude = pupil[0].data
-                nc.pupil = ote
-
-                # Generate the PSF grid
-                # NOTE: we are choosing a polychromatic simulation here to better represent the
-                # complexity of simulating unstacked PSFs. See the WebbPSF website for more details.
-                grid = nc.psf_grid(num_psfs=1, save=False, all_detectors=False,
-                                   use_detsampled_psf=True, fov_pixels=fov_pixels,
-                                   oversample=1, overwrite=overwrite, add_distortion=False,
-                                   nlambda=10)
-
-                # Remove and add header keywords about segment
-                del grid.meta["grid_xypos"]
-                del grid.meta["oversampling"]
-                grid.meta['SEGID'] = (i_segment, 'ID of the mirror segment')
-                grid.meta['SEGNAME'] = (segname, 'Name of the mirror segment')
-                grid.meta['XTILT'] = (round(segment_tilts[i, 0], 2), 'X tilt of the segment in microns')
-                grid.meta['YTILT'] = (round(segment_tilts[i, 1], 2), 'Y tilt of the segment in microns')
-
-                # Write out file
-                filename = 'nircam_{}_{}_fovp{}_samp1_npsf1_seg{:02d}.fits'.format(det.lower(), filt.lower(),
-                                                                                   fov_pixels, i_segment)
-                filepath = os.path.join(out_dir, filename)
-                primaryhdu = fits.PrimaryHDU(grid.data)
-                tuples = [(a, b, c) for (a, (b, c)) in sorted(grid.meta.items())]
-                primaryhdu.header.extend(tuples)
-                hdu = fits.HDUList(primaryhdu)
-                hdu.writeto(filepath, overwrite=overwrite)
+        for det, filt in det_filt_pairs:
+            filepath = os.path.join(out_dir, segment_psf_filename(det, filt, fov_pixels, i_segment))
+            filepaths.append(filepath)
+            inputs_hash = segment_psf_inputs_hash(ote, segment_tilts[i])
+            if not overwrite and _valid_segment_psf_file(filepath, i_segment, fov_pixels, inputs_hash):
+                print('Keeping existing gridded library file {}'.format(filepath))
+                continue
+            tasks.append((ote, segment_tilts[i], i_segment, det, filt, fov_pixels, filepath))
+
+    print('Generating {} of {} segment PSF library files'.format(len(tasks), len(filepaths)))
+    start_time = time.time()
+    if processes > 1 and len(tasks) > 1:
+        with Pool(processes=min(processes, len(tasks))) as pool:
+            for filepath in pool.imap_unordered(_generate_segment_psf, tasks):
                 print('Saved gridded library file to {}'.format(filepath))
+    else:
+        for task in tasks:
+            filepath = _generate_segment_psf(task)
+            print('Saved gridded library file to {}'.format(filepath))
 
-        if det_filt_match == False:
-            raise ValueError('No matching filters and detectors given - all '
-                             'filters are longwave but detectors are shortwave, '
-                             'or vice versa.')
-
-        print('\nElapsed time:', time.time() - start_time, '\n')
+    print('\nElapsed time:', time.time() - start_time, '\n')
+    return filepaths
 
 
 def get_gridded_segment_psf_library_list(instrument, detector, filtername,
-                                         library_path, pupilname="CLEAR"):
+                                         library_path, pupilname="CLEAR", lazy=True):
     """Find the filenames for the appropriate gridded segment PSF libraries and
     read them into griddedPSFModel objects
 
@@ -170,10 +225,15 @@ def get_gridded_segment_psf_library_list(instrument, detector, filtername,
     pupilname : str, optional
         Name of pupil wheel element used for PSF library creation. Default is "CLEAR".
 
+    lazy : bool, optional
+        If True (the default), each segment library is read only when it
+        is first accessed. If False, all 18 libraries are read immediately.
+
     Returns:
     --------
-    libraries : list of photutils.griddedPSFModel
-        List of object containing segment PSF libraries
+    libraries : SegmentLibraryList
+        List-like object containing segment PSF libraries as
+        photutils.griddedPSFModel objects
 
     """
     library_list = get_segment_library_list(instrument, detector, filtername, library_path, pupil=pupilname)
@@ -182,18 +242,10 @@ def get_gridded_segment_psf_library_list(instrument, detector, filtername,
     for filename in library_list:
         print(os.path.basename(filename))
 
-    libraries = []
-    for filename in library_list:
-        with fits.open(filename) as hdulist:
-        #     hdr = hdulist[0].header
-        #     d = hdulist[0].data
-        #
-        # data = d[0][0]
-        # phdu = fits.PrimaryHDU(data, header=hdr)
-        # hdulist = fits.HDUList(phdu)
-
-            lib_model = to_griddedpsfmodel(hdulist)
-            libraries.append(lib_model)
+    libraries = SegmentLibraryList(library_list)
+    if not lazy:
+        for i in range(len(libraries)):
+            libraries[i]
 
     return libraries
 
@@ -301,7 +353,7 @@ def get_segment_offset(segment_number, detector, library_list):
     y_displacement = -(tilt_onto_y * tilt_to_pixel_slope) + tilt_to_pixel_intercept  # pixels
 
     # Get the appropriate pixel scale from pysiaf
-    siaf = pysiaf.Siaf('nircam')
+    siaf = siaf_interface.get_instance('nircam', basepath=JWST_PRD_DATA_ROOT)
     aperture = siaf['NRC{}_FULL'.format(detector[-2:].upper())]
     nircam_x_pixel_scale = aperture.XSciScale  # arcsec/pixel
     nircam_y_pixel_scale = aperture.YSciScale  # arcsec/pixel
@@ -311,3 +363,148 @@ def get_segment_offset(segment_number, detector, library_list):
     y_arcsec = y_displacement * nircam_y_pixel_scale  # arcsec
 
     return x_arcsec, y_arcsec
+
+
+def segment_psf_filename(detector, filtername, fov_pixels, segment_id):
+    """Construct the name of the segment PSF library file for the given
+    detector, filter, PSF size, and segment
+
+    Parameters
+    ----------
+    detector : str
+        Name of NIRCam detector
+
+    filtername : str
+        Name of filter
+
+    fov_pixels : int
+        Size of the PSF, in pixels
+
+    segment_id : int
+        ID of the mirror segment
+
+    Returns
+    -------
+    filename : str
+        Base name of the segment PSF library file
+    """
+    return 'nircam_{}_{}_fovp{}_samp1_npsf1_seg{:02d}.fits'.format(detector.lower(), filtername.lower(),
+                                                                    fov_pixels, segment_id)
+
+
+def segment_psf_inputs_hash(ote, segment_tilt):
+    """Create a hash of the inputs that determine a segment PSF library,
+    so that libraries made from a different OTE state or segment tilt
+    can be recognized.
+
+    Parameters
+    ----------
+    ote : webbpsf.opds.OTE_Linear_Model_WSS object
+        WebbPSF OTE object describing perturbed OTE state with tip and tilt removed
+
+    segment_tilt : numpy.ndarray
+        X and Y tilt of the segment, in microradians
+
+    Returns
+    -------
+    inputs_hash : str
+        Hash of the OTE segment state and the segment tilt
+    """
+    inputs = np.concatenate([np.ravel(ote.segment_state), np.ravel(segment_tilt)]).astype(float)
+    return hashlib.sha1(inputs.tobytes()).hexdigest()[:16]
+
+
+def _generate_segment_psf(task):
+    """Generate and save the PSF library for one segment, detector, and
+    filter. This is the unit of work for ``generate_segment_psfs``, and
+    takes a single tuple so that it can be mapped over a process pool.
+
+    Parameters
+    ----------
+    task : tuple
+        (ote, segment_tilt, segment_id, detector, filter, fov_pixels, filepath)
+        where ``segment_tilt`` is the X and Y tilt of the segment, in
+        microradians, and ``filepath`` is the name of the output file
+
+    Returns
+    -------
+    filepath : str
+        Name of the saved PSF library file
+    """
+    ote, segment_tilt, i_segment, det, filt, fov_pixels, filepath = task
+    segname = webbpsf.webbpsf_core.segname(i_segment)
+
+    # Create webbpsf NIRCam instance and define the filter and detector
+    nc = webbpsf.NIRCam()
+    nc.filter = filt
+    nc.detector = det
+
+    # Restrict the pupil to the current segment
+    pupil = webbpsf.webbpsf_core.one_segment_pupil(i_segment)
+    ote.amplitude = pupil[0].data
+    nc.pupil = ote
+
+    # Generate the PSF grid
+    # NOTE: we are choosing a polychromatic simulation here to better represent the
+    # complexity of simulating unstacked PSFs. See the WebbPSF website for more details.
+    grid = nc.psf_grid(num_psfs=1, save=False, all_detectors=False,
+                       use_detsampled_psf=True, fov_pixels=fov_pixels,
+                       oversample=1, overwrite=True, add_distortion=False,
+                       nlambda=10)
+
+    # Remove and add header keywords about segment
+    del grid.meta["grid_xypos"]
+    del grid.meta["oversampling"]
+    grid.meta['SEGID'] = (i_segment, 'ID of the mirror segment')
+    grid.meta['SEGNAME'] = (segname, 'Name of the mirror segment')
+    grid.meta['XTILT'] = (round(segment_tilt[0], 2), 'X tilt of the segment in microns')
+    grid.meta['YTILT'] = (round(segment_tilt[1], 2), 'Y tilt of the segment in microns')
+    grid.meta['INHASH'] = (segment_psf_inputs_hash(ote, segment_tilt), 'Hash of OTE state and segment tilt')
+
+    # Write out file. Write to a temporary file first so that an
+    # interrupted run never leaves a partial file with the final name.
+    primaryhdu = fits.PrimaryHDU(grid.data)
+    tuples = [(a, b, c) for (a, (b, c)) in sorted(grid.meta.items())]
+    primaryhdu.header.extend(tuples)
+    hdu = fits.HDUList(primaryhdu)
+    temp_filepath = '{}.{}.tmp'.format(filepath, os.getpid())
+    hdu.writeto(temp_filepath, overwrite=True)
+    os.replace(temp_filepath, filepath)
+    return filepath
+
+
+def _valid_segment_psf_file(filepath, segment_id, fov_pixels, inputs_hash):
+    """Check whether an existing segment PSF library file is complete and
+    was made for the expected segment and inputs, so that it need not be
+    regenerated.
+
+    Parameters
+    ----------
+    filepath : str
+        Name of the segment PSF library file
+
+    segment_id : int
+        ID of the mirror segment
+
+    fov_pixels : int
+        Size of the PSF, in pixels
+
+    inputs_hash : str
+        Hash of the OTE state and segment tilt, from ``segment_psf_inputs_hash``
+
+    Returns
+    -------
+    valid : bool
+        True if the file exists and matches the expected segment, size,
+        and inputs
+    """
+    if not os.path.isfile(filepath):
+        return False
+    try:
+        with fits.open(filepath) as hdulist:
+            header = hdulist[0].header
+            shape = hdulist[0].data.shape
+        return (int(header['SEGID']) == segment_id and shape[-2:] == (fov_pixels, fov_pixels)
+                and header['INHASH'] == inputs_hash)
+    except (OSError, KeyError, AttributeError, TypeError, ValueError):
+        return False
@@ -40,6 +40,8 @@ from ..utils import siaf_interface
 from ..psf.psf_selection import get_gridded_psf_library, get_psf_wings
 from ..psf.segment_psfs import (get_gridded_segment_psf_library_list,
                                 get_segment_offset, get_segment_library_list)
+from ..catalogs.catalog_generator import read_catalog_table
+from ..catalogs.sky_index import read_catalog_near
 from ..utils.constants import grism_factor
 from mirage import version
 
@@ -60,6 +62,10 @@ ALLOWEDOUTPUTFORMATS = ['DMS']
 WFE_OPTIONS = ['predicted', 'requirements']
 WFEGROUP_OPTIONS = np.arange(5)
 
+# Sources more than this number of pixels from the detector are removed
+# from the source catalogs before their positions are converted
+FOV_DELTA_PIXELS = 4096
+
 
 class Catalog_seed():
     def __init__(self, offline=False):
@@ -170,7 +176,7 @@ class Catalog_seed():
             self.psf_library = get_gridded_segment_psf_library_list(
                 self.params['Inst']['instrument'], self.detector, self.psf_filter,
                 self.params['simSignals']['psfpath'], pupilname=self.psf_pupil)
-            self.psf_library_core_y_dim, self.psf_library_core_x_dim = self.psf_library[0].data.shape[-2:]
+            self.psf_library_core_y_dim, self.psf_library_core_x_dim = self.psf_library.data_shape(0)[-2:]
             self.psf_library_oversamp = 1
 
         # Set the psf core dimensions to actually be 2 rows and columns
@@ -805,7 +811,7 @@ class Catalog_seed():
                 are in units of pixels/hour. If false, arcsec/hour
             magsys -- magnitude system of the moving target magnitudes
         """
-        mtlist = ascii.read(filename, comment='#')
+        mtlist = read_catalog_table(filename, comment='#')
 
         # Convert all relevant columns to floats
         for col in mtlist.colnames:
@@ -872,6 +878,49 @@ class Catalog_seed():
     #    data, header = fits.getdata(filename, header=True)
     #    return data, header
 
+    def get_catalog_v2v3(self, catalog_table, pixelflag):
+        """Translate the positions of all sources in a catalog to V2, V3
+
+        Parameters
+        ----------
+        catalog_table : astropy.table.Table
+            Source catalog read in from an ascii file
+
+        pixelflag : bool
+            Flag indicating whether catalog positions are given in units of
+            pixels (True), or RA, Dec (False)
+
+        Returns
+        -------
+        v2 : numpy.ndarray
+            V2 positions of the sources, in arcseconds
+
+        v3 : numpy.ndarray
+            V3 positions of the sources, in arcseconds
+        """
+        if pixelflag:
+            # Convert X/Y (detector frame) to V2/V3 (telescope frame)
+            x = np.array(catalog_table['x_or_RA'], dtype=np.float64)
+            y = np.array(catalog_table['y_or_Dec'], dtype=np.float64)
+            return self.siaf.det_to_tel(x, y)
+
+        try:
+            ra = np.array(catalog_table['x_or_RA'], dtype=np.float64)
+            dec = np.array(catalog_table['y_or_Dec'], dtype=np.float64)
+        except ValueError:
+            # Positions given as RA/Dec strings
+            radec = [utils.parse_RA_Dec(ra_str, dec_str) for ra_str, dec_str
+                     in zip(catalog_table['x_or_RA'], catalog_table['y_or_Dec'])]
+            ra, dec = np.array(radec, dtype=np.float64).reshape(-1, 2).T
+
+        V2ref_arcsec = self.siaf.V2Ref
+        V3ref_arcsec = self.siaf.V3Ref
+        position_angle = self.params['Telescope']['rotation']
+        attitude_ref = pysiaf.utils.rotations.attitude(V2ref_arcsec, V3ref_arcsec, self.ra, self.dec, position_angle)
+
+        # Convert RA/Dec (sky frame) to V2/V3 (telescope frame)
+        return pysiaf.utils.rotations.getv2v3(attitude_ref, ra, dec)
+
     def get_index_numbers(self, catalog_table):
         """Get index numbers associated with the sources in a catalog
 
@@ -891,15 +940,26 @@ class Catalog_seed():
             indexes = catalog_table['index']
         else:
             indexes = np.arange(1, len(catalog_table['x_or_RA']) + 1)
+
+        # Catalogs read using a spatial index contain only part of the
+        # full catalog. Number the sources as if the full catalog were read.
+        if 'index_range' in catalog_table.meta:
+            min_index, max_index = catalog_table.meta['index_range']
+        else:
+            min_index, max_index = np.min(indexes), np.max(indexes)
+
         # Make sure there is no 0th object
-        if np.min(indexes) == 0:
+        if min_index == 0:
             indexes += 1
+            min_index += 1
+            max_index += 1
         # Make sure the index numbers don't overlap with any
         # sources already present. Increment the maxindex
         # value.
-        if np.min(indexes) <= self.maxindex:
+        if min_index <= self.maxindex:
             indexes += self.maxindex
-        self.maxindex = np.max(indexes)
+            max_index += self.maxindex
+        self.maxindex = max_index
         return indexes
 
     def movingTargetInputs(self, filename, input_type, MT_tracking=False,
@@ -1012,7 +1072,7 @@ class Catalog_seed():
         # Check the source list and remove any sources that are well outside the
         # field of view of the detector. These sources cause the coordinate
         # conversion to hang.
-        indexes, mtlist = self.remove_outside_fov_sources(indexes, mtlist, pixelFlag, 4096)
+        indexes, mtlist = self.remove_outside_fov_sources(indexes, mtlist, pixelFlag, FOV_DELTA_PIXELS)
 
         # Determine the name of the column to use for source magnitudes
         mag_column = self.select_magnitude_column(mtlist, filename)
@@ -1024,7 +1084,7 @@ class Catalog_seed():
             start_time = time.time()
             # For each object, calculate x,y or RA,Dec of initial position
             pixelx, pixely, ra, dec, ra_str, dec_str = self.get_positions(
-                entry['x_or_RA'], entry['y_or_Dec'], pixelFlag, 4096)
+                entry['x_or_RA'], entry['y_or_Dec'], pixelFlag, FOV_DELTA_PIXELS)
 
             # Now generate a list of x,y position in each frame
             if pixvelflag is False:
@@ -1112,7 +1172,7 @@ class Catalog_seed():
             elif input_type == 'galaxies':
                 pixelx, pixely, ra, dec, ra_str, dec_str = self.get_positions(entry['x_or_RA'],
                                                                               entry['y_or_Dec'],
-                                                                              pixelFlag, 4096)
+                                                                              pixelFlag, FOV_DELTA_PIXELS)
 
                 pixelv2, pixelv3 = pysiaf.utils.rotations.getv2v3(self.attitude_matrix, ra, dec)
 
@@ -1504,14 +1564,30 @@ class Catalog_seed():
                     self.params['Inst']['instrument'].lower(), self.detector, self.psf_filter,
                     self.params['simSignals']['psfpath'], pupil=self.psf_pupil
                 )
+
+                # Read the catalog and translate the source positions to
+                # V2, V3 only once. Each segment's offset is then applied
+                # as a shift of these arrays.
+                # Sources are shifted by each segment's offset before the
+                # field of view cut, so read the full catalog.
+                catalog = self.read_point_source_file(self.params['simSignals']['pointsource'],
+                                                      prefilter=False)
+                catalog_v2v3 = self.get_catalog_v2v3(catalog[0], catalog[1])
+
                 for i_segment in np.arange(1, 19):
                     print('\nCalculating point source lists for segment {}'.format(i_segment))
                     # Get the RA/Dec offset that matches the given segment
                     offset_vector = get_segment_offset(i_segment, self.detector, library_list)
 
-                    # need to add a new offset option to get_point_source_list:
                     pslist = self.get_point_source_list(self.params['simSignals']['pointsource'],
-                                                        segment_offset=offset_vector)
+                                                        segment_offset=offset_vector, catalog=catalog,
+                                                        catalog_v2v3=catalog_v2v3)
+
+                    # Segments with no sources in the (padded) field of view
+                    # contribute nothing, so their library need not be read
+                    if len(pslist) == 0:
+                        print('    No sources for segment {}. Skipping.'.format(i_segment))
+                        continue
 
                     # Create a point source image, using the specific point
                     # source list and PSF for the given segment
@@ -1670,10 +1746,33 @@ class Catalog_seed():
 
     #    return x_coeffs, y_coeffs, v2ref, v3ref, parity, yang, xsciscale, ysciscale, v3scixang
 
-    def get_point_source_list(self, filename, segment_offset=None):
-        # read in the list of point sources to add, and adjust the
-        # provided positions for astrometric distortion
+    def get_point_source_list(self, filename, segment_offset=None, catalog=None, catalog_v2v3=None):
+        """Read in the list of point sources to add, and adjust the
+        provided positions for astrometric distortion
+
+        Parameters
+        ----------
+        filename : str
+            Name of the point source catalog file
+
+        segment_offset : tup, optional
+            (x, y) offset, in arcseconds, by which to shift all sources
+            for a segment-wise simulation
+
+        catalog : tup, optional
+            Output of ``read_point_source_file`` for ``filename``. If
+            given, the catalog is not read in again.
+
+        catalog_v2v3 : tup, optional
+            Output of ``get_catalog_v2v3`` for the catalog. If given, along
+            with ``segment_offset``, the source positions are not
+            translated to V2, V3 again.
 
+        Returns
+        -------
+        pointSourceList : astropy.table.Table
+            Table of point sources on the detector
+        """
 
         # Make sure that a valid PSF path has been provided
         if not os.path.isdir(self.params['simSignals']['psfpath']):
@@ -1686,7 +1785,9 @@ class Catalog_seed():
                                 dtype=('i', 'f', 'f', 'S14', 'S14', 'f', 'f', 'f', 'f', 'f'))
 
         try:
-            lines, pixelflag, magsys = self.read_point_source_file(filename)
+            if catalog is None:
+                catalog = self.read_point_source_file(filename)
+            lines, pixelflag, magsys = catalog
             if pixelflag:
                 print("Point source list input positions assumed to be in units of pixels.")
             else:
@@ -1744,12 +1845,15 @@ class Catalog_seed():
         # If creating a segment-wise simulation, shift all of the RAs/Decs in
         # the list by the given offset
         if segment_offset is not None:
-            lines = self.shift_sources_by_offset(lines, segment_offset, pixelflag)
+            lines = self.shift_sources_by_offset(lines, segment_offset, pixelflag, v2v3=catalog_v2v3)
+
+            # Shifted source positions are always RA, Dec
+            pixelflag = False
 
         # Check the source list and remove any sources that are well outside the
         # field of view of the detector. These sources cause the coordinate
         # conversion to hang.
-        indexes, lines = self.remove_outside_fov_sources(indexes, lines, pixelflag, 4096)
+        indexes, lines = self.remove_outside_fov_sources(indexes, lines, pixelflag, FOV_DELTA_PIXELS)
 
         # Determine the name of the column to use for source magnitudes
         mag_column = self.select_magnitude_column(lines, filename)
@@ -1774,7 +1878,7 @@ class Catalog_seed():
 
             pixelx, pixely, ra, dec, ra_str, dec_str = self.get_positions(values['x_or_RA'],
                                                                           values['y_or_Dec'],
-                                                                          pixelflag, 4096)
+                                                                          pixelflag, FOV_DELTA_PIXELS)
 
             # Get the input magnitude and countrate of the point source
             mag = float(values[mag_column])
@@ -1874,11 +1978,37 @@ class Catalog_seed():
             dimension = self.psf_wing_sizes['number_of_pixels'][brighter[0]]
         return dimension
 
-    def shift_sources_by_offset(self, lines, segment_offset, pixelflag):
+    def shift_sources_by_offset(self, lines, segment_offset, pixelflag, v2v3=None):
+        """Shift all sources in a catalog by the given offset in the
+        V2, V3 frame.
+
+        Parameters
+        ----------
+        lines : astropy.table.Table
+            Source catalog
+
+        segment_offset : tup
+            (x, y) offset, in arcseconds, to apply to the sources
+
+        pixelflag : bool
+            Flag indicating whether catalog positions are given in units of
+            pixels (True), or RA, Dec (False)
+
+        v2v3 : tup, optional
+            V2 and V3 arrays (in arcseconds) of the sources in ``lines``,
+            as returned by ``get_catalog_v2v3``. If None, they are calculated.
+
+        Returns
+        -------
+        shifted_lines : astropy.table.Table
+            Copy of ``lines`` with the shifted source positions given as RA
+            and Dec, in decimal degrees
+        """
         print('    Shifting point source locations by arcsecond offset {}'.format(segment_offset))
 
-        shifted_lines = lines.copy()
-        shifted_lines.remove_rows(np.arange(0, len(shifted_lines)))
+        if v2v3 is None:
+            v2v3 = self.get_catalog_v2v3(lines, pixelflag)
+        v2, v3 = v2v3
 
         V2ref_arcsec = self.siaf.V2Ref
         V3ref_arcsec = self.siaf.V3Ref
@@ -1886,28 +2016,37 @@ class Catalog_seed():
         print('    Position angle = ', position_angle)
         attitude_ref = pysiaf.utils.rotations.attitude(V2ref_arcsec, V3ref_arcsec, self.ra, self.dec, position_angle)
 
-        # Shift every source by the appropriate offset
+        # Add the arcsecond displacement to each V2/V3 source position
+        # and translate back to RA/Dec
         x_displacement_arcsec, y_displacement_arcsec = segment_offset
-        for line in lines:
-            x_or_RA, y_or_Dec = line['x_or_RA', 'y_or_Dec']
-            # Convert the input source locations to V2/V3
-            if not pixelflag:
-                # Convert RA/Dec (sky frame) to V2/V3 (telescope frame)
-                v2, v3 = pysiaf.utils.rotations.getv2v3(attitude_ref, x_or_RA, y_or_Dec)
-            else:
-                # Convert X/Y (detector frame) to V2/V3 (telescope frame)
-                v2, v3 = self.siaf.det_to_tel(x_or_RA, y_or_Dec)
+        ra, dec = pysiaf.utils.rotations.pointing(attitude_ref, v2 - x_displacement_arcsec,
+                                                  v3 + y_displacement_arcsec)
 
-            # Add the arcsecond displacement to each V2/V3 source position
-            v2 -= x_displacement_arcsec
-            v3 += y_displacement_arcsec
+        shifted_lines = lines.copy()
+        shifted_lines['x_or_RA'] = Column(np.atleast_1d(ra), name='x_or_RA')
+        shifted_lines['y_or_Dec'] = Column(np.atleast_1d(dec), name='y_or_Dec')
+        return shifted_lines
 
-            # Translate back to RA/Dec and save
-            ra, dec = pysiaf.utils.rotations.pointing(attitude_ref, v2, v3)
-            # TODO: need to be smarter about which magnitude to use here
-            shifted_lines.add_row([ra, dec, line['magnitude']])
+    def read_catalog_near_fov(self, filename):
+        """Read in a source catalog. For large catalogs with RA, Dec
+        source positions, only the sources within the radius used by
+        ``remove_outside_fov_sources`` are read, using a spatial index saved
+        next to the catalog.
 
-        return shifted_lines
+        Parameters
+        ----------
+        filename : str
+            Name of the catalog file
+
+        Returns
+        -------
+        catalog : astropy.table.Table
+            Catalog contents
+        """
+        # Add a small margin so that rounding can not exclude any source
+        # kept by remove_outside_fov_sources
+        radius = FOV_DELTA_PIXELS * self.siaf.XSciScale + 1.
+        return read_catalog_near(filename, self.ra, self.dec, radius)
 
     def remove_outside_fov_sources(self, index, source, pixflag, delta_pixels):
         """Filter out entries in the source catalog that are located well outside the field of
@@ -1942,6 +2081,9 @@ class Catalog_seed():
         source : Table
             astropy Table containing filtered list of sources
         """
+        if len(source) == 0:
+            return index, source
+
         catalog_x = source['x_or_RA']
         catalog_y = source['y_or_Dec']
 
@@ -2187,14 +2329,6 @@ class Catalog_seed():
             # the offset between the full wing array and the user-specified
             # wing array size
 
-            # Get the psf wings array - first the nominal size
-            # Later we may crop if the source is only partially on the detector
-            full_wing_y_dim, full_wing_x_dim = self.psf_wings.shape
-            offset_x = np.int((full_wing_x_dim - psf_dim_x) / 2)
-            offset_y = np.int((full_wing_y_dim - psf_dim_y) / 2)
-
-            full_psf = copy.deepcopy(self.psf_wings[offset_y:offset_y+psf_dim_y, offset_x:offset_x+psf_dim_x])
-
             # Get coordinates describing overlap between PSF image and the
             # full frame of the detector
             # Step 1
@@ -2203,6 +2337,14 @@ class Catalog_seed():
                                                         (psf_dim_y, psf_dim_x), psf_x_loc, psf_y_loc,
                                                         coord_sys='full_frame', ignore_detector=ignore_detector)
 
+            # Get the psf wings array, cropped to the portion that is on
+            # the detector. The wings array is shared by all sources and is
+            # read-only, so copy only the cropped stamp.
+            full_wing_y_dim, full_wing_x_dim = self.psf_wings.shape
+            offset_x = np.int((full_wing_x_dim - psf_dim_x) / 2)
+            offset_y = np.int((full_wing_y_dim - psf_dim_y) / 2)
+            full_psf = np.array(self.psf_wings[offset_y+l1:offset_y+l2, offset_x+k1:offset_x+k2])
+
             # Step 2
             # If the core of the psf lands at least partially on the detector
             # then we need to evaluate the psf library
@@ -2234,16 +2376,20 @@ class Catalog_seed():
                                                 x_0=xc_core, y_0=yc_core)
 
                 # Step 5
+                # Insert the part of the core that overlaps the cropped
+                # wing stamp
                 wing_start_x = k1c + delta_core_to_wing_x
                 wing_end_x = k2c + delta_core_to_wing_x
                 wing_start_y = l1c + delta_core_to_wing_y
                 wing_end_y = l2c + delta_core_to_wing_y
 
-                full_psf[wing_start_y:wing_end_y, wing_start_x:wing_end_x] = psf
-
-            # Whether or not the core is on the detector, crop the PSF
-            # to the proper shape based on how much is on the detector
-            full_psf = full_psf[l1:l2, k1:k2]
+                x_start = max(wing_start_x, k1)
+                x_end = min(wing_end_x, k2)
+                y_start = max(wing_start_y, l1)
+                y_end = min(wing_end_y, l2)
+                if x_start < x_end and y_start < y_end:
+                    full_psf[y_start-l1:y_end-l1, x_start-k1:x_end-k1] = \
+                        psf[y_start-wing_start_y:y_end-wing_start_y, x_start-wing_start_x:x_end-wing_start_x]
 
         return full_psf, k1, l1, add_wings
 
@@ -2537,7 +2683,7 @@ class Catalog_seed():
 
         return psf[nyshift - ydist:nyshift + ydist + 1, nxshift - xdist:nxshift + xdist + 1]
 
-    def read_point_source_file(self, filename):
+    def read_point_source_file(self, filename, prefilter=True):
         """Read in the point source catalog file
 
          Parameters:
@@ -2545,6 +2691,10 @@ class Catalog_seed():
         filename : str
             Filename of catalog file to be read in
 
+        prefilter : bool
+            If True, large catalogs are read using a spatial index, keeping
+            only the sources that ``remove_outside_fov_sources`` could keep
+
          Returns:
         --------
         gtab : Table
@@ -2558,7 +2708,10 @@ class Catalog_seed():
             Magnitude system of the source brightnesses (e.g. 'abmag')
         """
         try:
-            gtab = ascii.read(filename)
+            if prefilter:
+                gtab = self.read_catalog_near_fov(filename)
+            else:
+                gtab = read_catalog_table(filename)
             # Look at the header lines to see if inputs
             # are in units of pixels or RA, Dec
             pflag = False
@@ -2769,7 +2922,7 @@ class Catalog_seed():
         # Read in the galaxy source list
         try:
             # read table
-            gtab = ascii.read(filename)
+            gtab = self.read_catalog_near_fov(filename)
 
             # Look at the header lines to see if inputs
             # are in units of pixels or RA, Dec
@@ -2844,7 +2997,7 @@ class Catalog_seed():
         # Check the source list and remove any sources that are well outside the
         # field of view of the detector. These sources cause the coordinate
         # conversion to hang.
-        indexes, galaxylist = self.remove_outside_fov_sources(indexes, galaxylist, pixelflag, 4096)
+        indexes, galaxylist = self.remove_outside_fov_sources(indexes, galaxylist, pixelflag, FOV_DELTA_PIXELS)
 
         # Determine the name of the column to use for source magnitudes
         mag_column = self.select_magnitude_column(galaxylist, catfile)
@@ -2870,7 +3023,7 @@ class Catalog_seed():
 
             pixelx, pixely, ra, dec, ra_str, dec_str = self.get_positions(source['x_or_RA'],
                                                                           source['y_or_Dec'],
-                                                                          pixelflag, 4096)
+                                                                          pixelflag, FOV_DELTA_PIXELS)
 
             # only keep the source if the peak will fall within the subarray
             if pixely > outminy and pixely < outmaxy and pixelx > outminx and pixelx < outmaxx:
@@ -3168,9 +3321,27 @@ class Catalog_seed():
                          + 90. + self.params['Telescope']['rotation'])
         return x_posang
 
-    def getExtendedSourceList(self, filename):
-        # read in the list of point sources to add, and adjust the
-        # provided positions for astrometric distortion
+    def getExtendedSourceList(self, filename, catalog=None):
+        """Read in the list of extended sources to add, and adjust the
+        provided positions for astrometric distortion
+
+        Parameters
+        ----------
+        filename : str
+            Name of the extended source catalog file
+
+        catalog : tup, optional
+            Output of ``read_point_source_file`` for ``filename``. If
+            given, the catalog is not read in again.
+
+        Returns
+        -------
+        extSourceList : astropy.table.Table
+            Table of extended sources on the detector
+
+        all_stamps : list
+            Normalized stamp image of each source in ``extSourceList``
+        """
 
         extSourceList = Table(names=('index', 'pixelx', 'pixely', 'RA', 'Dec',
                                      'RA_degrees', 'Dec_degrees', 'magnitude',
@@ -3178,7 +3349,9 @@ class Catalog_seed():
                               dtype=('i', 'f', 'f', 'S14', 'S14', 'f', 'f', 'f', 'f', 'f'))
 
         try:
-            lines, pixelflag, magsys = self.read_point_source_file(filename)
+            if catalog is None:
+                catalog = self.read_point_source_file(filename)
+            lines, pixelflag, magsys = catalog
             if pixelflag:
                 print("Extended source list input positions assumed to be in units of pixels.")
             else:
@@ -3211,7 +3384,7 @@ class Catalog_seed():
         # Check the source list and remove any sources that are well outside the
         # field of view of the detector. These sources cause the coordinate
         # conversion to hang.
-        indexes, lines = self.remove_outside_fov_sources(indexes, lines, pixelflag, 4096)
+        indexes, lines = self.remove_outside_fov_sources(indexes, lines, pixelflag, FOV_DELTA_PIXELS)
 
         print("After extended sources, max index is {}".format(self.maxindex))
 
@@ -3226,7 +3399,7 @@ class Catalog_seed():
             try:
                 pixelx, pixely, ra, dec, ra_str, dec_str = self.get_positions(values['x_or_RA'],
                                                                               values['y_or_Dec'],
-                                                                              pixelflag, 4096)
+                                                                              pixelflag, FOV_DELTA_PIXELS)
                 # Get the input magnitude
                 try:
                     mag = float(values[mag_column])
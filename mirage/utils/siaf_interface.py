@@ -17,39 +17,133 @@ Use
 
         from mirage.utils import siaf_interface
 
+    Siaf objects are cached, so repeated calls for the same instrument
+    do not re-read the SIAF:
+
+    ::
+
+        siaf = siaf_interface.get_instance('NIRISS')
+
+    Apertures can be sent to worker processes as ``ApertureReference``
+    objects, which pickle to a few hundred bytes:
+
+    ::
+
+        aperture = siaf_interface.ApertureReference('NIRISS', 'NIS_CEN')
+        pixel_scale = aperture.XSciScale
 """
 import os
 import numpy as np
 
 import pysiaf
 from pysiaf import iando
-from pysiaf.constants import JWST_DELIVERY_DATA_ROOT
+from pysiaf.constants import JWST_DELIVERY_DATA_ROOT, JWST_PRD_DATA_ROOT
 from ..utils import rotations
 from ..utils import set_telescope_pointing_separated as set_telescope_pointing
 
 
-def get_instance(instrument):
-    """Return an instance of a pysiaf.Siaf object for the given instrument
+# pysiaf.Siaf instances created in this process, keyed by instrument and
+# SIAF file location
+_SIAF_INSTANCES = {}
+
+
+class ApertureReference():
+    def __init__(self, instrument, aperture_name, filename=None, basepath=None):
+        """Lightweight, picklable reference to a SIAF aperture, for passing
+        to worker processes. Only the instrument, aperture name and SIAF
+        file location are pickled. The aperture is looked up using
+        ``get_instance`` on first use, so the SIAF is read at most once per
+        process. Attributes and methods of the pysiaf aperture (e.g.
+        ``XSciScale``, ``sci_to_idl``) can be used directly on this object.
+
+        Parameters
+        ----------
+        instrument : str
+            Name of instrument
+
+        aperture_name : str
+            Aperture name (e.g. "NRCA1_FULL")
+
+        filename : str
+            SIAF xml file to read. Passed to ``get_instance``.
+
+        basepath : str
+            Directory containing the SIAF xml file. Passed to ``get_instance``.
+        """
+        self.instrument = instrument
+        self.aperture_name = aperture_name
+        self.filename = filename
+        self.basepath = basepath
+        self._aperture = None
+
+    def __getattr__(self, name):
+        # Called only for attributes not defined on this object
+        if name.startswith('__') or name == '_aperture':
+            raise AttributeError(name)
+        return getattr(self.aperture, name)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_aperture'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    @property
+    def aperture(self):
+        """Return the pysiaf aperture object"""
+        if self._aperture is None:
+            siaf = get_instance(self.instrument, filename=self.filename, basepath=self.basepath)
+            self._aperture = siaf[self.aperture_name]
+        return self._aperture
+
+
+def clear_siaf_cache():
+    """Remove all Siaf objects from the cache used by ``get_instance``"""
+    _SIAF_INSTANCES.clear()
+
+
+def get_instance(instrument, filename=None, basepath=None):
+    """Return an instance of a pysiaf.Siaf object for the given instrument.
+    Each SIAF is read once per process, and the same Siaf object is returned
+    by later calls with the same arguments. The returned object is shared,
+    and should not be modified.
 
     Parameters
     ----------
     instrument : str
         Name of instrument
 
+    filename : str
+        SIAF xml file to read. If None, the file for the instrument in
+        ``basepath`` is used.
+
+    basepath : str
+        Directory containing the SIAF xml file. If None along with
+        ``filename``, the pre-delivery SIAF data are used for NIRCam, and
+        the pysiaf default (PRD) data for other instruments.
+
     Returns
     -------
     siaf : pysiaf.Siaf
         Siaf object for the requested instrument
     """
     if instrument.lower() == 'nircam':
-        print("NOTE: Using pre-delivery SIAF data for {}".format(instrument))
         siaf_instrument = 'NIRCam'
-        pre_delivery_dir = os.path.join(JWST_DELIVERY_DATA_ROOT, 'NIRCam')
-        siaf = pysiaf.Siaf(siaf_instrument, basepath=pre_delivery_dir)
+        pre_delivery = filename is None and basepath is None
+        if pre_delivery:
+            basepath = os.path.join(JWST_DELIVERY_DATA_ROOT, 'NIRCam')
     else:
         siaf_instrument = instrument
-        siaf = pysiaf.Siaf(siaf_instrument)
-    return siaf
+        pre_delivery = False
+
+    key = (siaf_instrument.lower(), filename, basepath)
+    if key not in _SIAF_INSTANCES:
+        if pre_delivery:
+            print("NOTE: Using pre-delivery SIAF data for {}".format(instrument))
+        _SIAF_INSTANCES[key] = pysiaf.Siaf(siaf_instrument, filename=filename, basepath=basepath)
+    return _SIAF_INSTANCES[key]
 
 
 def get_siaf_information(siaf_instance, aperture_name, ra, dec, telescope_roll, v2_arcsec=None,
@@ -152,7 +246,7 @@ def sci_subarray_corners(instrument, aperture_name, siaf=None, verbose=False):
     """
     # get SIAF
     if siaf is None:
-        siaf = pysiaf.Siaf(instrument)
+        siaf = get_instance(instrument, basepath=JWST_PRD_DATA_ROOT)
 
     # get master aperture names
     siaf_detector_layout = iando.read.read_siaf_detector_layout()
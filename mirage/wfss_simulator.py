@@ -36,10 +36,14 @@ HISTORY:
 13 July 2018 - updated for name change to Mirage, Bryan Hilbert
 '''
 
+from concurrent.futures import ProcessPoolExecutor
 import copy
+import hashlib
+from multiprocessing import Pool
 import os
 import sys
 import argparse
+from types import SimpleNamespace
 import yaml
 
 import numpy as np
@@ -65,7 +69,7 @@ class WFSSSim():
     def __init__(self, paramfiles, SED_file=None, SED_normalizing_catalog_column=None,
                  final_SED_file=None, SED_dict=None, save_dispersed_seed=True, source_stamps_file=None,
                  extrapolate_SED=True, override_dark=None, disp_seed_filename=None, offline=False,
-                 create_continuum_seds=True):
+                 create_continuum_seds=True, processes=1, dispersed_seed_cache_dir=None):
 
         # Set the MIRAGE_DATA environment variable if it is not
         # set already. This is for users at STScI.
@@ -97,6 +101,8 @@ class WFSSSim():
         self.extrapolate_SED = extrapolate_SED
         self.fullframe_apertures = ["NRCA5_FULL", "NRCB5_FULL", "NIS_CEN"]
         self.offline = offline
+        self.processes = processes
+        self.dispersed_seed_cache_dir = dispersed_seed_cache_dir
 
         # Make sure the right combination of parameter files and SED file
         # are given
@@ -129,19 +135,15 @@ class WFSSSim():
     def create(self):
         """MAIN FUNCTION"""
 
-        # Loop over the yaml files and create
-        # a direct seed image for each
-        imseeds = []
-        for pfile in self.paramfiles:
-            print('Running catalog_seed_image for {}'.format(pfile))
-            cat = catalog_seed_image.Catalog_seed(offline=self.offline)
-            cat.paramfile = pfile
-            cat.make_seed()
-            imseeds.append(cat.seed_file)
-            # If Mirage is going to produce an hdf5 file of spectra,
-            # then we only need a single direct seed image.
-            if self.create_continuum_seds:
-                break
+        # Create a direct seed image for each yaml file. If Mirage is
+        # going to produce an hdf5 file of spectra, then we only need a
+        # single direct seed image.
+        seed_paramfiles = self.paramfiles
+        if self.create_continuum_seds:
+            seed_paramfiles = self.paramfiles[0:1]
+        seeds = self.create_seed_images(seed_paramfiles)
+        imseeds = [seed.seed_file for seed in seeds]
+        cat = seeds[-1]
 
         # Create hdf5 file with spectra of all sources if requested.
         if self.create_continuum_seds:
@@ -170,13 +172,7 @@ class WFSSSim():
         orders = None
 
         # Create dispersed seed image from the direct images
-        disp_seed = Grism_seed(imseeds, self.crossing_filter,
-                               dmode, config_path=loc, instrument=self.instrument.upper(),
-                               extrapolate_SED=self.extrapolate_SED, SED_file=self.SED_file,
-                               SBE_save=self.source_stamps_file)
-        disp_seed.observation(orders=orders)
-        disp_seed.disperse(orders=orders)
-        disp_seed.finalize(Back=background_file)
+        dispersed_seed = self.disperse(imseeds, dmode, loc, background_file, orders)
 
         # Get gain map
         gainfile = cat.params['Reffiles']['gain']
@@ -186,8 +182,8 @@ class WFSSSim():
         # requested subarray if necessary
         if cat.params['Readout']['array_name'] not in self.fullframe_apertures:
             print("Subarray bounds: {}".format(cat.subarray_bounds))
-            print("Dispersed seed image size: {}".format(disp_seed.final.shape))
-            disp_seed.final = self.crop_to_subarray(disp_seed.final, cat.subarray_bounds)
+            print("Dispersed seed image size: {}".format(dispersed_seed.shape))
+            dispersed_seed = self.crop_to_subarray(dispersed_seed, cat.subarray_bounds)
             gain = self.crop_to_subarray(gain, cat.subarray_bounds)
 
             # Segmentation map will be centered in a frame that is larger
@@ -206,11 +202,11 @@ class WFSSSim():
         # "perfect" noiseless view of the scene that does not depend on
         # detector effects, such as gain.
         if self.save_dispersed_seed:
-            self.save_dispersed_seed_image(disp_seed.final)
+            self.save_dispersed_seed_image(dispersed_seed)
 
         # Convert seed image to ADU/sec to be consistent
         # with other simulator outputs
-        disp_seed.final /= gain
+        dispersed_seed /= gain
 
         # Update seed image header to reflect the
         # division by the gain
@@ -249,7 +245,7 @@ class WFSSSim():
         # Combine into final observation
         obs = obs_generator.Observation(offline=self.offline)
         obs.linDark = obslindark
-        obs.seed = disp_seed.final
+        obs.seed = dispersed_seed
         obs.segmap = cat.seed_segmap
         obs.seedheader = cat.seedinfo
         #obs.paramfile = y.outname
@@ -305,6 +301,103 @@ class WFSSSim():
                 raise FileNotFoundError(("WARNING: {} does not exist."
                                          .format(self.override_dark)))
 
+    def disperse(self, seed_files, dmode, config_path, background_file, orders=None):
+        """Disperse the sources in the direct seed images. If
+        ``self.dispersed_seed_cache_dir`` is set, the dispersed image is
+        stored there under a fingerprint of the dispersion inputs, and is
+        reused by later runs with identical inputs (e.g. runs differing
+        only in dark current or noise realization). The fingerprint is
+        computed from the direct seed images, so these are still created
+        on every run; only the dispersion itself is skipped. If
+        ``self.processes`` is greater than 1, the sources are partitioned
+        across worker processes, each of which disperses its sources into
+        a private image. The partial images are then summed in partition
+        order, so the result does not depend on worker scheduling.
+
+        Parameters
+        ----------
+        seed_files : list
+            Direct seed image files
+
+        dmode : str
+            Dispersion mode (e.g. 'modA_R', 'GR150C')
+
+        config_path : str
+            Directory containing the grism configuration files
+
+        background_file : str
+            Name of the background file added to the dispersed image
+
+        orders : list
+            Orders to disperse. If None, all orders are dispersed.
+
+        Returns
+        -------
+        dispersed_seed : numpy.ndarray
+            Full frame dispersed seed image, in e/sec
+        """
+        # Reuse a previously dispersed seed image if all of the dispersion
+        # inputs are unchanged
+        if self.dispersed_seed_cache_dir is not None and self.source_stamps_file is None:
+            fingerprint = dispersion_fingerprint(seed_files, self.SED_file, config_path,
+                                                 self.crossing_filter, dmode, self.instrument,
+                                                 self.extrapolate_SED, background_file, orders)
+            cache_file = os.path.join(self.dispersed_seed_cache_dir,
+                                      'dispersed_seed_{}.fits'.format(fingerprint))
+            if os.path.isfile(cache_file):
+                print('Using cached dispersed seed image {}'.format(cache_file))
+                return fits.getdata(cache_file, 'DATA')
+
+            dispersed_seed = self.disperse_sources(seed_files, dmode, config_path, background_file, orders)
+            os.makedirs(self.dispersed_seed_cache_dir, exist_ok=True)
+            temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(dispersed_seed, name='DATA')]).writeto(temp_file,
+                                                                                                   overwrite=True)
+            os.replace(temp_file, cache_file)
+            print('Dispersed seed image cached as {}'.format(cache_file))
+            return dispersed_seed
+
+        return self.disperse_sources(seed_files, dmode, config_path, background_file, orders)
+
+    def disperse_sources(self, seed_files, dmode, config_path, background_file, orders=None):
+        """Run the disperser on the direct seed images, partitioning the
+        sources across ``self.processes`` worker processes. See ``disperse``
+        for a description of the parameters and return value.
+        """
+        disperse_args = (self.crossing_filter, dmode, config_path, self.instrument.upper(),
+                         self.extrapolate_SED, self.SED_file, orders)
+
+        if self.processes > 1 and self.source_stamps_file is not None:
+            print(("Source stamps are saved to a single file, so sources will be dispersed "
+                   "in a single process."))
+        if self.processes <= 1 or self.source_stamps_file is not None:
+            return _disperse_sources((seed_files, background_file, self.source_stamps_file) + disperse_args)
+
+        partition_files = partition_seed_files(seed_files, self.processes)
+        if len(partition_files) <= 1:
+            return _disperse_sources((seed_files, background_file, None) + disperse_args)
+
+        # The background is added only once, by the first partition
+        tasks = []
+        for i, files in enumerate(partition_files):
+            background = background_file if i == 0 else False
+            tasks.append((files, background, None) + disperse_args)
+
+        # The disperser may start its own process pool, which is not allowed
+        # from within (daemonic) multiprocessing.Pool workers
+        try:
+            with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+                partials = list(executor.map(_disperse_sources, tasks))
+        finally:
+            for files in partition_files:
+                for filename in files:
+                    os.remove(filename)
+
+        dispersed_seed = partials[0]
+        for partial in partials[1:]:
+            dispersed_seed += partial
+        return dispersed_seed
+
     def find_param_info(self):
         """Extract dispersion direction and crossing filter from the input
         param files"""
@@ -415,6 +508,33 @@ class WFSSSim():
         image[~np.isfinite(image)] = mngain
         return image, header
 
+    def create_seed_images(self, paramfiles):
+        """Create a direct seed image for each of the given yaml files.
+        The seed images are independent of one another, so if
+        ``self.processes`` is greater than 1, they are created in a pool
+        of worker processes.
+
+        Parameters
+        ----------
+        paramfiles : list
+            Yaml files to create seed images from
+
+        Returns
+        -------
+        seeds : list
+            One SimpleNamespace per yaml file, in the same order as
+            ``paramfiles``, containing the Catalog_seed attributes needed
+            for dispersion (seed_file, params, subarray_bounds,
+            seed_segmap, seedinfo)
+        """
+        tasks = [(pfile, self.offline) for pfile in paramfiles]
+        if self.processes > 1 and len(tasks) > 1:
+            with Pool(processes=min(self.processes, len(tasks))) as pool:
+                seeds = pool.map(_create_catalog_seed, tasks)
+        else:
+            seeds = [_create_catalog_seed(task) for task in tasks]
+        return seeds
+
     def crop_to_subarray(self, data, bounds):
         """
         Crop the given full frame array down to the appropriate
@@ -500,6 +620,167 @@ class WFSSSim():
         return parser
 
 
+def dispersion_fingerprint(seed_files, SED_file, config_path, crossing_filter, dmode, instrument,
+                           extrapolate_SED, background_file, orders):
+    """Create a hash identifying all of the inputs to the disperser. The
+    seed image and segmentation map data are hashed directly, so that
+    headers that change between runs do not affect the fingerprint. The
+    SED file is hashed by content, and the grism configuration files by
+    name, size and modification time.
+
+    Parameters
+    ----------
+    seed_files : list
+        Direct seed image files
+
+    SED_file : str
+        hdf5 file of source spectra, or None
+
+    config_path : str
+        Directory containing the grism configuration files
+
+    crossing_filter : str
+        Name of the crossing filter
+
+    dmode : str
+        Dispersion mode
+
+    instrument : str
+        Instrument name
+
+    extrapolate_SED : bool
+        Whether SEDs are extrapolated to cover the grism wavelength range
+
+    background_file : str
+        Name of the background file
+
+    orders : list
+        Orders dispersed, or None for all orders
+
+    Returns
+    -------
+    fingerprint : str
+        Hash of the dispersion inputs
+    """
+    digest = hashlib.sha1()
+    for value in [crossing_filter, dmode, instrument, extrapolate_SED, background_file, orders]:
+        digest.update(repr(value).encode())
+
+    for seed_file in seed_files:
+        with fits.open(seed_file) as hdulist:
+            for extname in ['DATA', 'SEGMAP']:
+                data = np.ascontiguousarray(hdulist[extname].data)
+                digest.update(repr((extname, data.shape, data.dtype.str)).encode())
+                digest.update(data.tobytes())
+
+    if SED_file is not None:
+        with open(SED_file, 'rb') as sed_obj:
+            for block in iter(lambda: sed_obj.read(1024 * 1024), b''):
+                digest.update(block)
+
+    if os.path.isdir(config_path):
+        for filename in sorted(os.listdir(config_path)):
+            stat = os.stat(os.path.join(config_path, filename))
+            digest.update(repr((filename, stat.st_size, stat.st_mtime)).encode())
+    return digest.hexdigest()[:16]
+
+
+def partition_seed_files(seed_files, partitions):
+    """Split the sources in a set of direct seed images into groups, and
+    create a copy of the seed images for each group in which all pixels
+    belonging to other sources are set to zero in both the seed image
+    and the segmentation map. Sources are assigned to groups in order of
+    decreasing size, in turn, so that the groups contain similar numbers
+    of source pixels.
+
+    Parameters
+    ----------
+    seed_files : list
+        Direct seed image files, containing 'DATA' and 'SEGMAP' extensions.
+        All files must share the same segmentation map.
+
+    partitions : int
+        Maximum number of groups to create
+
+    Returns
+    -------
+    partition_files : list
+        One list of seed image files for each group. The files are
+        created alongside the input files, and should be removed by the
+        caller when no longer needed.
+    """
+    segmap = fits.getdata(seed_files[0], 'SEGMAP')
+    source_ids, pixel_counts = np.unique(segmap[segmap > 0], return_counts=True)
+    source_ids = source_ids[np.argsort(-pixel_counts, kind='stable')]
+    groups = [source_ids[i::partitions] for i in range(min(partitions, len(source_ids)))]
+
+    partition_files = []
+    for i, group in enumerate(groups):
+        files = []
+        for seed_file in seed_files:
+            with fits.open(seed_file) as hdulist:
+                outside = ~np.isin(hdulist['SEGMAP'].data, group)
+                hdulist['DATA'].data[outside] = 0.
+                hdulist['SEGMAP'].data[outside] = 0
+                filename = '{}_partition{}.fits'.format(seed_file.split('.fits')[0], i)
+                hdulist.writeto(filename, overwrite=True)
+            files.append(filename)
+        partition_files.append(files)
+    return partition_files
+
+
+def _create_catalog_seed(task):
+    """Create the direct seed image for a single yaml file. This is a
+    module-level function so that it can be run in a worker process.
+
+    Parameters
+    ----------
+    task : tuple
+        (paramfile, offline)
+
+    Returns
+    -------
+    seed : types.SimpleNamespace
+        Catalog_seed attributes needed for dispersion and the creation
+        of the final observation
+    """
+    paramfile, offline = task
+    print('Running catalog_seed_image for {}'.format(paramfile))
+    cat = catalog_seed_image.Catalog_seed(offline=offline)
+    cat.paramfile = paramfile
+    cat.make_seed()
+    return SimpleNamespace(seed_file=cat.seed_file, params=cat.params,
+                           subarray_bounds=cat.subarray_bounds, seed_segmap=cat.seed_segmap,
+                           seedinfo=cat.seedinfo)
+
+
+def _disperse_sources(task):
+    """Disperse all of the sources in a set of direct seed images. This is a
+    module-level function so that it can be run in a worker process.
+
+    Parameters
+    ----------
+    task : tuple
+        (seed_files, background_file, source_stamps_file, crossing_filter,
+        dmode, config_path, instrument, extrapolate_SED, SED_file, orders).
+        If background_file is False, no background is added.
+
+    Returns
+    -------
+    dispersed : numpy.ndarray
+        Dispersed seed image
+    """
+    (seed_files, background_file, source_stamps_file, crossing_filter, dmode, config_path,
+     instrument, extrapolate_SED, SED_file, orders) = task
+    disp_seed = Grism_seed(seed_files, crossing_filter, dmode, config_path=config_path,
+                           instrument=instrument, extrapolate_SED=extrapolate_SED, SED_file=SED_file,
+                           SBE_save=source_stamps_file)
+    disp_seed.observation(orders=orders)
+    disp_seed.disperse(orders=orders)
+    disp_seed.finalize(Back=background_file)
+    return disp_seed.final
+
+
 if __name__ == '__main__':
 
     usagestring = ('USAGE: wfss_simualtor.py file1.yaml file2.yaml --crossing_filter F444W --direction R '
@@ -101,9 +101,10 @@ from astropy.table import Table
 from astropy.io import ascii, fits
 import numpy as np
 import pkg_resources
-import pysiaf
+from pysiaf.constants import JWST_PRD_DATA_ROOT
 
 from ..apt import apt_inputs
+from ..utils import siaf_interface
 from ..utils.utils import calc_frame_time, ensure_dir_exists, expand_environment_variable
 from .generate_observationlist import get_observation_dict
 from ..constants import NIRISS_PUPIL_WHEEL_ELEMENTS, NIRISS_FILTER_WHEEL_ELEMENTS
@@ -942,7 +943,7 @@ class SimInput:
                 siaf_inst = self.info['Instrument'][i].upper()
                 if siaf_inst == 'NIRCAM':
                     siaf_inst = "NIRCam"
-                siaf_obj = pysiaf.Siaf(siaf_inst)[aperture]
+                siaf_obj = siaf_interface.get_instance(siaf_inst, basepath=JWST_PRD_DATA_ROOT)[aperture]
 
                 # Calculate the readout time for a single frame
                 frametime = calc_frame_time(siaf_inst, aperture,
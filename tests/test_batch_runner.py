@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+"""Test the batch runner for simulator yaml files
+
+Authors
+-------
+    - Bryan Hilbert
+
+Use
+---
+    >>> pytest -s test_batch_runner.py
+"""
+
+import json
+import os
+from types import SimpleNamespace
+
+import yaml
+
+from mirage import batch_runner
+
+
+def make_params(output_dir, output_file, mode='imaging', array_name='NIS_SUB64', ngroup=5):
+    """Return the yaml entries used by the batch runner"""
+    return {'Inst': {'instrument': 'NIRISS', 'mode': mode},
+            'Readout': {'readpatt': 'NIS', 'ngroup': ngroup, 'nint': 1, 'array_name': array_name},
+            'Reffiles': {'readpattdefs': 'config'},
+            'Output': {'directory': output_dir, 'file': output_file, 'datatype': 'linear, raw'}}
+
+
+def fake_simulation(task):
+    """Stand-in for running a simulation. job1 fails on its first attempt
+    only, job2 always fails, and other jobs succeed and create their
+    output files."""
+    yaml_file, mode, offline = task
+    attempted = yaml_file + '.attempted'
+    if os.path.basename(yaml_file) == 'job1.yaml' and not os.path.isfile(attempted):
+        open(attempted, 'w').close()
+        return SimpleNamespace(success=False, elapsed=0.1, error='First attempt fails')
+    if os.path.basename(yaml_file) == 'job2.yaml':
+        return SimpleNamespace(success=False, elapsed=0.1, error='Always fails')
+    for filename in batch_runner.expected_outputs(batch_runner.read_yaml(yaml_file)):
+        open(filename, 'w').close()
+    return SimpleNamespace(success=True, elapsed=0.1, error=None)
+
+
+def test_estimate_memory():
+    """Memory estimates scale with the array size and number of frames"""
+    subarray = batch_runner.estimate_memory(make_params('.', 'a_uncal.fits'))
+    full_frame = batch_runner.estimate_memory(make_params('.', 'a_uncal.fits', array_name='NIS_CEN'))
+    more_groups = batch_runner.estimate_memory(make_params('.', 'a_uncal.fits', array_name='NIS_CEN', ngroup=10))
+    wfss = batch_runner.estimate_memory(make_params('.', 'a_uncal.fits', mode='wfss', array_name='NIS_CEN'))
+    assert batch_runner.BASE_JOB_MEMORY < subarray < full_frame < more_groups
+    assert full_frame < wfss
+
+    outputs = batch_runner.expected_outputs(make_params('out', 'a_uncal.fits'))
+    assert outputs == [os.path.abspath('out/a_linear.fits'), os.path.abspath('out/a_uncal.fits')]
+
+
+def test_resume_and_retry(tmpdir, monkeypatch):
+    """Completed jobs in the journal are skipped, and failed jobs are
+    retried before being recorded as failed"""
+    yaml_dir = str(tmpdir.mkdir('yaml'))
+    output_dir = str(tmpdir.mkdir('output'))
+    for i in range(3):
+        with open(os.path.join(yaml_dir, 'job{}.yaml'.format(i)), 'w') as outfile:
+            yaml.dump(make_params(output_dir, 'job{}_uncal.fits'.format(i)), outfile)
+
+    # Record the first job as complete in the journal of an earlier batch
+    journal_file = os.path.join(yaml_dir, batch_runner.JOURNAL_FILENAME)
+    outputs = [os.path.join(output_dir, name) for name in ['job0_linear.fits', 'job0_uncal.fits']]
+    for filename in outputs:
+        open(filename, 'w').close()
+    with open(journal_file, 'w') as journal:
+        journal.write(json.dumps({'yaml_file': os.path.join(yaml_dir, 'job0.yaml'), 'mode': 'imaging',
+                                  'status': 'complete', 'attempts': 1, 'memory': 1.e9, 'elapsed': 10.,
+                                  'outputs': outputs}) + '\n')
+
+    # job1 succeeds when retried, while job2 fails on every attempt
+    monkeypatch.setattr(batch_runner, '_run_simulation', fake_simulation)
+    runner = batch_runner.BatchRunner(yaml_dir, processes=2, retries=1,
+                                      summary_file=os.path.join(str(tmpdir), 'summary.txt'))
+    summary = runner.run()
+    summary.sort('yaml_file')
+    assert list(summary['status']) == ['skipped', 'complete', 'failed']
+    assert list(summary['attempts']) == [1, 2, 2]
+    assert os.path.isfile(os.path.join(str(tmpdir), 'summary.txt'))
+
+    with open(journal_file) as journal:
+        entries = sorted([json.loads(line) for line in journal], key=lambda entry: entry['yaml_file'])
+    assert [entry['status'] for entry in entries] == ['complete', 'complete', 'failed']
+    assert entries[1]['outputs'] == batch_runner.expected_outputs(make_params(output_dir, 'job1_uncal.fits'))
+    assert entries[2]['error'] == 'Always fails'
+    completed = [os.path.join(yaml_dir, 'job{}.yaml'.format(i)) for i in range(2)]
+    assert sorted(batch_runner.completed_jobs(journal_file)) == completed
+
+    # Resuming the batch runs only the failed job
+    summary = batch_runner.BatchRunner(yaml_dir, processes=2, retries=0).run()
+    summary.sort('yaml_file')
+    assert list(summary['status']) == ['skipped', 'skipped', 'failed']
@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+"""Test the tile-based cache of external catalog queries
+
+Authors
+-------
+    - Bryan Hilbert
+
+Use
+---
+    >>> pytest -s test_catalog_cache.py
+"""
+
+from astropy.table import Table
+import numpy as np
+
+from mirage.catalogs import catalog_cache, create_catalog
+from mirage.catalogs.catalog_cache import CatalogBackend, TiledCatalogCache
+
+
+class LocalBackend(CatalogBackend):
+    """Stand-in catalog server backed by a fixed table of sources"""
+    def __init__(self):
+        random = np.random.RandomState(12)
+        self.table = Table()
+        self.table['ra'] = random.uniform(79., 81., 5000)
+        self.table['dec'] = random.uniform(-70.5, -69., 5000)
+        self.table['designation'] = ['src{}'.format(i) for i in range(5000)]
+        self.queries = []
+
+    def query_box(self, catalog, ra_min, ra_max, dec_min, dec_max):
+        self.queries.append((ra_min, dec_min))
+        ra = self.table['ra']
+        dec = self.table['dec']
+        return self.table[(ra >= ra_min) & (ra < ra_max) & (dec >= dec_min) & (dec < dec_max)]
+
+
+def test_tiled_catalog_cache(tmpdir):
+    """Test that overlapping regions are served from stored tiles, and
+    that the results match a direct selection from the catalog"""
+    backend = LocalBackend()
+    cache = TiledCatalogCache(str(tmpdir), backend=backend, tile_size=0.25)
+
+    ra, dec, width = 80.1, -69.8, 600.
+    table = cache.query_box('2MASS', ra, dec, width)
+    half_width = width / 3600. / 2.
+    expected = ((np.abs((backend.table['ra'] - ra) * np.cos(np.radians(dec))) <= half_width)
+                & (np.abs(backend.table['dec'] - dec) <= half_width))
+    assert sorted(table['designation']) == sorted(backend.table['designation'][expected])
+    first_queries = len(backend.queries)
+    assert first_queries > 0
+
+    # Repeating the query, or querying an overlapping region with the same
+    # tiles, does not query the backend again
+    again = cache.query_box('2MASS', ra, dec, width)
+    assert sorted(again['designation']) == sorted(table['designation'])
+    cache.query_box('2MASS', ra + 0.01, dec + 0.01, width)
+    assert len(backend.queries) == first_queries
+
+    # A region that extends past the stored tiles queries only new tiles
+    cache.query_box('2MASS', ra + 0.3, dec, width)
+    assert 0 < len(backend.queries) - first_queries < first_queries + 1
+    assert len(set(backend.queries)) == len(backend.queries)
+
+    # Cone queries use the same tiles
+    cone = cache.query_cone('2MASS', ra, dec, 100.)
+    assert len(cone) > 0
+    assert all(np.isin(cone['designation'], table['designation']))
+
+
+def test_cached_catalog_query(tmpdir, monkeypatch):
+    """Test that a catalog query function works when its results are
+    served from the stored tiles"""
+    backend = LocalBackend()
+    monkeypatch.setattr(catalog_cache, '_CATALOG_CACHE',
+                        TiledCatalogCache(str(tmpdir), backend=backend, tile_size=0.25))
+
+    first, mag_cols = create_catalog.query_2MASS_ptsrc_catalog(80.1, -69.8, 600.)
+    first_queries = len(backend.queries)
+    assert len(first) > 0
+
+    second, mag_cols = create_catalog.query_2MASS_ptsrc_catalog(80.1, -69.8, 600.)
+    assert len(backend.queries) == first_queries
+    assert sorted(second['designation']) == sorted(first['designation'])
+
+    # A region without sources gives an empty table
+    empty, mag_cols = create_catalog.query_2MASS_ptsrc_catalog(10., 10., 600.)
+    assert len(empty) == 0
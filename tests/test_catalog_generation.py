@@ -17,10 +17,12 @@ import numpy as np
 import os
 
 from astropy.io import ascii
+from astropy.table import Table
 import pytest
 
 from mirage.catalogs import catalog_generator
 from mirage.catalogs import create_catalog
+from mirage.catalogs import sky_index
 
 TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data/')
 
@@ -72,6 +74,102 @@ def test_galaxy_catalog_creation():
     os.remove(output_file)
 
 
+def test_add_catalog_columns():
+    """Test that adding catalogs extends all per-source columns, and fills
+    magnitude columns that are missing from one of the catalogs
+    """
+    gal = catalog_generator.GalaxyCatalog(ra=np.zeros(3) + 80.0, dec=np.zeros(3) - 69.8,
+                                          ellipticity=np.zeros(3) + 0.1, radius=np.zeros(3) + 0.5,
+                                          sersic_index=np.zeros(3) + 1.5, position_angle=np.zeros(3))
+    gal.add_magnitude_column(np.zeros(3) + 19., instrument='nircam', filter_name='f090w')
+    assert len(gal.table) == 3
+
+    gal2 = catalog_generator.GalaxyCatalog(ra=np.zeros(2) + 80.1, dec=np.zeros(2) - 69.7,
+                                           ellipticity=np.zeros(2) + 0.2, radius=np.zeros(2) + 0.6,
+                                           sersic_index=np.zeros(2) + 2.5, position_angle=np.zeros(2) + 45.)
+    gal2.add_magnitude_column(np.zeros(2) + 20., instrument='nircam', filter_name='f200w')
+    for i in range(3):
+        gal.add_catalog(gal2)
+
+    assert len(gal.table) == 9
+    assert all(gal.ellipticity == [0.1] * 3 + [0.2] * 6)
+    assert all(gal.table['nircam_f090w_magnitude'] == [19.] * 3 + [99.] * 6)
+    assert all(gal.get_magnitudes('nircam_f200w_magnitude') == [99.] * 3 + [20.] * 6)
+
+    subset = gal.select([0, 4])
+    assert isinstance(subset, catalog_generator.GalaxyCatalog)
+    assert all(subset.table['pos_angle'] == [0., 45.])
+    assert len(gal) == 9
+
+
+def test_catalog_for_boxes():
+    """Test that a catalog built box by box contains each source in the
+    union of the boxes exactly once"""
+    random = np.random.RandomState(4)
+    sky_ra = random.uniform(79.5, 80.5, 20000)
+    sky_dec = random.uniform(-70.2, -69.8, 20000)
+    boxes = [(80., -70., 300.), (80.02, -70., 300.), (80., -69.95, 200.)]
+
+    def make_catalog(box_number, ra, dec, width):
+        # Return all sources within a circle enclosing the box, as a
+        # catalog query or galaxy_background would
+        near = np.hypot((sky_ra - ra) * np.cos(np.radians(dec)), sky_dec - dec) < width / 3600.
+        catalog = catalog_generator.PointSourceCatalog(ra=sky_ra[near], dec=sky_dec[near])
+        catalog.add_magnitude_column(np.zeros(np.sum(near)) + 18., instrument='nircam', filter_name='f200w')
+        return catalog
+
+    combined = create_catalog.catalog_for_boxes(boxes, make_catalog)
+    expected = sky_index.in_boxes(sky_ra, sky_dec, boxes)
+    assert len(combined) == np.sum(expected)
+    assert sorted(combined.ra) == sorted(sky_ra[expected])
+
+
+def test_besancon_queries_for_proposal(monkeypatch):
+    """Test that for_proposal queries the Besancon model once for a region
+    covered by several boxes, and that each Besancon star within the
+    boxes is kept once"""
+    # A chain of pointings too far apart to share a box, but close enough
+    # to be in one region
+    pointing_dec = -70. + np.arange(4) * 300. / 3600.
+    pointing_dictionary = {'ra_ref': [80.] * 4, 'dec_ref': list(pointing_dec),
+                           'ObservationID': ['001', '002', '003', '004']}
+    monkeypatch.setattr(create_catalog, 'create_basic_exposure_list', lambda xml, pointing: pointing_dictionary)
+    monkeypatch.setattr(create_catalog, 'get_filters', lambda pointings: {'nircam': ['F200W']})
+
+    besancon_calls = []
+    stars = {}
+
+    def fake_besancon(ra, dec, box_width, email='', kmag_limits=(13, 29), seed=None):
+        besancon_calls.append((ra, dec, box_width))
+        random = np.random.RandomState(seed)
+        half_width = box_width / 3600. / 2.
+        stars['ra'] = ra + random.uniform(-half_width, half_width, 5000) / np.cos(np.radians(dec))
+        stars['dec'] = dec + random.uniform(-half_width, half_width, 5000)
+        cat = catalog_generator.PointSourceCatalog(ra=stars['ra'], dec=stars['dec'])
+        return cat, Table({'V': np.zeros(5000) + 20.})
+
+    def fake_get_all_catalogs(ra, dec, box_width, instrument='', filters=[], email='', besancon_result=None):
+        besancon_cat, besancon_model = besancon_result
+        besancon_cat.add_magnitude_column(besancon_model['V'].data, instrument=instrument,
+                                          filter_name=filters[0])
+        return besancon_cat, ['{}_{}_magnitude'.format(instrument, filters[0])]
+
+    monkeypatch.setattr(create_catalog, 'besancon', fake_besancon)
+    monkeypatch.setattr(create_catalog, 'get_all_catalogs', fake_get_all_catalogs)
+    ptsrc_list, galaxy_list, ptsrc_names, galaxy_names, ptsrc_mapping, galaxy_mapping = \
+        create_catalog.for_proposal('proposal.xml', 'proposal.pointing', extragalactic=False,
+                                    save_catalogs=False, besancon_seed=5)
+    assert len(besancon_calls) == 1
+    assert len(ptsrc_list) == 4
+
+    boxes = sky_index.covering_boxes(np.zeros(4) + 80., pointing_dec, 2. * create_catalog.POINTING_HALF_WIDTH)
+    assert len(boxes) == 4
+    expected = sky_index.in_boxes(stars['ra'], stars['dec'], boxes)
+    kept = np.unique(np.concatenate([cat.ra for cat in ptsrc_list]))
+    assert len(kept) == np.sum(expected)
+    assert np.all(np.isin(kept, stars['ra'][expected]))
+
+
 def test_2mass_catalog_generation():
     """Test the generation of a catalog from a 2MASS query
     """
@@ -239,6 +337,52 @@ def test_gaia_query():
                                   'gaia_phot_bp_mean_mag_magnitude', 'gaia_phot_rp_mean_mag_magnitude']
 
 
+def test_twomass_crossmatch():
+    """Test the selection of the GAIA counterpart of 2MASS sources"""
+    gaia_cat = Table()
+    gaia_cat['ra'] = [80.0, 80.0, 80.1]
+    gaia_cat['dec'] = [-69.8, -69.8 + 0.1 / 3600., -69.7]
+    gaia_cat['designation'] = ['G1', 'G2', 'G3']
+    gaia_cat['phot_g_mean_mag'] = [15., 14., 12.]
+
+    gaia_2mass = Table()
+    gaia_2mass['ra'] = [80.0, 80.1]
+    gaia_2mass['dec'] = [-69.8, -69.7]
+    gaia_2mass['designation'] = ['T1', 'T2']
+    gaia_2mass['ph_qual'] = ['UAB', 'UUU']
+    for key in ['j_m', 'h_m', 'ks_m']:
+        gaia_2mass[key] = [13.5, 11.]
+
+    crossref = Table()
+    crossref['designation'] = ['G1', 'G2', 'G3']
+    crossref['designation_2'] = ['T1', 'T1', 'T2']
+
+    twomass_cat = Table()
+    twomass_cat['ra'] = [80.1, 80.0, 81.]
+    twomass_cat['designation'] = ['T2', 'T1', 'T3']
+
+    # T1 matches G2, which has the smaller G - H difference. T2 has no
+    # usable 2MASS magnitude, and T3 has no cross reference.
+    matches = create_catalog.twomass_crossmatch(gaia_cat, gaia_2mass, crossref, twomass_cat)
+    assert list(matches) == [-10, 1, -10]
+
+
+def test_interpolate_magnitude_array():
+    """Test batched magnitude interpolation against numpy.interp"""
+    wl1 = np.array([0.5, 0.7, 0.8, 1.2, 1.7, 2.2, 3.4, 4.6, 12., 22.])
+    wl2 = np.array([0.9, 2.0, 4.4])
+    magnitudes = np.zeros((3, 10)) + 10000.
+    magnitudes[0, [1, 3, 5]] = [15., 14., 13.]
+    magnitudes[1, [0, 6, 7]] = [16., 12., np.nan]
+    magnitudes[2, :] = 10000.
+    expected = [np.interp(wl2, wl1[[1, 3, 5]], [15., 14., 13.]),
+                np.interp(wl2, wl1[[0, 6]], [16., 12.]),
+                np.zeros(3) + 10000.]
+    names = ['nircam_f090w_magnitude', 'nircam_f200w_magnitude', 'nircam_f444w_magnitude']
+    result = create_catalog.interpolate_magnitude_array(wl1, magnitudes, wl2, names)
+    assert np.allclose(result, expected)
+
+
 def test_random_ra_dec_values():
     """Test the random RA, Dec value generator used when getting Besancon
     sources"""
@@ -258,6 +402,24 @@ def test_random_ra_dec_values():
     assert np.min(dec1) >= dec_min
     assert np.max(dec1) <= dec_max
 
+    # Generating in chunks does not change the values
+    ra3, dec3 = create_catalog.generate_ra_dec(num_stars, ra_min, ra_max, dec_min, dec_max,
+                                               seed=37465, chunk_size=3)
+    assert np.all(ra1 == ra3)
+    assert np.all(dec1 == dec3)
+
+    # Integer seeds give the same values as seeding numpy's global random
+    # state, as was done in earlier versions
+    numbers = np.random.RandomState(37465).random_sample(2 * num_stars)
+    assert np.allclose(ra1, numbers[:num_stars] * (ra_max - ra_min) + ra_min)
+    assert np.allclose(dec1, numbers[num_stars:] * (dec_max - dec_min) + dec_min)
+
+    # A numpy Generator can be used instead
+    ra4, dec4 = create_catalog.generate_ra_dec(num_stars, ra_min, ra_max, dec_min, dec_max,
+                                               seed=np.random.default_rng(37465))
+    assert np.min(ra4) >= ra_min
+    assert np.max(dec4) <= dec_max
+
 
 def test_cat_from_file():
     """Test function for reading ascii catalogs into catalog objects"""
@@ -273,3 +435,21 @@ def test_cat_from_file():
         cat_path = os.path.join(data_path, cat_name)
         cat_object = catalog_generator.cat_from_file(cat_path, catalogs[cat_name][0])
         assert isinstance(cat_object, catalogs[cat_name][1])
+
+
+def test_binary_catalog_round_trip(tmpdir):
+    """Test that catalogs saved as FITS tables are read back with the same
+    columns and metadata as the ascii versions"""
+    data_path = os.path.join(TEST_DATA_DIR, 'catalog_generation/')
+    catalogs = {'galaxy_1.cat': 'galaxy', 'moving_sersic_source_test.cat': 'moving_sersic',
+                'nonsidereal_source_test.cat': 'non_sidereal'}
+    for cat_name in catalogs:
+        cat_object = catalog_generator.cat_from_file(os.path.join(data_path, cat_name), catalogs[cat_name])
+        binary_file = os.path.join(str(tmpdir), cat_name.replace('.cat', '.fits'))
+        cat_object.save(binary_file)
+
+        from_binary = catalog_generator.cat_from_file(binary_file, catalogs[cat_name])
+        assert from_binary.table.colnames == cat_object.table.colnames
+        assert from_binary.table.meta['comments'] == cat_object.table.meta['comments']
+        for colname in cat_object.table.colnames:
+            assert all(from_binary.table[colname] == cat_object.table[colname])
@@ -16,11 +16,15 @@ Use
 
         pytest -s test_catalog_seed_generator.py
 """
+from types import SimpleNamespace
+
+from astropy.io import fits
 from astropy.table import Table
 import numpy as np
 import os
 import webbpsf
 
+from mirage.catalogs import catalog_generator
 from mirage.seed_image import catalog_seed_image
 
 # Determine if tests are being run on Travis
@@ -205,3 +209,45 @@ def test_overlap_coordinates_subarray():
                                                     updated_psf_dimensions, stamp_x_loc, stamp_y_loc,
                                                     coord_sys='aperture')
         assert (i1, i2, j1, j2, k1, k2, l1, l2) == expected_k1l1[index]
+
+
+def test_extended_source_list(tmpdir):
+    """Test that an extended source catalog is read in and its sources
+    placed on the detector, both when the catalog is read from the file
+    and when a catalog that was already read is passed in"""
+    stamp_file = os.path.join(str(tmpdir), 'stamp.fits')
+    fits.writeto(stamp_file, np.ones((11, 11)))
+    catalog = catalog_generator.ExtendedCatalog(filenames=[stamp_file, stamp_file], x=[100., 5000.],
+                                                y=[200., 5000.], position_angle=[0., 0.])
+    catalog.add_magnitude_column([15., 15.], instrument='nircam', filter_name='f200w')
+    catalog_file = os.path.join(str(tmpdir), 'extended.cat')
+    catalog.save(catalog_file)
+
+    seed = catalog_seed_image.Catalog_seed(offline=True)
+    seed.params = {'Inst': {'instrument': 'NIRCam', 'mode': 'imaging'},
+                   'Readout': {'filter': 'F200W', 'pupil': 'CLEAR'},
+                   'Output': {'file': os.path.join(str(tmpdir), 'seed.fits'), 'grism_source_image': False},
+                   'simSignals': {'extendedscale': 1.},
+                   'Telescope': {'rotation': 0.}}
+    seed.siaf = SimpleNamespace(XSciScale=0.031)
+    seed.subarray_bounds = [0, 0, 2047, 2047]
+    seed.output_dims = [2048, 2048]
+    seed.ra, seed.dec = 80., -70.
+    seed.maxindex = 0
+    seed.frametime = 10.
+    seed.photfnu = 1.e-31
+    seed.photflam = 1.e-21
+    seed.vegazeropoint = 25.
+    seed.XYToRADec = lambda x, y: (80., -70., '05:20:00.00', '-70:00:00.00')
+
+    extlist, stamps = seed.getExtendedSourceList(catalog_file)
+    assert len(extlist) == 1
+    assert len(stamps) == 1
+    assert np.isclose(np.sum(stamps[0]), 1.)
+    assert extlist['pixelx'][0] == 100.
+    assert extlist['pixely'][0] == 200.
+
+    seed.maxindex = 0
+    read_in = seed.read_point_source_file(catalog_file)
+    extlist_from_catalog, _ = seed.getExtendedSourceList(catalog_file, catalog=read_in)
+    assert all(extlist_from_catalog['countrate_e/s'] == extlist['countrate_e/s'])
@@ -171,3 +171,43 @@ def test_load_ote_from_deployment_yaml(test_directory, remove_yamls_and_fits):
     assert not np.array_equal(ote_opd_with_tilts, ote.opd), 'Segment tilts were not removed.'
     assert np.isclose(np.mean(ote_opd_with_tilts), -1.709744233280506e-05), \
         'OTE was not loaded correctly from file.'
+
+
+def test_stored_ote_realization(test_directory, remove_yamls_and_fits):
+    """Test that a seeded OTE deployment is stored and then reused.
+
+    Parameters
+    ----------
+    test_directory : str
+        Path to directory used for testing
+    remove_yamls_and_fits
+        Pytest fixture to clear files after test is run
+    """
+    store_dir = os.path.join(test_directory, 'realizations')
+    ote, segment_tilts, ote_opd_with_tilts = generate_random_ote_deployment(
+        test_directory, reduction_factor=0.2, save=False, seed=12, store_dir=store_dir
+    )
+    assert len(glob.glob(os.path.join(store_dir, 'ote_realization_*.npz'))) == 1, \
+        'OTE deployment realization was not stored'
+
+    stored_ote, stored_tilts, stored_opd_with_tilts = generate_random_ote_deployment(
+        test_directory, reduction_factor=0.2, save=False, seed=12, store_dir=store_dir
+    )
+    np.testing.assert_allclose(stored_ote.segment_state, ote.segment_state)
+    np.testing.assert_allclose(stored_ote.opd, ote.opd)
+    np.testing.assert_allclose(stored_tilts, segment_tilts)
+    np.testing.assert_allclose(stored_opd_with_tilts, ote_opd_with_tilts)
+
+    # Saving a new and a stored realization produces the same files
+    saved_files = []
+    for subdir in ['new', 'stored']:
+        out_dir = os.path.join(test_directory, subdir)
+        ensure_dir_exists(out_dir)
+        generate_random_ote_deployment(
+            out_dir, reduction_factor=0.2, save=True, seed=13, store_dir=store_dir
+        )
+        saved_files.append(sorted(filename.rsplit('_', 2)[0] for filename in os.listdir(out_dir)))
+    assert saved_files[0] == saved_files[1], \
+        'Stored realization did not save the same files as a new realization'
+    assert saved_files[0] == ['OPD_notilt', 'OPD_withtilt', 'deployment_errors',
+                              'deployment_errors_reduced']
@@ -8,14 +8,19 @@ Use
 ---
     >>> pytest test_psf_selection.py
 """
+from glob import glob
 import os
 import shutil
 
 from astropy.io import fits
+from astropy.nddata import NDData
+import numpy as np
 import photutils
 import pytest
 
-from mirage.psf.psf_selection import get_library_file, _load_itm_library
+from mirage.psf import psf_selection
+from mirage.psf.psf_selection import (get_library_file, _load_itm_library,
+                                    LIBRARY_INDEX_FILENAME, PSFLibraryIndex)
 from mirage.utils.utils import ensure_dir_exists
 
 # Define directory and file locations
@@ -132,3 +137,127 @@ def test_load_itm_library(itm_file):
         'ITM PSF library not created correctly'
     assert lib_model.data.shape == (1, 2048, 2048), \
         'ITM PSF library not created correctly'
+
+
+def test_library_index(test_directory):
+    """Test that the PSF library index is created, used for file
+    selection, and refreshed when a library file changes
+
+    Parameters
+    ----------
+    test_directory : str
+        Path to directory used for testing
+    """
+    library_path = os.path.join(test_directory, 'index_test')
+    ensure_dir_exists(library_path)
+    filenames = []
+    for segment_id in [1, 2]:
+        header = fits.Header()
+        header['INSTRUME'] = 'NIRCAM'
+        header['DETECTOR'] = 'NRCA3'
+        header['FILTER'] = 'F212N'
+        header['SEGID'] = segment_id
+        filename = os.path.join(library_path, 'nircam_nrca3_f212n_seg{}.fits'.format(segment_id))
+        fits.PrimaryHDU(header=header).writeto(filename, overwrite=True)
+        filenames.append(filename)
+
+    match_file = get_library_file('NIRCam', 'NRCA3', 'F212N', 'CLEAR', '', 0,
+                                  library_path, segment_id=2)
+    assert match_file == filenames[1]
+
+    index_file = os.path.join(library_path, LIBRARY_INDEX_FILENAME)
+    assert os.path.isfile(index_file)
+    library_index = PSFLibraryIndex(library_path)
+    assert sorted(library_index.entries.keys()) == ['nircam_nrca3_f212n_seg1.fits',
+                                                    'nircam_nrca3_f212n_seg2.fits']
+    assert library_index.get_header(filenames[0])['SEGID'] == 1
+    assert not library_index.modified
+
+    # Changing a file must invalidate its index entry
+    fits.setval(filenames[0], 'SEGID', value=3)
+    os.utime(filenames[0], (0, 0))
+    match_file = get_library_file('NIRCam', 'NRCA3', 'F212N', 'CLEAR', '', 0,
+                                  library_path, segment_id=3)
+    assert match_file == filenames[0]
+
+
+def test_library_cache(test_directory, monkeypatch):
+    """Test that gridded PSF models are shared between calls, reloaded
+    when the file changes, and evicted when over the memory budget
+
+    Parameters
+    ----------
+    test_directory : str
+        Path to directory used for testing
+    """
+    class FakeModel():
+        def __init__(self, filename):
+            self.filename = filename
+            self.data = np.zeros((1, 10, 10))
+
+    monkeypatch.setattr(psf_selection, 'to_griddedpsfmodel', FakeModel)
+    psf_selection.clear_library_cache()
+
+    filenames = []
+    for i in range(2):
+        filename = os.path.join(test_directory, 'cache_test_{}.fits'.format(i))
+        fits.PrimaryHDU().writeto(filename, overwrite=True)
+        filenames.append(filename)
+
+    first = psf_selection.load_gridded_psf_model(filenames[0])
+    assert psf_selection.load_gridded_psf_model(filenames[0]) is first
+
+    # A modified file is read again
+    os.utime(filenames[0], (0, 0))
+    assert psf_selection.load_gridded_psf_model(filenames[0]) is not first
+
+    # Only one model fits within this budget
+    monkeypatch.setattr(psf_selection, 'LIBRARY_CACHE_MAX_BYTES', first.data.nbytes)
+    second = psf_selection.load_gridded_psf_model(filenames[1])
+    assert len(psf_selection._LIBRARY_CACHE) == 1
+    assert psf_selection.load_gridded_psf_model(filenames[1]) is second
+
+    psf_selection.set_library_cache_limit(0)
+    assert len(psf_selection._LIBRARY_CACHE) == 0
+
+
+def test_shared_library(test_directory, monkeypatch):
+    """Test that a library exported to the shared directory is read back
+    as a memory-mapped griddedPSFModel with the original data
+
+    Parameters
+    ----------
+    test_directory : str
+        Path to directory used for testing
+    """
+    data = np.random.random((4, 11, 11))
+    grid_xypos = [(0., 0.), (100., 0.), (0., 100.), (100., 100.)]
+
+    def fake_to_griddedpsfmodel(library_file):
+        return photutils.psf.GriddedPSFModel(
+            NDData(data, meta={'grid_xypos': grid_xypos, 'oversampling': 1}))
+
+    monkeypatch.setattr(psf_selection, 'to_griddedpsfmodel', fake_to_griddedpsfmodel)
+    library_file = os.path.join(test_directory, 'shared_test.fits')
+    fits.PrimaryHDU().writeto(library_file, overwrite=True)
+    shared_dir = os.path.join(test_directory, 'shared')
+
+    # Keep the memory-mapped arrays so that we can check the models use them
+    # rather than a copy
+    mapped = []
+    np_load = np.load
+
+    def recording_load(*args, **kwargs):
+        array = np_load(*args, **kwargs)
+        mapped.append(array)
+        return array
+
+    monkeypatch.setattr(psf_selection.np, 'load', recording_load)
+
+    for i in range(2):
+        library = psf_selection.load_shared_gridded_psf_model(library_file, shared_dir)
+        assert np.allclose(library.data, data)
+        assert np.allclose(library.grid_xypos, grid_xypos)
+        assert isinstance(mapped[-1], np.memmap)
+        assert np.shares_memory(library.data, mapped[-1])
+    assert len(glob(os.path.join(shared_dir, '*.npy'))) == 1
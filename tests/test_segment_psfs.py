@@ -12,6 +12,7 @@ from ast import literal_eval
 import glob
 import os
 import shutil
+from types import SimpleNamespace
 
 from astropy.io import fits
 import numpy as np
@@ -22,8 +23,10 @@ from webbpsf.utils import to_griddedpsfmodel
 from .utils import parametrized_data
 from mirage.psf.deployments import generate_random_ote_deployment
 from mirage.psf.psf_selection import get_library_file
+from mirage.psf import segment_psfs
 from mirage.psf.segment_psfs import (get_segment_library_list, get_segment_offset,
-                                     get_gridded_segment_psf_library_list, generate_segment_psfs)
+                                     get_gridded_segment_psf_library_list, generate_segment_psfs,
+                                     segment_psf_filename, segment_psf_inputs_hash)
 from mirage.utils.utils import ensure_dir_exists
 
 # Define directory and file locations
@@ -44,6 +47,17 @@ DETECTOR = 'NRCA3'
 FILTER = 'F212N'
 
 
+def fake_generate_segment_psf(task):
+    """Stand-in for the generation of a segment PSF library, writing a
+    file with the header keywords checked on restart"""
+    ote, segment_tilt, i_segment, det, filt, fov_pixels, filepath = task
+    hdu = fits.PrimaryHDU(np.ones((1, fov_pixels, fov_pixels)))
+    hdu.header['SEGID'] = i_segment
+    hdu.header['INHASH'] = segment_psf_inputs_hash(ote, segment_tilt)
+    hdu.writeto(filepath, overwrite=True)
+    return filepath
+
+
 @pytest.fixture(scope="module")
 def test_directory(test_dir=TEMP_TEST_DIRECTORY):
     """Create a test directory.
@@ -131,6 +145,45 @@ def test_generate_segment_psfs(test_directory):
         assert lib_success, 'Failed to create file: {}'.format(os.path.join(test_directory, name))
 
 
+def test_generate_segment_psfs_restart(test_directory, monkeypatch):
+    """Test that existing segment PSF library files made from the same
+    inputs are not regenerated, while those made from other inputs are.
+
+    Parameters
+    ----------
+    test_directory : str
+        Path to directory used for testing
+    """
+    out_dir = os.path.join(test_directory, 'restart')
+    ensure_dir_exists(out_dir)
+    ote = SimpleNamespace(segment_state=np.zeros((19, 6)))
+    segment_tilts = np.zeros((18, 2))
+    for i_segment in range(1, 19):
+        hdu = fits.PrimaryHDU(np.zeros((1, 11, 11)))
+        hdu.header['SEGID'] = i_segment
+        hdu.header['INHASH'] = segment_psf_inputs_hash(ote, segment_tilts[i_segment - 1])
+        hdu.writeto(os.path.join(out_dir, segment_psf_filename('NRCA3', 'F212N', 11, i_segment)))
+
+    # No PSFs should be computed, since all of the files are up to date
+    monkeypatch.setattr(segment_psfs, '_generate_segment_psf', None)
+    filepaths = generate_segment_psfs(ote, segment_tilts, out_dir, filters=['F212N'],
+                                      detectors='NRCA3', fov_pixels=11, processes=2)
+    assert filepaths == [os.path.join(out_dir, 'nircam_nrca3_f212n_fovp11_samp1_npsf1_seg{:02d}.fits'.format(i))
+                         for i in range(1, 19)]
+
+    # Restarting with a changed tilt, or a changed OTE state, regenerates
+    # the affected files
+    monkeypatch.setattr(segment_psfs, '_generate_segment_psf', fake_generate_segment_psf)
+    segment_tilts[4] = [0.5, -0.25]
+    generate_segment_psfs(ote, segment_tilts, out_dir, filters=['F212N'], detectors='NRCA3', fov_pixels=11)
+    regenerated = [fits.getdata(filepath).max() == 1 for filepath in filepaths]
+    assert regenerated == [i == 4 for i in range(18)]
+
+    ote.segment_state[3, 4] = 1.
+    generate_segment_psfs(ote, segment_tilts, out_dir, filters=['F212N'], detectors='NRCA3', fov_pixels=11)
+    assert all(fits.getdata(filepath).max() == 1 for filepath in filepaths)
+
+
 @pytest.mark.skipif(ON_TRAVIS,
                    reason="Cannot access mirage data in the central storage directory from Travis CI.")
 def test_get_segment_library_list_remote():
@@ -284,6 +337,8 @@ def test_get_gridded_segment_psf_library_list_local():
     libraries = get_gridded_segment_psf_library_list(INSTRUMENT, DETECTOR, FILTER,
                                          library_path)
     assert len(libraries) == 18, 'Did not find all 18 segment libraries'
+    assert libraries.loaded() == [], 'Segment PSF libraries were not loaded lazily'
+    assert libraries.data_shape(0) == (1, 101, 101), 'Incorrect library shape from header'
     for i, lib_model in enumerate(libraries):
         assert isinstance(lib_model, photutils.psf.models.GriddedPSFModel), \
             'Segment PSF library not created correctly'
@@ -10,6 +10,8 @@ Use
 
 
 """
+import pickle
+
 from pysiaf import iando
 
 from mirage.utils import siaf_interface
@@ -26,3 +28,25 @@ def test_sci_subarray_corners():
         x_sci, y_sci = siaf_interface.sci_subarray_corners(instrument, aperture_name)
         assert len(x_sci) == 2
         assert len(y_sci) == 2
+
+
+def test_get_instance_cache():
+    """Repeated calls return the same Siaf object until the cache is cleared"""
+    siaf = siaf_interface.get_instance('NIRISS')
+    assert siaf_interface.get_instance('NIRISS') is siaf
+    siaf_interface.clear_siaf_cache()
+    assert siaf_interface.get_instance('NIRISS') is not siaf
+
+
+def test_aperture_reference_pickle():
+    """Aperture references pickle without the aperture, and give the same
+    values as the pysiaf aperture after unpickling"""
+    aperture = siaf_interface.get_instance('NIRISS')['NIS_CEN']
+    reference = siaf_interface.ApertureReference('NIRISS', 'NIS_CEN')
+    assert reference.XSciScale == aperture.XSciScale
+
+    pickled = pickle.dumps(reference)
+    assert len(pickled) < 1000
+    unpickled = pickle.loads(pickled)
+    assert unpickled.V2Ref == aperture.V2Ref
+    assert unpickled.sci_to_idl(1000., 1000.) == aperture.sci_to_idl(1000., 1000.)
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+"""Test the spatial indexing of source positions
+
+Authors
+-------
+    - Bryan Hilbert
+
+Use
+---
+    >>> pytest -s test_sky_index.py
+"""
+
+import os
+
+from astropy.coordinates import SkyCoord
+import astropy.units as u
+import numpy as np
+
+from mirage.catalogs import catalog_generator, sky_index
+
+
+def test_query_box():
+    """Sources selected using the index should match a direct selection,
+    including across RA = 0"""
+    random = np.random.RandomState(5)
+    ra = random.uniform(-0.5, 0.5, 20000) % 360.
+    dec = random.uniform(-0.5, 0.5, 20000)
+    index = sky_index.SkyIndex(ra, dec)
+
+    rows = index.query_box(0., 0., 600.)
+    delta_ra = (ra + 180.) % 360. - 180.
+    expected = np.where((np.abs(delta_ra) <= 300. / 3600.) & (np.abs(dec) <= 300. / 3600.))[0]
+    assert np.all(rows == expected)
+
+    both = index.query_boxes([0., 0.1], [0., 0.], 600.)
+    assert np.all(np.isin(rows, both))
+    assert len(both) > len(rows)
+
+
+def test_group_positions():
+    """Positions are grouped by friends-of-friends linking"""
+    ra = np.array([1., 1.1, 1.2, 5., 359.95])
+    dec = np.zeros(5)
+    labels = sky_index.group_positions(ra, dec, 0.15 * 3600.)
+    assert labels[0] == labels[1] == labels[2]
+    assert len(set(labels)) == 3
+
+    ra_center, dec_center, width = sky_index.region_center_and_width([359.9, 0.1], [0., 0.], pad=10.)
+    assert np.isclose((ra_center + 180.) % 360. - 180., 0., atol=1e-6)
+    assert np.isclose(width, 0.2 * 3600. + 20., rtol=1e-4)
+
+
+def test_covering_boxes():
+    """Dithered pointings are merged into one box, while the pointings of
+    an L-shaped mosaic keep their own boxes"""
+    width = 300.
+    step = width / 3600.
+    ra = np.array([80., 80. + step, 80., 80.001])
+    dec = np.array([-70., -70., -70. + step, -70.])
+    ra[1] = 80. + step / np.cos(np.radians(70.))
+    boxes = sky_index.covering_boxes(ra, dec, width)
+    assert len(boxes) == 3
+    assert sum(box[2]**2 for box in boxes) < 3.1 * width**2
+
+    # Every pointing's box is covered, and nothing far outside the mosaic
+    random = np.random.RandomState(3)
+    test_ra = random.uniform(79.9, 80.3, 20000)
+    test_dec = random.uniform(-70.1, -69.85, 20000)
+    pointing_boxes = [(ra_value, dec_value, width) for ra_value, dec_value in zip(ra, dec)]
+    in_pointings = sky_index.in_boxes(test_ra, test_dec, pointing_boxes)
+    in_cover = sky_index.in_boxes(test_ra, test_dec, boxes)
+    assert np.all(in_cover[in_pointings])
+    bounding_box = [sky_index.region_center_and_width(ra, dec, pad=width / 2.)]
+    assert np.sum(in_cover) < 0.9 * np.sum(sky_index.in_boxes(test_ra, test_dec, bounding_box))
+
+
+def test_read_catalog_near(tmpdir, monkeypatch):
+    """Reading with the saved spatial index should return the same
+    sources as reading the full catalog and selecting by separation"""
+    monkeypatch.setattr(sky_index, 'INDEX_MIN_FILE_SIZE', 0)
+    random = np.random.RandomState(8)
+    catalog = catalog_generator.PointSourceCatalog(ra=random.uniform(79.5, 80.5, 5000),
+                                                   dec=random.uniform(-70.3, -69.7, 5000))
+    catalog.add_magnitude_column(random.uniform(15., 20., 5000), instrument='nircam', filter_name='f200w')
+    filename = os.path.join(str(tmpdir), 'ptsrc.cat')
+    catalog.save(filename)
+
+    full = catalog_generator.read_catalog_table(filename)
+    separation = SkyCoord(full['x_or_RA'], full['y_or_Dec'], unit='deg').separation(SkyCoord(80., -70., unit='deg'))
+    expected = full[separation < 300. * u.arcsec]
+
+    for attempt in range(2):
+        near = sky_index.read_catalog_near(filename, 80., -70., 300.)
+        assert all(near['index'] == expected['index'])
+        assert all(near['nircam_f200w_magnitude'] == expected['nircam_f200w_magnitude'])
+        assert near.meta['index_range'] == (1, 5000)
+        assert near.meta['comments'][0] == 'position_RA_Dec'
+
+        # The second read uses the index saved next to the catalog
+        sky_index._CATALOG_INDEXES.clear()
+        assert os.path.isfile(filename + sky_index.CATALOG_INDEX_SUFFIX + '.pkl')
@@ -13,6 +13,7 @@ Use
 import os
 import numpy as np
 
+from astropy.table import Table
 import astropy.units as u
 
 from mirage.catalogs import spectra_from_catalog as spec
@@ -49,8 +50,11 @@ def test_hdf5_file_input():
 
     comparison = hdf5.open(os.path.join(TEST_DATA_DIR, 'output_spec_from_hdf5_input_including_normalized.hdf5'))
     constructed = hdf5.open(sed_catalog)
-    for key in comparison:
-        assert key in constructed.keys()
+
+    # Spectra in the file for sources not in the catalog are not used
+    assert sorted(constructed.keys()) == [3, 4]
+    for key in constructed:
+        assert key in comparison.keys()
         assert all(comparison[key]["wavelengths"].value == constructed[key]["wavelengths"].value)
         assert all(comparison[key]["fluxes"].value == constructed[key]["fluxes"].value)
         assert comparison[key]["wavelengths"].unit == constructed[key]["wavelengths"].unit
@@ -102,8 +106,9 @@ def test_manual_plus_file_inputs():
                                         output_filename=output_hdf5)
     comparison = hdf5.open(os.path.join(TEST_DATA_DIR, 'output_spec_from_file_plus_manual_input.hdf5'))
     constructed = hdf5.open(output_hdf5)
-    for key in comparison:
-        assert key in constructed.keys()
+    assert sorted(constructed.keys()) == [3, 4, 7]
+    for key in constructed:
+        assert key in comparison.keys()
         assert all(comparison[key]["wavelengths"].value == constructed[key]["wavelengths"].value)
         assert all(comparison[key]["fluxes"].value == constructed[key]["fluxes"].value)
         assert comparison[key]["wavelengths"].unit == constructed[key]["wavelengths"].unit
@@ -194,4 +199,94 @@ def test_multiple_ascii_catalogs():
         outbase = cat_base + '_with_flambda.cat'
         flambda_output_catalog = os.path.join(TEST_DATA_DIR, outbase)
         os.remove(flambda_output_catalog)
-    os.remove(sed_catalog)
\ No newline at end of file
+    os.remove(sed_catalog)
+
+
+def test_create_spectra_array():
+    """Test that all spectra are built together for the flat-spectrum
+    and multi-filter cases"""
+    params = {'nircam_f200w_magnitude': (None, None, None, 2. * u.micron),
+              'nircam_f444w_magnitude': (None, None, None, 4. * u.micron)}
+
+    # Single filter: flat spectra
+    catalog = Table([[1, 2], [1e-18, 2e-18]], names=('index', 'nircam_f200w_flam'))
+    indexes, waves, fluxes = spec.create_spectra_array(catalog, params)
+    assert np.all(indexes == [1, 2])
+    assert np.allclose(waves, [2., 2.01, 5.15])
+    assert fluxes.shape == (2, 3)
+    assert np.allclose(fluxes[0], 1e-18, rtol=0, atol=1e-30)
+    assert np.allclose(fluxes[1], 2e-18, rtol=0, atol=1e-30)
+
+    # Two filters: linear interpolation, clipped at zero
+    catalog = Table([[1, 2], [1e-18, 1e-18], [2e-18, 0.]],
+                    names=('index', 'nircam_f444w_flam', 'nircam_f200w_flam'))
+    indexes, waves, fluxes = spec.create_spectra_array(catalog, params)
+    assert np.allclose(waves, [2., 4., 5.15])
+    assert np.allclose(fluxes[0], [2e-18, 1e-18, 0.425e-18], rtol=0, atol=1e-30)
+    assert np.allclose(fluxes[1], [0., 1e-18, 1.575e-18], rtol=0, atol=1e-30)
+
+    spectra = spec.create_spectra(catalog, params)
+    assert list(spectra.keys()) == [1, 2]
+    assert spectra[2]['fluxes'].unit == FLAMBDA_CGS_UNITS
+    assert np.allclose(spectra[2]['fluxes'].value, fluxes[1], rtol=0, atol=1e-30)
+
+
+def test_zeropoint_cache():
+    """Test that zeropoint tables are parsed once and can be invalidated"""
+    spec.clear_zeropoint_cache()
+    entry = spec.get_zeropoint_entry('nircam', 'F444W', module='B')
+    assert entry['PHOTFLAM'] == 6.6928e-22
+    assert len(spec._ZEROPOINT_CACHE) == 1
+
+    # Repeated lookups do not re-read the table
+    assert spec.get_zeropoint_entry('nircam', 'f444w', module='b') is entry
+
+    spec.clear_zeropoint_cache('nircam')
+    assert len(spec._ZEROPOINT_CACHE) == 0
+
+
+def test_lazy_hdf5_catalog():
+    """Test that spectra read on demand match those read up front"""
+    sed_file = os.path.join(TEST_DATA_DIR, 'sed_file_with_normalized_dataset.hdf5')
+    full = hdf5.open(sed_file)
+    with hdf5.open(sed_file, lazy=True) as lazy:
+        assert sorted(lazy.keys()) == sorted(full.keys())
+        for key in full:
+            assert all(lazy[key]['wavelengths'] == full[key]['wavelengths'])
+            assert all(lazy[key]['fluxes'] == full[key]['fluxes'])
+        subset = lazy.subset([list(full.keys())[0], 999999])
+        assert list(subset.keys()) == [list(full.keys())[0]]
+
+        # Chunked, compressed writes round-trip
+        output_file = os.path.join(TEST_DATA_DIR, 'chunked_spectra.hdf5')
+        hdf5.save(lazy, output_file, chunk_size=2)
+    rewritten = hdf5.open(output_file)
+    for key in full:
+        assert np.allclose(rewritten[key]['fluxes'].value, full[key]['fluxes'].value)
+    os.remove(output_file)
+
+
+def test_input_spectra_file_reads_catalog_sources(monkeypatch):
+    """Test that only the spectra of sources in the catalog are read from
+    an input hdf5 file"""
+    read_keys = []
+    read_dataset = hdf5._read_dataset
+
+    def recording_read_dataset(dataset, key):
+        read_keys.append(key)
+        return read_dataset(dataset, key)
+
+    monkeypatch.setattr(hdf5, '_read_dataset', recording_read_dataset)
+
+    catfile = os.path.join(TEST_DATA_DIR, 'point_sources.cat')
+    sed_file = os.path.join(TEST_DATA_DIR, 'sed_file_with_normalized_dataset.hdf5')
+    output_hdf5 = os.path.join(TEST_DATA_DIR, 'all_spectra.hdf5')
+    sed_catalog = spec.make_all_spectra(catfile, input_spectra_file=sed_file,
+                                        normalizing_mag_column='nircam_f444w_magnitude',
+                                        output_filename=output_hdf5)
+
+    # Source 4 is the only source in both the catalog and the file
+    assert read_keys == ['4']
+
+    os.remove(os.path.join(TEST_DATA_DIR, 'point_sources_with_flambda.cat'))
+    os.remove(sed_catalog)
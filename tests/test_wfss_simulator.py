@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+"""Test the parallel and cached steps of the WFSS simulator
+
+Authors
+-------
+    - Bryan Hilbert
+
+Use
+---
+    >>> pytest -s test_wfss_simulator.py
+"""
+
+import os
+from types import SimpleNamespace
+
+from astropy.io import fits
+import numpy as np
+
+from mirage import wfss_simulator
+
+# Value added by the stand-in disperser when a background is requested
+BACKGROUND_LEVEL = 1000.
+
+
+def fake_catalog_seed(task):
+    """Stand-in for the creation of a seed image, recording the process
+    that created it"""
+    paramfile, offline = task
+    return SimpleNamespace(seed_file=paramfile.replace('.yaml', '_seed_image.fits'), pid=os.getpid())
+
+
+def fake_disperse_sources(task):
+    """Stand-in for the disperser, returning the sum of the seed images
+    plus a constant background if one is requested"""
+    seed_files, background_file = task[0:2]
+    dispersed = np.sum([fits.getdata(seed_file, 'DATA') for seed_file in seed_files], axis=0)
+    if background_file is not False:
+        dispersed += BACKGROUND_LEVEL
+    return dispersed
+
+
+def make_seed_files(directory, number_of_files=2):
+    """Create direct seed images sharing a segmentation map of five
+    sources of different sizes"""
+    segmap = np.zeros((40, 40), dtype=int)
+    for source, size in zip(range(1, 6), [10, 2, 6, 4, 8]):
+        segmap[source * 6:source * 6 + size, 2:2 + size] = source
+    seed_files = []
+    for i in range(number_of_files):
+        data = (segmap > 0) * np.random.RandomState(i).uniform(1., 2., segmap.shape)
+        seed_file = os.path.join(directory, 'seed{}.fits'.format(i))
+        fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data, name='DATA'),
+                      fits.ImageHDU(segmap, name='SEGMAP')]).writeto(seed_file)
+        seed_files.append(seed_file)
+    return seed_files
+
+
+def make_simulator(**kwargs):
+    """Create a WFSSSim instance with the given attributes, without
+    reading any yaml files"""
+    sim = wfss_simulator.WFSSSim.__new__(wfss_simulator.WFSSSim)
+    attributes = {'offline': True, 'processes': 1, 'dispersed_seed_cache_dir': None,
+                  'source_stamps_file': None, 'SED_file': None, 'crossing_filter': 'F444W',
+                  'instrument': 'nircam', 'extrapolate_SED': True}
+    attributes.update(kwargs)
+    for key, value in attributes.items():
+        setattr(sim, key, value)
+    return sim
+
+
+def test_create_seed_images_in_parallel(monkeypatch):
+    """Seed images created in a pool of processes are returned in the
+    same order as those created serially"""
+    monkeypatch.setattr(wfss_simulator, '_create_catalog_seed', fake_catalog_seed)
+    paramfiles = ['obs{}.yaml'.format(i) for i in range(6)]
+
+    serial = make_simulator(processes=1).create_seed_images(paramfiles)
+    parallel = make_simulator(processes=3).create_seed_images(paramfiles)
+    assert [seed.seed_file for seed in parallel] == [seed.seed_file for seed in serial]
+    assert set(seed.pid for seed in serial) == {os.getpid()}
+    assert os.getpid() not in set(seed.pid for seed in parallel)
+
+
+def test_partition_seed_files(tmpdir):
+    """Partitions contain disjoint sets of sources that together cover all
+    of the sources in the seed images"""
+    seed_files = make_seed_files(str(tmpdir))
+    partition_files = wfss_simulator.partition_seed_files(seed_files, 3)
+    assert len(partition_files) == 3
+
+    partition_sources = []
+    for files in partition_files:
+        segmap = fits.getdata(files[0], 'SEGMAP')
+        partition_sources.append(set(np.unique(segmap[segmap > 0])))
+        for seed_file in files[1:]:
+            assert np.all(fits.getdata(seed_file, 'SEGMAP') == segmap)
+    for i, sources in enumerate(partition_sources):
+        for other in partition_sources[i + 1:]:
+            assert sources.isdisjoint(other)
+    assert set.union(*partition_sources) == {1, 2, 3, 4, 5}
+
+    # The partitioned seed images add up to the original seed images
+    for i, seed_file in enumerate(seed_files):
+        total = np.sum([fits.getdata(files[i], 'DATA') for files in partition_files], axis=0)
+        assert np.allclose(total, fits.getdata(seed_file, 'DATA'))
+
+
+def test_disperse_sources_in_parallel(tmpdir, monkeypatch):
+    """Dispersing the sources in partitions gives the same image as
+    dispersing them together, with the background added exactly once"""
+    monkeypatch.setattr(wfss_simulator, '_disperse_sources', fake_disperse_sources)
+    seed_files = make_seed_files(str(tmpdir))
+    expected = np.sum([fits.getdata(seed_file, 'DATA') for seed_file in seed_files], axis=0) + BACKGROUND_LEVEL
+
+    serial = make_simulator(processes=1).disperse_sources(seed_files, 'modA_R', str(tmpdir), 'back.fits')
+    parallel = make_simulator(processes=3).disperse_sources(seed_files, 'modA_R', str(tmpdir), 'back.fits')
+    assert np.allclose(serial, expected)
+    assert np.allclose(parallel, expected)
+
+    # Partitioned seed images are removed once they are dispersed
+    assert sorted(os.listdir(str(tmpdir))) == ['seed0.fits', 'seed1.fits']
+
+
+def test_dispersion_fingerprint(tmpdir):
+    """The fingerprint depends on the seed image data and dispersion
+    settings, but not on the seed image headers"""
+    seed_files = make_seed_files(str(tmpdir.mkdir('seeds')))
+    config_path = str(tmpdir.mkdir('config'))
+    args = (None, config_path, 'F444W', 'modA_R', 'nircam', True, 'back.fits', None)
+    fingerprint = wfss_simulator.dispersion_fingerprint(seed_files, *args)
+    assert wfss_simulator.dispersion_fingerprint(seed_files, *args) == fingerprint
+
+    fits.setval(seed_files[0], 'DATE', value='2020-01-01', ext=1)
+    assert wfss_simulator.dispersion_fingerprint(seed_files, *args) == fingerprint
+
+    changed_args = (None, config_path, 'F444W', 'modA_C', 'nircam', True, 'back.fits', None)
+    assert wfss_simulator.dispersion_fingerprint(seed_files, *changed_args) != fingerprint
+
+    with fits.open(seed_files[1], mode='update') as hdulist:
+        hdulist['DATA'].data[10, 5] += 1.
+    assert wfss_simulator.dispersion_fingerprint(seed_files, *args) != fingerprint
+
+
+def test_dispersed_seed_cache(tmpdir):
+    """A dispersed seed image is reused when the inputs match, and
+    recreated when they change"""
+    seed_files = make_seed_files(str(tmpdir.mkdir('seeds')))
+    config_path = str(tmpdir.mkdir('config'))
+    sim = make_simulator(dispersed_seed_cache_dir=os.path.join(str(tmpdir), 'cache'))
+    calls = []
+
+    def counting_disperse_sources(seed_files, dmode, config_path, background_file, orders=None):
+        calls.append(dmode)
+        return fake_disperse_sources((seed_files, background_file))
+
+    sim.disperse_sources = counting_disperse_sources
+
+    first = sim.disperse(seed_files, 'modA_R', config_path, 'back.fits')
+    second = sim.disperse(seed_files, 'modA_R', config_path, 'back.fits')
+    assert calls == ['modA_R']
+    assert np.all(second == first)
+    assert len(os.listdir(sim.dispersed_seed_cache_dir)) == 1
+
+    sim.disperse(seed_files, 'modA_C', config_path, 'back.fits')
+    assert calls == ['modA_R', 'modA_C']
+    assert len(os.listdir(sim.dispersed_seed_cache_dir)) == 2